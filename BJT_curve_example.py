@@ -1,6 +1,14 @@
-import pyvisa
-import time
 import matplotlib.pyplot as plt
+from instruments import resource_manager
+from async_instruments import reset_all
+from settle import wait_for_settle
+from list_sweep import run_list_sweep
+from measurement import DmmMeasurement, AdaptiveSampler
+from result_store import resume_results, read_results
+from bjt_analysis import bjt_curves, extract_bjt_parameters
+from limit_test import LimitTest, bjt_limit_masks, in_current_limit
+from shadow import shadow
+from batch import CommandBatcher
 
 # Replace these with your actual instrument addresses
 psu_resource_name = 'USB0::0x0957::0x1A07::MY53202914::INSTR'   
@@ -8,22 +16,27 @@ dmm_resource_name = 'USB0::0x0957::0x1A07::MY53202914::INSTR'
 smu_resource_name = 'USB0::0x0957::0x1A07::MY53202914::INSTR'
 
 # Create resource manager and connect to instruments
-rm = pyvisa.ResourceManager()
+rm = resource_manager()
 
 # Connect to power supply
 psu = rm.open_resource(psu_resource_name)
 psu.timeout = 5000  # timeout in milliseconds
-psu.write('*RST')   # reset the device to bring it to a known state
 
 # Connect to digital multimeter
 dmm = rm.open_resource(dmm_resource_name)
 dmm.timeout = 5000  # timeout in milliseconds
-dmm.write('*RST')   # reset the device to bring it to a known state
 
 # Connect to source measure unit
 smu = rm.open_resource(smu_resource_name)
 smu.timeout = 5000  # timeout in milliseconds
-smu.write('*RST')   # reset the device to bring it to a known state
+
+# Reset all devices in parallel to bring them to a known state
+# (an address shared by several roles is only reset once)
+reset_all(psu, dmm, smu)
+
+# Skip writes that would not change a setting (e.g. the collector current
+# limit, which is sent again for every base current)
+psu, dmm, smu = shadow(psu, dmm, smu)
 
 
 # Test parameters for output curves
@@ -36,10 +49,61 @@ v_be = 0.7
 ib_values_microamps = [0, 10, 50, 100]  
 collector_current_limit = 0.500  # Collector current limit (500mA)
 
+# How each VCE sweep is measured:
+#   'point'   - set and measure one VCE point at a time
+#   'grouped' - measure every point for VCE, then every point for IC, so the DMM
+#               only switches function twice per curve
+#   'list'    - hardware list-mode sweep (needs the PSU trigger out wired to the DMM Ext Trig)
+sweep_mode = 'point'
+# DMM ranges (V, A): a fixed range, 'AUTO', or 'PREDICT' to pick a fixed range
+# from the previous readings (IC spans several decades across the base currents)
+dmm_voltage_range = 'PREDICT'
+dmm_current_range = 'PREDICT'
+dmm_preset = 'balanced'  # 'fast', 'balanced' or 'precise' (see measurement.py)
+# Point mode: average IC at each point until its standard error is within
+# ic_tolerance + ic_rel_tolerance * |IC|, using at most averaging_max_samples
+# readings. Quiet points take a single reading; the mean, standard deviation
+# (NaN for a single reading) and number of readings are stored.
+averaging = True
+ic_tolerance = 1e-9        # A
+ic_rel_tolerance = 1e-3
+averaging_max_samples = 32
+# Limit test: each curve stops as soon as it has passed or failed, and the
+# sweep moves on to the next base current. A curve fails if IC / IB at
+# limit_vce is outside beta_limits (IC above leakage_limit for IB = 0), or if
+# the collector supply goes into current limit first (point mode), and passes
+# once limit_vce has been checked.
+limit_test = False
+limit_vce = 5.0
+beta_limits = (100, 300)
+leakage_limit = 1e-6       # A
+list_dwell = 0.05          # Time spent at each VCE point (s)
+list_trigger_delay = 0.02  # DMM delay after each trigger before reading (s)
+list_binary = True         # Read the list buffer back as float64 blocks instead of ASCII
+results_dir = 'bjt_results'  # Raw points are streamed here as they are measured
+# An interrupted run with the same settings is resumed from its last measured
+# point when the script is started again
+
 # Create dictionaries to store our measurement curves
 ic_curves = {}  # Will store current curves for different IB values
 vce_actual = {}  # Will store actual measured VCE values
 
+# Configure each DMM function once and use READ? for every reading after that
+meter = DmmMeasurement(dmm, preset=dmm_preset,
+                       ranges={'VOLT': dmm_voltage_range, 'CURR': dmm_current_range})
+sampler = AdaptiveSampler(meter, {'CURR': ic_tolerance}, ic_rel_tolerance, max_samples=averaging_max_samples)
+
+config = {'resources': [psu_resource_name, dmm_resource_name, smu_resource_name],
+          'ib_values_microamps': ib_values_microamps, 'vce': [vce_start, vce_end, vce_step],
+          'v_be': v_be, 'collector_current_limit': collector_current_limit, 'sweep_mode': sweep_mode,
+          'dmm_ranges': [dmm_voltage_range, dmm_current_range], 'dmm_preset': dmm_preset,
+          'averaging': [averaging, ic_tolerance, ic_rel_tolerance, averaging_max_samples],
+          'limit_test': [limit_test, limit_vce, beta_limits, leakage_limit]}
+results, done = resume_results(results_dir, ['ib_microamps', 'vce_set', 'vce', 'ic', 'ic_std', 'ic_n'], config)
+if len(done['ic']):
+    print(f"Resuming the interrupted run in '{results_dir}' ({len(done['ic'])} points already measured)")
+verdicts = results.metadata.get('verdicts', {})   # limit test outcome by base current
+
 try:
 
     print("Measuring BJT output characteristic curves...")
@@ -47,14 +111,16 @@ try:
     print("for different base current values")
     print("-----------------------------------------------------------------------")
 
-    # Enable both channels
-    smu.write("SOUR:CURR:LEV:IMM:AMP 0.0") # Set the smu to 0 current output
-    smu.write("SOUR:VOLT:LEV:IMM:AMP 0.0") # Set the smu to 0 voltage output
-    smu.write("OUTP:STAT ON") # Turn on the smu
+    # Enable both channels (one message per instrument)
+    with CommandBatcher(smu) as commands:
+        commands.write("SOUR:CURR:LEV:IMM:AMP 0.0") # Set the smu to 0 current output
+        commands.write("SOUR:VOLT:LEV:IMM:AMP 0.0") # Set the smu to 0 voltage output
+        commands.write("OUTP:STAT ON") # Turn on the smu
 
-    psu.write("SOUR:CURR:LEV:IMM:AMP 0.0 @1") # Set the channel 1 of the psu to 0 current output
-    psu.write("SOUR:VOLT:LEV:IMM:AMP 0.0 @1") # Set the channel 1 of the psu to 0 voltage output
-    psu.write("OUTP:STAT ON @1") # Turn on channel 1 of the psu    
+    with CommandBatcher(psu) as commands:
+        commands.write("SOUR:CURR:LEV:IMM:AMP 0.0 @1") # Set the channel 1 of the psu to 0 current output
+        commands.write("SOUR:VOLT:LEV:IMM:AMP 0.0 @1") # Set the channel 1 of the psu to 0 voltage output
+        commands.write("OUTP:STAT ON @1") # Turn on channel 1 of the psu    
 
     # Generate the list of VCE values to test
     vce_test_values = []
@@ -80,30 +146,49 @@ try:
         # Convert microamps to amps for the power supply
         ib_amps = ib_microamps * 1E-6 
         
-        # Lists to store collector currents and actual VCE for this base current
-        ic_currents = []
-        vce_voltages = []
+        # Lists to store collector currents and actual VCE for this base current,
+        # starting from the points an interrupted run already measured
+        measured = done['ib_microamps'] == ib_microamps
+        ic_currents = done['ic'][measured].tolist()
+        vce_voltages = done['vce'][measured].tolist()
+        remaining_vce = vce_test_values[len(ic_currents):]
+        if str(ib_microamps) in verdicts:
+            remaining_vce = []   # already decided by the limit test
         
         print(f"\nMeasuring curve for IB = {ib_microamps}µA")
+        if not remaining_vce:
+            print("Already measured in the interrupted run")
+            ic_curves[ib_microamps] = ic_currents
+            vce_actual[ib_microamps] = vce_voltages
+            continue
         
         # Section 2
-        # Set up the base current
+        # Set up the base current, and wait (*OPC?) until the SMU has applied it
+        # instead of sleeping between curves
+        base = CommandBatcher(smu)
         if ib_microamps == 0:
             # For IB=0, just set base to 0V
             # INSERT YOUR CODE HERE
             ###############################################################
-            smu.write("SOUR:VOLT:LEV:IMM:AMP 0.0") # Set the smu to 0 voltage output
+            base.write("SOUR:VOLT:LEV:IMM:AMP 0.0") # Set the smu to 0 voltage output
             ###############################################################
         else:
             # For non-zero IB, set VBE to about 0.7V and limit current to desired IB
             # INSERT YOUR CODE HERE
             ###############################################################
-            smu.write(f"SOUR:VOLT:LEV:IMM:AMP {v_be}") # Set the smu to desired base-emitter voltage
-            smu.write(f"SOUR:VOLT:LEV:IMM:AMP {ib_amps}") # Set the smu to desired current
+            base.write(f"SOUR:VOLT:LEV:IMM:AMP {v_be}") # Set the smu to desired base-emitter voltage
+            base.write(f"SOUR:CURR:LEV:IMM:AMP {ib_amps}") # Set the smu to desired current
             ###############################################################
+        base.sync()
 
         # Set up channel 2 for collector
         psu.write(f"SOUR:CURR:LEV:IMM:AMP {collector_current_limit} @1")
+
+        # Pass/fail masks for this curve, checked against the points measured so far
+        if limit_test:
+            test = LimitTest(bjt_limit_masks(ib_amps, vce_test_values, limit_vce, beta_limits, leakage_limit))
+            for index, collector_current in enumerate(ic_currents):
+                test.check(index, collector_current)
         
         # Section 3
         # Sweep through VCE values
@@ -111,49 +196,99 @@ try:
         # You will need to apply the new collector-emitter voltage, and measure the collector current, 
         # as well as collector emitter voltage.
         # The measured data will need to be stored in a list called ic_currents, and vce_voltages.
-        for vce in vce_test_values:
-            # Set collector-emitter voltage
-            ###############################################################
-            psu.write(f"SOUR:VOLT:LEV:IMM:AMP {vce} @1") # Set the channel 1 of the psu to 0 current output
-            ###############################################################
-            
-            # Wait for measurement to settle
-            ###############################################################
-            time.sleep(0.5)   
-            ###############################################################
+        if sweep_mode == 'list':
+            # Let the supply step through the whole VCE list in hardware and read
+            # back the buffered DMM readings, once per DMM function
+            new_vce = run_list_sweep(psu, dmm, remaining_vce, 'VOLT', list_dwell, collector_current_limit,
+                                     trigger_delay=list_trigger_delay, nplc=meter.nplc, binary=list_binary)
+            new_ic = run_list_sweep(psu, dmm, remaining_vce, 'CURR', list_dwell, collector_current_limit,
+                                    trigger_delay=list_trigger_delay, nplc=meter.nplc, binary=list_binary)
+            results.extend(ib_microamps=[ib_microamps] * len(remaining_vce), vce_set=remaining_vce,
+                           vce=new_vce, ic=new_ic, ic_std=[float('nan')] * len(remaining_vce),
+                           ic_n=[1] * len(remaining_vce))
+            vce_voltages.extend(new_vce)
+            ic_currents.extend(new_ic)
+            for vce, actual_vce, collector_current in zip(vce_test_values, vce_voltages, ic_currents):
+                print(f"Set VCE = {vce:.1f}V, Measured VCE = {actual_vce:.3f}V, IC = {collector_current:.2f}mA")
+        elif sweep_mode == 'grouped':
+            # All VCE readings first, then all IC readings, to minimize function switches
+            def set_vce(vce):
+                psu.write(f"SOUR:VOLT:LEV:IMM:AMP {vce} @1")
+            grouped = meter.sweep_grouped(remaining_vce, set_vce, ('VOLT', 'CURR'),
+                                          settle=lambda read: wait_for_settle(read, tolerance=1e-3, timeout=0.5))
+            results.extend(ib_microamps=[ib_microamps] * len(remaining_vce), vce_set=remaining_vce,
+                           vce=grouped['VOLT'], ic=grouped['CURR'], ic_std=[float('nan')] * len(remaining_vce),
+                           ic_n=[1] * len(remaining_vce))
+            vce_voltages.extend(grouped['VOLT'])
+            ic_currents.extend(grouped['CURR'])
+            for vce, actual_vce, collector_current in zip(vce_test_values, vce_voltages, ic_currents):
+                print(f"Set VCE = {vce:.1f}V, Measured VCE = {actual_vce:.3f}V, IC = {collector_current:.2f}mA")
+        else:
+            for vce in remaining_vce:
+                # Set collector-emitter voltage
+                ###############################################################
+                psu.write(f"SOUR:VOLT:LEV:IMM:AMP {vce} @1") # Set the channel 1 of the psu to 0 current output
+                ###############################################################
             
-            # Measure actual VCE voltage 
-            ###############################################################
-            actual_vce = float(dmm.query('MEAS:VOLT:DC? AUTO'))
-            ###############################################################
+                # Measure actual VCE voltage once it has settled
+                # (polls the DMM instead of a fixed 0.5s sleep)
+                ###############################################################
+                actual_vce = wait_for_settle(lambda: meter.read('VOLT'),
+                                             tolerance=1e-3, timeout=0.5)
+                ###############################################################
             
-            # Append the collector emitter voltage to vce_voltages
-            ###############################################################
-            vce_voltages.append(actual_vce)
-            ###############################################################
+                # Append the collector emitter voltage to vce_voltages
+                ###############################################################
+                vce_voltages.append(actual_vce)
+                ###############################################################
 
-            # Measure collector current 
-            ###############################################################
-            collector_current = float(dmm.query('MEAS:CURR:DC? AUTO'))
-            ###############################################################
+                # Measure collector current (averaged as much as its noise needs)
+                ###############################################################
+                if averaging:
+                    collector_current, ic_std, ic_n = sampler.sample('CURR')
+                else:
+                    collector_current, ic_std, ic_n = meter.read('CURR'), float('nan'), 1
+                ###############################################################
             
-            # Append the collector current to ic_currents
-            ###############################################################
-            ic_currents.append(collector_current)
-            ###############################################################
+                # Append the collector current to ic_currents
+                ###############################################################
+                ic_currents.append(collector_current)
+                results.append(ib_microamps=ib_microamps, vce_set=vce, vce=actual_vce, ic=collector_current,
+                               ic_std=ic_std, ic_n=ic_n)
+                ###############################################################
             
-            # Print all of this information for debugging!
-            print(f"Set VCE = {vce:.1f}V, Measured VCE = {actual_vce:.3f}V, IC = {collector_current:.2f}mA")
+                # Print all of this information for debugging!
+                print(f"Set VCE = {vce:.1f}V, Measured VCE = {actual_vce:.3f}V, IC = {collector_current:.2f}mA"
+                      f"{f' ({ic_n} readings)' if ic_n > 1 else ''}")
+
+                # Stop this curve as soon as its outcome is decided
+                if limit_test and test.check(len(ic_currents) - 1, collector_current,
+                                             in_current_limit(psu, 1)) is not None:
+                    break
         
+        if limit_test:
+            # List and grouped sweeps cannot stop early; check their points now
+            for index in range(test.points, len(ic_currents)):
+                if test.check(index, ic_currents[index]) is not None:
+                    break
+            verdicts[str(ib_microamps)] = [test.finish(), test.reason]
+            results.update_metadata(verdicts=verdicts)
+            print(f"IB = {ib_microamps}µA: {test.outcome.upper()} ({test.reason})")
+
         # Store these measurements in our dictionaries
         ic_curves[ib_microamps] = ic_currents
         vce_actual[ib_microamps] = vce_voltages
-        # Short delay before data for a new base current is measured
-        time.sleep(0.5)
 
     # Turn off power supply outputs
     smu.write("OUTP:STAT OFF")    # Turn off the smu
     psu.write("OUTP:STAT OFF @1") # Turn off channel 1 of the psu
+    results.update_metadata(complete=True)
+    results.close()
+    if sampler.points:
+        print(f"Averaging: {sampler.readings} IC readings for {sampler.points} points")
+    if limit_test:
+        failed = [ib for ib, (outcome, _) in verdicts.items() if outcome != 'pass']
+        print(f"Limit test: {'FAIL (IB = ' + ', '.join(failed) + ' µA)' if failed else 'PASS'}")
     
     # Plot the results using measured voltage values
     plt.figure(figsize=(12, 8))
@@ -176,18 +311,30 @@ try:
     plt.savefig('bjt_output_characteristics.png', dpi=300)
     plt.show()
 
-    # Close the connections
-    psu.close()
-    dmm.close()
-    smu.close()
+    # Extract the transistor parameters from the stored curves
+    columns, _ = read_results(results_dir)
+    curves = bjt_curves(columns)
+    parameters = extract_bjt_parameters(curves['ib'], curves['vce'], curves['ic'],
+                                        current_limit=collector_current_limit)
+    print("\n  IB (µA)   beta   VA (V)   VCE(sat) (V)   go (µS)")
+    for row, ib_microamps in enumerate(curves['ib_microamps']):
+        print(f"{ib_microamps:9.0f} {parameters['beta'][0, row]:6.1f} {parameters['early_voltage'][0, row]:8.1f} "
+              f"{parameters['vce_sat'][0, row]:14.3f} {parameters['output_conductance'][0, row] * 1e6:9.2f}")
 
     print("\nMeasurement complete!")
     print("Results saved to 'bjt_output_characteristics.png'")
 
 except KeyboardInterrupt:
 
+    results.close()   # keeps every point measured before the interrupt
+    print("\nInterrupted: run the script again to resume from the last measured point")
+
+finally:
+
+    # Never leave the outputs on, whether the run finished, was interrupted or failed
     smu.write("OUTP:STAT OFF")    # Turn off the smu
     psu.write("OUTP:STAT OFF @1") # Turn off channel 1 of the psu
+    results.close()
 
     # Close the connections
     psu.close()
@@ -1,14 +1,24 @@
-import pyvisa
-import time
 import matplotlib.pyplot as plt
 import numpy as np
+from instruments import resource_manager
+from discovery import find_instruments
+from async_instruments import reset_all
+from settle import wait_for_settle
+from list_sweep import run_list_sweep
+from measurement import DmmMeasurement, AdaptiveSampler
+from result_store import ResultWriter
+from iv_analysis import fit_diodes
+from limit_test import LimitTest, limit_masks, in_current_limit
+from shadow import shadow
 
-# Replace these with your actual instrument addresses
-psu_address = 'USB0::0x2A8D::0x1102::MY12345678::INSTR'  # EDU36311A
-dmm_address = 'USB0::0x2A8D::0x1401::MY12345678::INSTR'  # EDU34450A
+# Create resource manager and find the instruments by model (a full resource
+# string also works, e.g. psu='USB0::0x2A8D::0x1102::MY12345678::INSTR')
+rm = resource_manager()
+addresses = find_instruments(rm, psu='EDU36311A', dmm='EDU34450A')
+psu_address = addresses['psu']
+dmm_address = addresses['dmm']
 
-# Create resource manager and connect to instruments
-rm = pyvisa.ResourceManager()
+# Connect to instruments
 psu = rm.open_resource(psu_address)
 dmm = rm.open_resource(dmm_address)
 
@@ -16,9 +26,11 @@ psu.timeout = 5000  # milliseconds
 dmm.timeout = 5000  # milliseconds
 
 
-# Reset instruments
-psu.write('*RST')
-dmm.write('*RST')
+# Reset instruments (in parallel)
+reset_all(psu, dmm)
+
+# Skip writes that would not change a setting (e.g. OUTPut 1 at every point)
+psu, dmm = shadow(psu, dmm)
 
 # Data storage
 currents_dmm = []
@@ -29,29 +41,114 @@ current_limit = 0.5  # Amps
 final_voltage = 5.0  # Volts
 voltage_step = 0.2   # Volts
 
+# Sweep mode: 'point' measures one voltage at a time, 'grouped' measures every
+# point for current and then every point for voltage (two DMM function switches
+# per sweep), 'list' runs a hardware list-mode sweep (needs the PSU trigger out
+# wired to the DMM Ext Trig)
+sweep_mode = 'point'
+# DMM ranges (A, V): a fixed range, 'AUTO', or 'PREDICT' to pick a fixed range
+# from the previous readings (the diode current spans several decades)
+dmm_ranges = {'CURR': 'PREDICT', 'VOLT': 'PREDICT'}
+dmm_preset = 'balanced'    # 'fast', 'balanced' or 'precise' (see measurement.py)
+# Point mode: average the current at each point until its standard error is
+# within current_tolerance + current_rel_tolerance * |I|, using at most
+# averaging_max_samples readings (quiet points take a single reading)
+averaging = True
+current_tolerance = 1e-9   # Amps
+current_rel_tolerance = 1e-3
+averaging_max_samples = 32
+# Limit test (point mode): stop the sweep as soon as the diode has passed or
+# failed. It fails if the current at a test voltage is outside its window, or
+# if the supply reaches current_limit before the last test voltage; it passes
+# once every test voltage has been checked. The diode fit is skipped.
+limit_test = False
+current_windows = {0.6: (None, 1e-4), 1.0: (1e-3, 1e-2)}   # Volts: (min, max Amps)
+list_dwell = 0.05          # Seconds at each voltage
+list_trigger_delay = 0.02  # DMM delay after each trigger (s)
+list_binary = True         # Read the list buffer back as float64 blocks instead of ASCII
+results_dir = 'iv_results'  # Raw points are streamed here as they are measured
+
 # Configure PSU
 psu.write(f'CURRent {current_limit}, (@1)')
 psu.write('VOLTage 0, (@1)')
 
+# Configure each DMM function once and use READ? for every reading after that
+meter = DmmMeasurement(dmm, preset=dmm_preset, ranges=dmm_ranges)
+sampler = AdaptiveSampler(meter, {'CURR': current_tolerance}, current_rel_tolerance,
+                          max_samples=averaging_max_samples)
+
 # Voltage sweep
-for voltage in np.arange(0, final_voltage + voltage_step, voltage_step):
-    voltage = round(voltage, 2)
-    
-    # Set voltage and enable output
-    psu.write(f"VOLTage {voltage}, (@1)")
+sweep_voltages = [round(v, 2) for v in np.arange(0, final_voltage + voltage_step, voltage_step)]
+results = ResultWriter(results_dir, ['set_voltage', 'voltage', 'current', 'current_std', 'current_n'],
+                       metadata={'sweep_mode': sweep_mode, 'current_limit': current_limit})
+if limit_test:
+    test = LimitTest(limit_masks(sweep_voltages, current_windows))
+
+if sweep_mode == 'list':
+    # Run the whole list in hardware and read the DMM buffer back once per function
+    currents_dmm = run_list_sweep(psu, dmm, sweep_voltages, 'CURR', list_dwell, current_limit,
+                                  trigger_delay=list_trigger_delay, nplc=meter.nplc, binary=list_binary)
+    voltages_dmm = run_list_sweep(psu, dmm, sweep_voltages, 'VOLT', list_dwell, current_limit,
+                                  trigger_delay=list_trigger_delay, nplc=meter.nplc, binary=list_binary)
+    results.extend(set_voltage=sweep_voltages, voltage=voltages_dmm, current=currents_dmm,
+                   current_std=[np.nan] * len(sweep_voltages), current_n=[1] * len(sweep_voltages))
+    for voltage, current in zip(sweep_voltages, currents_dmm):
+        print(f"V={voltage}V, I={current:.4f}A")
+elif sweep_mode == 'grouped':
+    def set_voltage(voltage):
+        psu.write(f"VOLTage {voltage}, (@1)")
     psu.write('OUTPut 1, (@1)')
-    
-    # Wait for measurement to settle
-    time.sleep(0.75)
-    
-    # Measure with DMM
-    currents_dmm.append(float(dmm.query("MEAS:CURR:DC?")))
-    voltages_dmm.append(float(dmm.query("MEAS:VOLT:DC?")))
-    
-    print(f"V={voltage}V, I={currents_dmm[-1]:.4f}A")
+    grouped = meter.sweep_grouped(sweep_voltages, set_voltage, ('CURR', 'VOLT'),
+                                  settle=lambda read: wait_for_settle(read, tolerance=1e-5, timeout=0.75))
+    currents_dmm = grouped['CURR']
+    voltages_dmm = grouped['VOLT']
+    results.extend(set_voltage=sweep_voltages, voltage=voltages_dmm, current=currents_dmm,
+                   current_std=[np.nan] * len(sweep_voltages), current_n=[1] * len(sweep_voltages))
+    for voltage, current in zip(sweep_voltages, currents_dmm):
+        print(f"V={voltage}V, I={current:.4f}A")
+else:
+    for index, voltage in enumerate(sweep_voltages):
+        # Set voltage and enable output
+        psu.write(f"VOLTage {voltage}, (@1)")
+        psu.write('OUTPut 1, (@1)')
+        
+        # Measure with DMM once the current has settled, averaging the current
+        # as much as its noise needs (the settled reading is the first sample)
+        current = wait_for_settle(lambda: meter.read('CURR'), tolerance=1e-5, timeout=0.75)
+        current_std, current_n = np.nan, 1
+        if averaging:
+            current, current_std, current_n = sampler.sample('CURR', [current])
+        currents_dmm.append(current)
+        voltages_dmm.append(meter.read('VOLT'))
+        results.append(set_voltage=voltage, voltage=voltages_dmm[-1], current=current,
+                       current_std=current_std, current_n=current_n)
+        
+        print(f"V={voltage}V, I={current:.4f}A" + (f" ({current_n} readings)" if current_n > 1 else ""))
+
+        # Stop as soon as the outcome is decided
+        if limit_test and test.check(index, current, in_current_limit(psu, 1)) is not None:
+            break
 
 # Turn off output
 psu.write('OUTPut 0, (@1)')
+if limit_test:
+    if sweep_mode != 'point':
+        # List and grouped sweeps cannot stop early; check the whole sweep afterwards
+        for index, current in enumerate(currents_dmm):
+            if test.check(index, current) is not None:
+                break
+    test.finish()
+    results.update_metadata(outcome=test.outcome, reason=test.reason)
+    print(f"{test.outcome.upper()}: {test.reason} (decided after {test.points} of {len(sweep_voltages)} points)")
+results.close()
+if sampler.points:
+    print(f"Averaging: {sampler.readings} current readings for {sampler.points} points")
+
+# Fit the diode model (Is, n, Rs) to the measured curve
+if not limit_test:
+    fit = fit_diodes(voltages_dmm, currents_dmm, current_limit=current_limit)
+    print(f"Is = {fit['saturation_current']:.3g} A, n = {fit['ideality']:.3f}, Rs = {fit['series_resistance']:.3f} ohm "
+          f"({fit['points']} points, {fit['point_outliers'].sum()} outliers, rms error {fit['rms_error'] * 1e3:.2f} mV)")
 
 # Plot results
 plt.figure(figsize=(12, 5))
@@ -1,25 +1,35 @@
-import pyvisa
-import time
 import matplotlib.pyplot as plt
 import numpy as np
+from instruments import resource_manager
+from discovery import find_instruments
+from async_instruments import reset_all
+from settle import wait_for_settle
+from measurement import DmmMeasurement
+from result_store import ResultWriter
+from iv_analysis import fit_diodes
 
 # THIS IS AN EXAMPLE OF THE POPULATED CODE BASE FOR IV_curve_template.py
 # This example uses a Rigol DP832 for a power supply, and an Agilent 34461A for a multimeter
 
-# Replace these with your actual instrument addresses
-psu_resource_name = 'USB0::0x1AB1::0x0E11::DP8C172001883::INSTR' 
-dmm_resource_name = 'USB0::0x0957::0x1A07::MY53202914::INSTR'  
+# Create resource manager and find the instruments by model (a full resource
+# string also works, e.g. psu='USB0::0x1AB1::0x0E11::DP8C172001883::INSTR')
+rm = resource_manager()
+resource_names = find_instruments(rm, psu='DP832', dmm='34461A')
+psu_resource_name = resource_names['psu']
+dmm_resource_name = resource_names['dmm']
 
-# Create resource manager and connect to instruments
-rm = pyvisa.ResourceManager()
+# Connect to instruments
 
 psu = rm.open_resource(psu_resource_name)
 psu.timeout = 5000  # timeout in milliseconds
-psu.write('*RST')   # reset the device to bring it to a known state
 
 dmm = rm.open_resource(dmm_resource_name)
 dmm.timeout = 5000  # timeout in milliseconds
-dmm.write('*RST')   # reset the device to bring it to a known state
+
+reset_all(psu, dmm)   # reset both devices in parallel to bring them to a known state
+
+# Configure each DMM function once (fixed ranges) and use READ? for every reading
+meter = DmmMeasurement(dmm, nplc=1, ranges={'VOLT': 10, 'CURR': 1})
 
 # Data storage
 measured_currents_list = []
@@ -30,6 +40,10 @@ current_limit = 0.5  # Amps
 final_voltage = 5  # Volts
 voltage_step = 0.2   # Volts
 
+# Every point is also streamed to disk as it is measured (see result_store.py)
+results = ResultWriter('iv_example_results', ['set_voltage', 'voltage', 'current'],
+                       metadata={'current_limit': current_limit})
+
 # Pre-Sweep setup
 # This code needs to do the following:
 #   Set the intial voltage and the current limit
@@ -57,15 +71,16 @@ for voltage in np.arange(0, final_voltage + voltage_step, voltage_step):
     psu.write(f"SOUR1:VOLT:LEV:IMM:AMPL {voltage}") #Set the voltage 
 
 
-    measured_voltage = -1 * float(dmm.query('MEAS:VOLT:DC? AUTO')) #measure and record voltage
-    measured_current = float(dmm.query('MEAS:CURR:DC? AUTO')) #measure and record current
+    # Wait for the voltage to settle, then measure and record voltage and current
+    measured_voltage = -1 * wait_for_settle(lambda: meter.read('VOLT'),
+                                            tolerance=1e-3, timeout=0.75)
+    measured_current = meter.read('CURR') #measure and record current
     ###############################################################
-    # Wait for measurement to settle
-    time.sleep(0.75)
     
     # Measure with DMM
     measured_currents_list.append(measured_current)
     measured_voltages_list.append(measured_voltage)
+    results.append(set_voltage=voltage, voltage=measured_voltage, current=measured_current)
     
     print(f"V={voltage}V, I={measured_currents_list[-1]:.4f}A")
 
@@ -74,6 +89,13 @@ for voltage in np.arange(0, final_voltage + voltage_step, voltage_step):
 ###############################################################
 psu.write("OUTP:STAT OFF") #Turn off the PSU
 ###############################################################
+results.close()
+
+# Fit the diode model (Is, n, Rs) to the measured curve (on the forward
+# voltage, which this example records negated)
+fit = fit_diodes(np.abs(measured_voltages_list), measured_currents_list, current_limit=current_limit)
+print(f"Is = {fit['saturation_current']:.3g} A, n = {fit['ideality']:.3f}, Rs = {fit['series_resistance']:.3f} ohm "
+      f"({fit['points']} points, {fit['point_outliers'].sum()} outliers, rms error {fit['rms_error'] * 1e3:.2f} mV)")
 
 # Plot results
 # plt.figure(figsize=(12, 5))
@@ -0,0 +1,67 @@
+import numpy as np
+
+# Adaptive frequency-point refinement
+# Start with a coarse log-spaced grid, then keep refining around whichever
+# point departs the most from a straight line (on log-frequency axes) through
+# its two neighbours, in dB or in phase, until every point is within the
+# thresholds of that line or the point budget is used up. Straight stretches of
+# the response (flat passband, a constant dB/decade roll-off) need no extra
+# points however steep they are; the bends (corners, resonances) get them.
+# Intervals that cross the -3 dB level are refined down to corner_ratio, so
+# the corner frequency ends up well resolved.
+
+
+# Departure of each interior point from log-linear interpolation between its
+# neighbours (NaN at both ends)
+def curvature(log_freqs, values):
+    deviation = np.full(len(values), np.nan)
+    if len(values) > 2:
+        weight = (log_freqs[1:-1] - log_freqs[:-2]) / (log_freqs[2:] - log_freqs[:-2])
+        expected = values[:-2] + weight * (values[2:] - values[:-2])
+        deviation[1:-1] = np.abs(values[1:-1] - expected)
+    return deviation
+
+
+# measure(freq) must return (gain, phase_degrees); use NaN for a failed point,
+# intervals touching a failed point are not refined.
+# Returns sorted numpy arrays (frequencies, gains, phases).
+def adaptive_sweep(measure, start_freq, stop_freq, coarse_points=9, max_points=25,
+                   db_threshold=0.5, phase_threshold=5.0, min_ratio=1.05, corner_ratio=1.25):
+    results = {}
+    for freq in np.logspace(np.log10(start_freq), np.log10(stop_freq), coarse_points):
+        results[freq] = measure(freq)
+
+    while len(results) < max_points:
+        freqs = np.array(sorted(results))
+        gains = np.array([results[f][0] for f in freqs], dtype=float)
+        phases = np.array([results[f][1] for f in freqs], dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            db = 20 * np.log10(gains)
+
+        # How far each point is off the line through its neighbours, in units
+        # of its threshold; an interval scores the worse of its two ends
+        log_freqs = np.log10(freqs)
+        bend = np.fmax(curvature(log_freqs, db) / db_threshold,
+                       curvature(log_freqs, phases) / phase_threshold)
+        score = np.fmax(bend[:-1], bend[1:])
+        valid = np.isfinite(db) & np.isfinite(phases)
+        score[~(valid[:-1] & valid[1:])] = np.nan
+
+        # Intervals crossing the -3 dB point (relative to the peak gain)
+        level = np.nanmax(db) - 3 if np.isfinite(db).any() else np.nan
+        crossing = ((db[:-1] - level) * (db[1:] - level) < 0) & (freqs[1:] / freqs[:-1] > corner_ratio)
+        score = np.where(crossing, np.fmax(score, 2.0), score)
+
+        # Don't split intervals that are already narrow enough
+        score[freqs[1:] / freqs[:-1] < min_ratio] = np.nan
+        if not np.any(score > 1):
+            break
+
+        i = np.nanargmax(score)
+        freq = np.sqrt(freqs[i] * freqs[i + 1])
+        results[freq] = measure(freq)
+
+    freqs = np.array(sorted(results))
+    gains = np.array([results[f][0] for f in freqs], dtype=float)
+    phases = np.array([results[f][1] for f in freqs], dtype=float)
+    return freqs, gains, phases
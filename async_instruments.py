@@ -0,0 +1,100 @@
+import asyncio
+
+# Asyncio session layer
+# pyvisa calls block, so each call runs in a worker thread. Every physical
+# instrument (resource name) has its own asyncio lock: commands to one
+# instrument stay in order, while commands to different instruments overlap.
+# Several handles to the same resource (the BJT example opens one address as
+# psu, dmm and smu) share one lock.
+
+
+class AsyncInstrument:
+    def __init__(self, instrument, lock):
+        self.instrument = instrument
+        self.lock = lock
+
+    # Run a blocking function with exclusive use of this instrument, e.g.
+    # await scope.call(capture_channels, scope.instrument, (1, 2))
+    async def call(self, function, *args, **kwargs):
+        async with self.lock:
+            return await asyncio.to_thread(function, *args, **kwargs)
+
+    async def write(self, message):
+        return await self.call(self.instrument.write, message)
+
+    async def query(self, message):
+        return await self.call(self.instrument.query, message)
+
+    async def query_ascii_values(self, message, **kwargs):
+        return await self.call(self.instrument.query_ascii_values, message, **kwargs)
+
+    async def read_raw(self):
+        return await self.call(self.instrument.read_raw)
+
+    # *RST and wait until the instrument has finished resetting
+    async def reset(self):
+        async with self.lock:
+            await asyncio.to_thread(self.instrument.write, '*RST')
+            return await asyncio.to_thread(self.instrument.query, '*OPC?')
+
+    async def close(self):
+        return await self.call(self.instrument.close)
+
+
+class AsyncSession:
+    def __init__(self, rm=None):
+        self.rm = rm
+        self.locks = {}
+
+    def lock_for(self, resource_name):
+        if resource_name not in self.locks:
+            self.locks[resource_name] = asyncio.Lock()
+        return self.locks[resource_name]
+
+    # Wrap an already opened pyvisa resource
+    def wrap(self, instrument):
+        return AsyncInstrument(instrument, self.lock_for(instrument.resource_name))
+
+    async def open(self, resource_name, timeout=5000):
+        instrument = await asyncio.to_thread(self.rm.open_resource, resource_name)
+        instrument.timeout = timeout
+        return self.wrap(instrument)
+
+    # Open several resources at once, returning them in the same order
+    async def open_all(self, resource_names, timeout=5000):
+        return await asyncio.gather(*(self.open(name, timeout) for name in resource_names))
+
+
+# Reset every instrument concurrently, once per physical instrument
+async def reset_all_async(instruments):
+    unique = {}
+    for instrument in instruments:
+        unique.setdefault(instrument.instrument.resource_name, instrument)
+    await asyncio.gather(*(instrument.reset() for instrument in unique.values()))
+
+
+# Blocking version for the scripts: reset plain pyvisa resources in parallel
+def reset_all(*instruments):
+    async def run():
+        session = AsyncSession()
+        await reset_all_async([session.wrap(instrument) for instrument in instruments])
+    asyncio.run(run())
+
+
+# Point-by-point sweep that overlaps each point's data download with applying
+# the next point, e.g. reading the scope while the wavegen changes frequency.
+# apply, acquire and download are coroutine functions taking the point;
+# download's return values are collected in order.
+async def pipelined_sweep(points, apply, acquire, download):
+    points = list(points)
+    results = []
+    if not points:
+        return results
+    await apply(points[0])
+    for i, point in enumerate(points):
+        await acquire(point)
+        pending = [download(point)]
+        if i + 1 < len(points):
+            pending.append(apply(points[i + 1]))
+        results.append((await asyncio.gather(*pending))[0])
+    return results
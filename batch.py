@@ -0,0 +1,78 @@
+# SCPI command batching
+# Every write is a separate bus transaction, and on USB that costs more than
+# the command itself. CommandBatcher collects consecutive commands for one
+# instrument and sends them as a single ';'-joined message. It sends the
+# message when it would grow past max_length, before a query (the query
+# rides along in the same message), or on flush(). Leaving the with-block
+# flushes too.
+#
+# After a ';' SCPI resolves a header relative to the previous command's path,
+# so every command is sent in its absolute form (leading ':').
+#
+# sync() adds '*OPC?' and waits for the reply. It returns once the instrument
+# has executed everything sent so far, so no blind sleep is needed.
+#
+#   with CommandBatcher(wavegen) as commands:
+#       commands.write(':SOURce1:FUNCtion:SHAPe SIN')
+#       commands.write(':SOURce1:VOLTage:AMPLitude 2.0')
+
+# Longest message sent at once (the input buffers of these instruments are larger)
+MAX_MESSAGE_LENGTH = 512
+
+
+def absolute(command):
+    command = command.strip()
+    return command if command.startswith((':', '*')) else ':' + command
+
+
+class CommandBatcher:
+    # sync=True waits for *OPC? when the with-block ends instead of only flushing
+    def __init__(self, instrument, max_length=MAX_MESSAGE_LENGTH, sync=False):
+        self.instrument = instrument
+        self.max_length = max_length
+        self.sync_on_exit = sync
+        self.pending = []
+
+    # Queue commands, flushing first if the message would get too long
+    def write(self, command):
+        command = absolute(command)
+        if self.pending and len(';'.join(self.pending)) + 1 + len(command) > self.max_length:
+            self.flush()
+        self.pending.append(command)
+
+    def flush(self):
+        if not self.pending:
+            return
+        message = ';'.join(self.pending)
+        self.pending = []
+        self.instrument.write(message)
+
+    # The pending commands and the query go out as one message
+    def take_message(self, command):
+        command = absolute(command)
+        if self.pending and len(';'.join(self.pending)) + 1 + len(command) > self.max_length:
+            self.flush()
+        message = ';'.join(self.pending + [command])
+        self.pending = []
+        return message
+
+    def query(self, command):
+        return self.instrument.query(self.take_message(command))
+
+    def query_ascii_values(self, command, **kwargs):
+        return self.instrument.query_ascii_values(self.take_message(command), **kwargs)
+
+    # Barrier: returns once the instrument has executed every command sent
+    def sync(self):
+        return self.query('*OPC?')
+
+    def __enter__(self):
+        return self
+
+    # Pending commands are sent even if the block failed (they are often the
+    # safe-state commands)
+    def __exit__(self, exc_type, *exc_info):
+        if self.sync_on_exit and exc_type is None:
+            self.sync()
+        else:
+            self.flush()
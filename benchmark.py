@@ -0,0 +1,453 @@
+import argparse
+import ast
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import warnings
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+
+import instruments
+from async_instruments import AsyncSession, pipelined_sweep
+from scope_scaling import ScopeScaler
+from settle import wait_for_settle
+from shadow import ShadowInstrument
+from sim_instruments import SimResourceManager
+from waveform import digitize, download_channels, gain_phase
+
+# Sweep throughput benchmark
+# Runs the IV, BJT and Bode flows against the simulated bench and reports
+# points/second and where the wall time went:
+#   io      - time inside write/query/read calls (simulated bus + instrument time)
+#   sleep   - time.sleep() outside instrument calls (settling delays)
+#   plot    - building and saving the matplotlib figures
+#   compute - everything else (parsing, NumPy, Python overhead)
+#   calls   - number of instrument transactions
+# Each flow has an 'original' variant that reproduces the scripts as they were
+# first written (MEAS? per reading, fixed sleeps, :AUT per frequency), so the
+# speedup of every other variant can be read off directly. Every other
+# variant runs the script itself (IV_Tracer.py, BJT_curve_example.py,
+# bodePlotterSolved.py) with some of its settings overridden (SCRIPT_VARIANTS),
+# so the benchmark always measures what the scripts do. bode/pipelined has no
+# script counterpart and stays a flow of its own.
+#
+# Every delay, the scripts' own sleeps included, is multiplied by --time-scale
+# so a full run stays short; compare results only at the same time scale.
+#
+# Regressions are judged on machine-independent numbers only: the number of
+# instrument transactions, and the speedup over the 'original' variant run in
+# the same invocation (wall time without plotting). Absolute wall times are
+# shown but depend on the machine the baseline was recorded on.
+#
+#   python benchmark.py                  run everything, compare to the baseline
+#   python benchmark.py --save-baseline  store the results as the new baseline
+#   python benchmark.py --case bjt       run only the cases matching 'bjt'
+#   python benchmark.py --shadow         skip redundant writes (shadow.py)
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+IV_PSU = 'USB0::0x2A8D::0x1102::MY12345678::INSTR'
+IV_DMM = 'USB0::0x2A8D::0x1401::MY12345678::INSTR'
+BJT_INSTRUMENT = 'USB0::0x0957::0x1A07::MY53202914::INSTR'
+SCOPE = 'USB0::0x0957::0x1799::MY51136625::INSTR'
+WAVEGEN = 'USB0::0x1AB1::0x0642::DG1ZA220900451::INSTR'
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS = {'iv': 'IV_Tracer.py', 'bjt': 'BJT_curve_example.py', 'bode': 'bodePlotterSolved.py'}
+
+# Settings overridden in the script for each variant that runs a script
+SCRIPT_VARIANTS = {
+    ('iv', 'point'): {},
+    ('iv', 'fast'): {'dmm_preset': 'fast'},
+    ('iv', 'grouped'): {'sweep_mode': 'grouped'},
+    ('iv', 'list'): {'sweep_mode': 'list'},
+    ('iv', 'limit'): {'limit_test': True},
+    ('bjt', 'point'): {},
+    ('bjt', 'fast'): {'dmm_preset': 'fast'},
+    ('bjt', 'grouped'): {'sweep_mode': 'grouped'},
+    ('bjt', 'list'): {'sweep_mode': 'list'},
+    ('bjt', 'limit'): {'limit_test': True},
+    ('bode', 'predictive'): {},
+    ('bode', 'waveform'): {'use_waveform_capture': True},
+    ('bode', 'adaptive'): {'adaptive': True},
+    ('bode', 'multisine'): {'excitation': 'multisine'},
+}
+
+# Points a script measured, from its variables after the run
+SCRIPT_POINTS = {
+    'iv': lambda names: len(names['currents_dmm']),
+    'bjt': lambda names: sum(len(curve) for curve in names['ic_curves'].values()),
+    'bode': lambda names: len(names['frequencies']),
+}
+
+
+class Timings:
+    def __init__(self):
+        self.io = 0.0
+        self.sleep = 0.0
+        self.plot = 0.0
+        self.calls = 0
+        self.io_depth = 0
+
+
+# Instrument wrapper that adds the time spent in every I/O call to timings.io
+class TimedInstrument:
+    def __init__(self, instrument, timings):
+        self.__dict__['instrument'] = instrument
+        self.__dict__['timings'] = timings
+
+    def __getattr__(self, name):
+        attribute = getattr(self.instrument, name)
+        if name not in ('write', 'query', 'read', 'read_raw', 'query_ascii_values', 'query_binary_values'):
+            return attribute
+
+        def timed(*args, **kwargs):
+            self.timings.io_depth += 1
+            self.timings.calls += 1
+            start = time.perf_counter()
+            try:
+                return attribute(*args, **kwargs)
+            finally:
+                self.timings.io += time.perf_counter() - start
+                self.timings.io_depth -= 1
+        return timed
+
+    def __setattr__(self, name, value):
+        setattr(self.instrument, name, value)
+
+
+class TimedResourceManager:
+    def __init__(self, rm, timings, shadow=False):
+        self.rm = rm
+        self.timings = timings
+        self.shadow = shadow
+
+    def list_resources(self, query='?*::INSTR'):
+        return self.rm.list_resources(query)
+
+    def open_resource(self, resource_name, **kwargs):
+        instrument = TimedInstrument(self.rm.open_resource(resource_name, **kwargs), self.timings)
+        return ShadowInstrument(instrument) if self.shadow else instrument
+
+    def close(self):
+        self.rm.close()
+
+
+def plot_curves(timings, curves, filename):
+    start = time.perf_counter()
+    plt.figure(figsize=(12, 8))
+    for x, y in curves:
+        plt.plot(x, y, '-o')
+    plt.grid(True)
+    plt.savefig(filename, dpi=100)
+    plt.close()
+    timings.plot += time.perf_counter() - start
+
+
+# Flows. Each returns the number of sweep points it measured.
+
+def run_iv(rm, variant, scale, timings, outdir):
+    psu = rm.open_resource(IV_PSU)
+    dmm = rm.open_resource(IV_DMM)
+    psu.write('*RST')
+    dmm.write('*RST')
+    psu.write('CURRent 0.5, (@1)')
+    psu.write('VOLTage 0, (@1)')
+    voltages = [round(v, 2) for v in np.arange(0, 5.0 + 0.2, 0.2)]
+
+    currents, measured = [], []
+    for voltage in voltages:
+        psu.write(f'VOLTage {voltage}, (@1)')
+        psu.write('OUTPut 1, (@1)')
+        time.sleep(0.75 * scale)
+        currents.append(float(dmm.query('MEAS:CURR:DC?')))
+        measured.append(float(dmm.query('MEAS:VOLT:DC?')))
+
+    psu.write('OUTPut 0, (@1)')
+    plot_curves(timings, [(measured, currents)], os.path.join(outdir, 'iv.png'))
+    return len(voltages)
+
+
+def run_bjt(rm, variant, scale, timings, outdir):
+    psu = smu = dmm = rm.open_resource(BJT_INSTRUMENT)
+    dmm.write('*RST')
+    vce_values = [round(v, 1) for v in np.arange(0, 10.0 + 0.1, 0.2)]
+
+    smu.write('SOUR:CURR:LEV:IMM:AMP 0.0')
+    smu.write('SOUR:VOLT:LEV:IMM:AMP 0.0')
+    smu.write('OUTP:STAT ON')
+    psu.write('SOUR:CURR:LEV:IMM:AMP 0.0 @1')
+    psu.write('SOUR:VOLT:LEV:IMM:AMP 0.0 @1')
+    psu.write('OUTP:STAT ON @1')
+
+    curves = []
+    for ib_microamps in (0, 10, 50, 100):
+        smu.write(f'SOUR:VOLT:LEV:IMM:AMP {0.7 if ib_microamps else 0.0}')
+        smu.write(f'SOUR:CURR:LEV:IMM:AMP {ib_microamps * 1e-6}')
+        psu.write('SOUR:CURR:LEV:IMM:AMP 0.5 @1')
+        vce, ic = [], []
+        for value in vce_values:
+            psu.write(f'SOUR:VOLT:LEV:IMM:AMP {value} @1')
+            time.sleep(0.5 * scale)
+            vce.append(float(dmm.query('MEAS:VOLT:DC? AUTO')))
+            ic.append(float(dmm.query('MEAS:CURR:DC? AUTO')))
+        curves.append((vce, [i * 1e3 for i in ic]))
+        time.sleep(0.5 * scale)
+
+    smu.write('OUTP:STAT OFF')
+    psu.write('OUTP:STAT OFF @1')
+    plot_curves(timings, curves, os.path.join(outdir, 'bjt.png'))
+    return len(vce_values) * 4
+
+
+def run_bode(rm, variant, scale, timings, outdir):
+    scope = rm.open_resource(SCOPE)
+    wavegen = rm.open_resource(WAVEGEN)
+    scope.write(':CHANNEL1:DISPLAY ON')
+    scope.write(':CHANNEL2:DISPLAY ON')
+    scope.write(':AUT')
+    wavegen.write(':SOURce1:FUNCtion:SHAPe SIN')
+    wavegen.write(':SOURce1:VOLTage:AMPLitude 2.0')
+    wavegen.write(':SOURce1:VOLTage:OFFSet 0')
+    wavegen.write(':OUTPut1:STATe OFF')
+
+    start_freq, stop_freq, points = 100, 200000, 25
+    frequencies = np.logspace(np.log10(start_freq), np.log10(stop_freq), points)
+
+    def measure(freq):
+        wavegen.write(f':SOURce1:FREQuency:FIXed {freq}')
+        wavegen.write(':OUTPut1:STATe ON')
+        time.sleep(1 * scale)
+        scope.write(':AUT')
+        scope.write(':CHANNEL1:COUPling AC')
+        scope.write(':CHANNEL2:COUPling AC')
+        time.sleep(1.5 * scale)
+        gain = float(scope.query(':MEASure:VAMP? CHAN2')) / float(scope.query(':MEASure:VAMP? CHAN1'))
+        return gain, float(scope.query(':MEAS:PHAS? CHAN2,CHAN1'))
+
+    # Download each point's waveforms while the wavegen already moves to the
+    # next frequency (clipped points are not re-captured in this mode)
+    scaler = ScopeScaler(scope, channels=(1, 2), periods=3, settle_timeout=1.0 * scale)
+
+    def set_frequency(freq):
+        wavegen.write(f':SOURce1:FREQuency:FIXed {freq}')
+        wavegen.write(':OUTPut1:STATe ON')
+
+    def acquire(freq):
+        scaler.set_frequency(freq)
+        wait_for_settle(lambda: float(scope.query(':MEASure:VAMP? CHAN2')), tolerance=1e-3,
+                        rel_tolerance=0.01, poll_interval=0.1 * scale, timeout=2.5 * scale)
+        digitize(scope, (1, 2), 1000)
+
+    def download(freq):
+        t, volts = download_channels(scope, (1, 2))
+        for channel, vpp in zip((1, 2), np.ptp(volts, axis=1)):
+            scaler.update(channel, vpp)
+        return gain_phase(t, volts[0], volts[1], freq)
+
+    if variant == 'pipelined':
+        scaler.setup(initial_amplitude=2.0)
+        session = AsyncSession()
+        async_scope, async_wavegen = session.wrap(scope), session.wrap(wavegen)
+        results = asyncio.run(pipelined_sweep(frequencies,
+                                              lambda freq: async_wavegen.call(set_frequency, freq),
+                                              lambda freq: async_scope.call(acquire, freq),
+                                              lambda freq: async_scope.call(download, freq)))
+        gains, phases = np.array(results).T
+    else:
+        gains, phases = np.array([measure(freq) for freq in frequencies]).T
+
+    wavegen.write(':OUTPut1:STATe OFF')
+    with np.errstate(divide='ignore'):
+        plot_curves(timings, [(frequencies, 20 * np.log10(gains)), (frequencies, phases)],
+                    os.path.join(outdir, 'bode.png'))
+    return len(frequencies)
+
+
+# Script source with top-level settings replaced, e.g. {'sweep_mode': 'list'}.
+# Assignments inside functions are left alone; every setting must be found.
+def override_settings(source, settings):
+    tree = ast.parse(source)
+    found = set()
+    pending = list(tree.body)
+    while pending:
+        node = pending.pop()
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            continue
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name) \
+                and node.targets[0].id in settings:
+            node.value = ast.Constant(settings[node.targets[0].id])
+            found.add(node.targets[0].id)
+        for field in ('body', 'orelse', 'finalbody', 'handlers'):
+            pending.extend(getattr(node, field, []))
+    missing = set(settings) - found
+    if missing:
+        raise ValueError(f'settings not found in the script: {sorted(missing)}')
+    return ast.fix_missing_locations(tree)
+
+
+# Run one of the scripts against rm, in outdir, with its output discarded.
+# Script-level sleeps are scaled by counted_sleep(); savefig() counts as plot time.
+def run_script(rm, flow, variant, timings, outdir):
+    path = os.path.join(SCRIPT_DIR, SCRIPTS[flow])
+    with open(path, encoding='utf-8') as f:
+        code = compile(override_settings(f.read(), SCRIPT_VARIANTS[flow, variant]), path, 'exec')
+
+    real_resource_manager, real_savefig = instruments.resource_manager, plt.savefig
+
+    def timed_savefig(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return real_savefig(*args, **kwargs)
+        finally:
+            timings.plot += time.perf_counter() - start
+
+    namespace = {'__name__': '__main__', '__file__': path}
+    cwd = os.getcwd()
+    instruments.resource_manager = lambda: rm
+    plt.savefig = timed_savefig
+    cache = os.environ.get('BENCH_DISCOVERY_CACHE')
+    os.environ['BENCH_DISCOVERY_CACHE'] = os.path.join(outdir, 'instruments.json')
+    try:
+        os.chdir(outdir)
+        with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            exec(code, namespace)
+    finally:
+        os.chdir(cwd)
+        instruments.resource_manager, plt.savefig = real_resource_manager, real_savefig
+        plt.close('all')
+        if cache is None:
+            del os.environ['BENCH_DISCOVERY_CACHE']
+        else:
+            os.environ['BENCH_DISCOVERY_CACHE'] = cache
+    return SCRIPT_POINTS[flow](namespace)
+
+
+FLOWS = {'iv': run_iv, 'bjt': run_bjt, 'bode': run_bode}
+CASES = [
+    ('iv', 'original'), ('iv', 'point'), ('iv', 'fast'), ('iv', 'grouped'), ('iv', 'list'), ('iv', 'limit'),
+    ('bjt', 'original'), ('bjt', 'point'), ('bjt', 'fast'), ('bjt', 'grouped'), ('bjt', 'list'), ('bjt', 'limit'),
+    ('bode', 'original'), ('bode', 'predictive'), ('bode', 'waveform'), ('bode', 'pipelined'),
+    ('bode', 'adaptive'), ('bode', 'multisine'),
+]
+
+
+def run_case(flow, variant, time_scale, seed=0, shadow=False):
+    timings = Timings()
+    rm = TimedResourceManager(SimResourceManager(time_scale=time_scale), timings, shadow)
+    rm.rm.bench.rng = np.random.default_rng(seed)
+
+    # Count script-level sleeps, but not the simulator's own delays inside I/O
+    # calls. The scripts' own delays are not scaled by the scripts, so scale them here.
+    real_sleep = time.sleep
+    script = (flow, variant) in SCRIPT_VARIANTS
+    scale = time_scale if script else 1.0
+
+    def counted_sleep(seconds):
+        if timings.io_depth:
+            return real_sleep(seconds)
+        start = time.perf_counter()
+        real_sleep(seconds * scale)
+        timings.sleep += time.perf_counter() - start
+
+    time.sleep = counted_sleep
+    try:
+        with tempfile.TemporaryDirectory() as outdir:
+            start = time.perf_counter()
+            if script:
+                points = run_script(rm, flow, variant, timings, outdir)
+            else:
+                points = FLOWS[flow](rm, variant, time_scale, timings, outdir)
+            wall = time.perf_counter() - start
+    finally:
+        time.sleep = real_sleep
+
+    return {
+        'points': points,
+        'wall': wall,
+        'points_per_second': points / wall,
+        'io': timings.io,
+        'sleep': timings.sleep,
+        'plot': timings.plot,
+        'compute': wall - timings.io - timings.sleep - timings.plot,
+        'calls': timings.calls,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Sweep throughput benchmark against the simulated bench')
+    parser.add_argument('--time-scale', type=float, default=0.1,
+                        help='multiplier for every simulated and scripted delay (default 0.1)')
+    parser.add_argument('--case', action='append', default=[],
+                        help="only run this flow (e.g. 'iv') or case (e.g. 'iv/list'); repeatable")
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='baseline results file')
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed increase in calls, or loss of speedup over the original variant, '
+                             'against the baseline before it counts as a regression')
+    parser.add_argument('--shadow', action='store_true', help='skip writes that would not change a setting')
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    if baseline and baseline.get('time_scale') != args.time_scale:
+        print(f"Baseline was recorded at time scale {baseline.get('time_scale')}, not comparing")
+        baseline = {}
+
+    print(f"{'case':<18}{'points':>7}{'wall s':>9}{'pts/s':>9}{'io':>8}{'sleep':>8}"
+          f"{'plot':>8}{'compute':>9}{'calls':>7}{'vs orig':>9}{'vs base':>9}")
+    results = {}
+    regressions = []
+    for flow, variant in CASES:
+        name = f'{flow}/{variant}'
+        if args.case and flow not in args.case and name not in args.case:
+            continue
+        result = run_case(flow, variant, args.time_scale, shadow=args.shadow)
+        results[name] = result
+
+        # Speedup over the original variant, leaving plotting out
+        original = results.get(f'{flow}/original')
+        if original:
+            result['speedup'] = (original['wall'] - original['plot']) / (result['wall'] - result['plot'])
+        previous = baseline.get('cases', {}).get(name)
+        change = '-'
+        if previous:
+            slower = 'speedup' in result and 'speedup' in previous and \
+                result['speedup'] < previous['speedup'] / (1 + args.tolerance)
+            more_calls = result['calls'] > previous['calls'] * (1 + args.tolerance)
+            if 'speedup' in result and 'speedup' in previous:
+                change = f"{result['speedup'] / previous['speedup']:.2f}x"
+            if slower or more_calls:
+                regressions.append(name)
+                change += ' !'
+        speedup = f"{result['speedup']:.1f}x" if 'speedup' in result else '-'
+        print(f"{name:<18}{result['points']:>7}{result['wall']:>9.2f}{result['points_per_second']:>9.1f}"
+              f"{result['io']:>8.2f}{result['sleep']:>8.2f}{result['plot']:>8.2f}{result['compute']:>9.2f}"
+              f"{result['calls']:>7}{speedup:>9}{change:>9}")
+
+    if args.save_baseline:
+        cases = dict(baseline.get('cases', {}))
+        cases.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump({'time_scale': args.time_scale, 'cases': cases}, f, indent=2, sort_keys=True)
+        print(f'Baseline saved to {args.baseline}')
+
+    if regressions:
+        print(f"Regressions against the baseline: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,120 @@
+import time
+
+import numpy as np
+
+from measurement import OVERLOAD
+
+# BJT parameter extraction
+# Works on whole families of output curves at once. Curves are arrays of shape
+# (..., n_ib, n_vce): one row per base current, one column per VCE step, and
+# any number of leading axes for DUTs (or runs, stations, ...). Every
+# parameter comes from masked sums over the last axis, so screening thousands
+# of stored runs is a single call with no Python loop over DUTs or curves.
+#
+#   curves = bjt_curves(combine(results))      # long format -> (dut, ib, vce) grid
+#   parameters = extract_bjt_parameters(curves['ib'], curves['vce'], curves['ic'])
+#
+# Per curve, i.e. with shape (..., n_ib):
+#   output_conductance  dIC/dVCE of a least-squares line through the active region (S)
+#   early_voltage       VA, where that line reaches IC = 0 (at VCE = -VA) (V)
+#   beta                IC / IB on that line at vce_ref
+#   vce_sat             the knee: the VCE at which IC first reaches knee_fraction
+#                       of the active-region line (interpolated between points)
+#
+# The active region is every point with VCE >= active_start that is not
+# missing (NaN or the DMM's 9.9E37 overload value) and not at the collector
+# current limit. beta, early_voltage and vce_sat are NaN for IB = 0 curves and
+# for curves with fewer than two active points.
+
+
+# Reshape long-format rows (one per measured point, as written by the result
+# store or stations.combine()) into a grid of curves. Points that were never
+# measured are NaN. Returns the sorted axis values and (dut, ib, vce) arrays.
+def bjt_curves(columns):
+    ib_microamps, ib_index = np.unique(np.asarray(columns['ib_microamps'], dtype=float), return_inverse=True)
+    vce_set, vce_index = np.unique(np.round(np.asarray(columns['vce_set'], dtype=float), 9), return_inverse=True)
+    if 'dut' in columns:
+        duts, dut_index = np.unique(np.asarray(columns['dut']), return_inverse=True)
+    else:
+        duts, dut_index = np.array([None]), np.zeros(len(ib_index), dtype=int)
+    shape = (len(duts), len(ib_microamps), len(vce_set))
+    vce = np.full(shape, np.nan)
+    ic = np.full(shape, np.nan)
+    vce[dut_index, ib_index, vce_index] = columns['vce']
+    ic[dut_index, ib_index, vce_index] = columns['ic']
+    return {'dut': duts, 'ib_microamps': ib_microamps, 'ib': ib_microamps * 1e-6,
+            'vce_set': vce_set, 'vce': vce, 'ic': ic}
+
+
+# Least-squares line y = intercept + slope * x through the points where mask is
+# set, for every row of the last axis at once
+def masked_line_fit(x, y, mask):
+    count = mask.sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x_mean = np.where(mask, x, 0).sum(axis=-1) / count
+        y_mean = np.where(mask, y, 0).sum(axis=-1) / count
+        dx = np.where(mask, x - x_mean[..., None], 0)
+        dy = np.where(mask, y - y_mean[..., None], 0)
+        slope = (dx * dy).sum(axis=-1) / (dx * dx).sum(axis=-1)
+    slope = np.where(count >= 2, slope, np.nan)
+    return y_mean - slope * x_mean, slope
+
+
+# ib: base currents in A, shape (n_ib,) or (..., n_ib)
+# vce, ic: measured curves in V and A, shape (..., n_ib, n_vce), each curve
+# sorted by VCE. current_limit excludes points clamped by the collector supply.
+def extract_bjt_parameters(ib, vce, ic, active_start=1.0, vce_ref=5.0, knee_fraction=0.9,
+                           current_limit=None):
+    vce = np.asarray(vce, dtype=float)
+    ic = np.asarray(ic, dtype=float)
+    ib = np.broadcast_to(np.asarray(ib, dtype=float), ic.shape[:-1])
+
+    measured = np.isfinite(vce) & np.isfinite(ic) & (np.abs(vce) < OVERLOAD) & (np.abs(ic) < OVERLOAD)
+    active = measured & (vce >= active_start)
+    if current_limit is not None:
+        active &= ic < 0.99 * current_limit
+    intercept, slope = masked_line_fit(vce, ic, active)
+    driven = (ib > 0) & np.isfinite(slope)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        early_voltage = intercept / slope
+        beta = (intercept + slope * vce_ref) / ib
+
+        # First point at or above the knee, then interpolate back to the crossing
+        ratio = ic / (intercept[..., None] + slope[..., None] * vce)
+        reached = measured & (ratio >= knee_fraction)
+        after = np.argmax(reached, axis=-1)[..., None]
+        before = np.maximum(after - 1, 0)
+        x0, x1 = np.take_along_axis(vce, before, -1)[..., 0], np.take_along_axis(vce, after, -1)[..., 0]
+        r0, r1 = np.take_along_axis(ratio, before, -1)[..., 0], np.take_along_axis(ratio, after, -1)[..., 0]
+        vce_sat = np.where((after[..., 0] > 0) & (r1 != r0), x0 + (knee_fraction - r0) * (x1 - x0) / (r1 - r0), x1)
+    found = reached.any(axis=-1)
+
+    return {'beta': np.where(driven, beta, np.nan),
+            'early_voltage': np.where(driven, early_voltage, np.nan),
+            'output_conductance': slope,
+            'vce_sat': np.where(driven & found, vce_sat, np.nan),
+            'active_points': active.sum(axis=-1)}
+
+
+# Throughput check on synthetic curve families (the simulator's BJT model with
+# a spread of beta and Early voltage, plus DMM noise)
+if __name__ == '__main__':
+    duts = 10000
+    rng = np.random.default_rng(0)
+    ib = np.array([0, 10, 50, 100]) * 1e-6
+    vce = np.round(np.arange(0.0, 10.0 + 0.1, 0.2), 1)
+    beta = rng.uniform(100, 300, duts)[:, None, None]
+    early_voltage = rng.uniform(40, 120, duts)[:, None, None]
+    ic = (beta * ib[:, None] * (1 + vce / early_voltage) + 1e-9) * (1 - np.exp(-vce / 0.15))
+    vce_measured = np.broadcast_to(vce, ic.shape) + rng.normal(0, 1e-4, ic.shape)
+    ic = ic + rng.normal(0, 1e-7, ic.shape)
+
+    start = time.perf_counter()
+    parameters = extract_bjt_parameters(ib, vce_measured, ic)
+    elapsed = time.perf_counter() - start
+    beta_error = np.nanmax(np.abs(parameters['beta'][:, 1:] / (beta[:, :, 0] * (1 + 5.0 / early_voltage[:, :, 0])) - 1))
+    va_error = np.nanmax(np.abs(parameters['early_voltage'][:, 1:] / early_voltage[:, :, 0] - 1))
+    print(f'{duts} DUTs x {len(ib)} curves x {len(vce)} points in {elapsed * 1e3:.1f} ms')
+    print(f'max beta error {beta_error:.2%}, max Early voltage error {va_error:.2%} (IB >= 10 uA), '
+          f'median VCE(sat) {np.nanmedian(parameters["vce_sat"]):.3f} V')
@@ -1,14 +1,26 @@
 import pyvisa
+from instruments import resource_manager
+from discovery import find_instruments
 import matplotlib.pyplot as plt
 import numpy as np
-import time
+from settle import wait_for_settle
+from scope_scaling import ScopeScaler
+from waveform import capture_channels, gain_phase
+from adaptive_sweep import adaptive_sweep
+from multisine import measure_broadband
+from result_store import ResultWriter
+from bode_analysis import analyze_bode
+from shadow import shadow
+from batch import CommandBatcher
 
 def plot_frequency_response(frequencies, amplitudes, phases, filename):
+    # Failed points are masked (NaN), phase is unwrapped
+    analysis = analyze_bode(frequencies, amplitudes, phases)
     plt.figure(figsize=(10, 8))
     
-    # Amplitude vs frequency (linear scale)
+    # Phase vs frequency
     plt.subplot(211)
-    plt.semilogx(frequencies, phases, '-o')
+    plt.semilogx(frequencies, analysis['phase'], '-o')
     plt.grid(True, which="both", ls="--")
     plt.xlabel('Frequency (Hz)')
     plt.ylabel('Phase (Deg)')
@@ -16,9 +28,7 @@ def plot_frequency_response(frequencies, amplitudes, phases, filename):
     
     # Amplitude in dB
     plt.subplot(212)
-    max_amp = max(amplitudes) if amplitudes and max(amplitudes) > 0 else 1
-    db_values = [20 * np.log10(a) for a in amplitudes]
-    plt.semilogx(frequencies, db_values, '-o')
+    plt.semilogx(frequencies, analysis['gain_db'], '-o')
     plt.grid(True, which="both", ls="--")
     plt.xlabel('Frequency (Hz)')
     plt.ylabel('Amplitude (dB)')
@@ -28,12 +38,16 @@ def plot_frequency_response(frequencies, amplitudes, phases, filename):
     plt.tight_layout()
     plt.savefig(filename.replace('.csv', '.png'))
     plt.show()
+    return analysis
 
 # Create a Resource Manager
-rm = pyvisa.ResourceManager()
+rm = resource_manager()
 
-scope_address  = 'USB0::0x0957::0x1799::MY51136625::INSTR'
-wavegen_address = 'USB0::0x1AB1::0x0642::DG1ZA220900451::INSTR'
+# Find the scope and wavegen by serial number, wherever they are connected
+# (a model name or a full resource string also works)
+addresses = find_instruments(rm, scope='MY51136625', wavegen='DG1ZA220900451')
+scope_address = addresses['scope']
+wavegen_address = addresses['wavegen']
 
 try:
     scope = rm.open_resource(scope_address)
@@ -42,11 +56,16 @@ try:
     # Set timeout
     scope.timeout = 5000  # milliseconds
     wavegen.timeout = 5000
+
+    # Skip writes that would not change a setting (e.g. the output enable sent
+    # at every frequency); :AUT makes the scope's settings unknown again
+    scope, wavegen = shadow(scope, wavegen)
    
-    #initialize scope
-    scope.write(":CHANNEL1:DISPLAY ON")
-    scope.write(":CHANNEL2:DISPLAY ON")
-    scope.write(":AUT")
+    #initialize scope (one message, waiting until :AUT has finished)
+    with CommandBatcher(scope, sync=True) as commands:
+        commands.write(":CHANNEL1:DISPLAY ON")
+        commands.write(":CHANNEL2:DISPLAY ON")
+        commands.write(":AUT")
 
     # SECTION A
     # In this section, be sure to:
@@ -56,10 +75,11 @@ try:
         # That the output is off before you start your test
     # WRITE YOUR CODE HERE
     #############################################################
-    wavegen.write(":SOURce1:FUNCtion:SHAPe SIN")
-    wavegen.write(":SOURce1:VOLTage:AMPLitude 2.0")
-    wavegen.write(":SOURce1:VOLTage:OFFSet 0")
-    wavegen.write(":OUTPut1:STATe OFF")    
+    with CommandBatcher(wavegen) as commands:   # sent as one message
+        commands.write(":SOURce1:FUNCtion:SHAPe SIN")
+        commands.write(":SOURce1:VOLTage:AMPLitude 2.0")
+        commands.write(":SOURce1:VOLTage:OFFSet 0")
+        commands.write(":OUTPut1:STATe OFF")    
     #############################################################
 
     # Frequency sweep parameters
@@ -67,14 +87,34 @@ try:
     stop_freq = 200000   # 200 kHz
     points = 25
 
-    frequencies = np.logspace(np.log10(start_freq), np.log10(stop_freq), points)
-    print(f"Starting point-by-point sweep from {start_freq} Hz to {stop_freq} Hz with {points} points")
-
-    amplitudes = []
-    phases = []
-    
-    # Perform point-by-point sweep
-    for i, freq in enumerate(frequencies):
+    # Scale the scope from the known frequency and the previous point's amplitudes
+    # instead of running :AUT at every frequency (:AUT is only a fallback)
+    predictive_scaling = True
+    scaler = ScopeScaler(scope, channels=(1, 2), periods=3)
+    if predictive_scaling:
+        scaler.setup(initial_amplitude=2.0)
+
+    # Download both channels as binary waveforms and fit gain/phase at the stimulus
+    # frequency, instead of :MEASure:VAMP?/:MEASure:PHASe? queries
+    use_waveform_capture = False
+    waveform_points = 1000
+
+    # Start from a coarse grid and only add points where the gain or phase curve
+    # bends (e.g. around the -3 dB corner), using at most 'points' measurements
+    adaptive = False
+    coarse_points = 9
+
+    # 'sine' steps a single tone through every frequency; 'multisine' or 'chirp'
+    # measure every frequency at once from one broadband arbitrary waveform
+    # repeating at start_freq
+    excitation = 'sine'
+
+    # Every measured point is streamed to this directory as soon as it is measured
+    results = ResultWriter('bode_results', ['frequency', 'gain', 'phase'],
+                           metadata={'excitation': excitation})
+
+    # Measure a single frequency, returning (gain, phase)
+    def measure_frequency(freq):
         print(f"Testing at {freq}")
 
         # SECTION B
@@ -83,12 +123,11 @@ try:
             # Enable the function generator output
         # WRITE YOUR CODE HERE
         #############################################################
-        wavegen.write(f":SOURce1:FREQuency:FIXed {freq}")
-        wavegen.write(":OUTPut1:STATe ON")
+        with CommandBatcher(wavegen) as commands:
+            commands.write(f":SOURce1:FREQuency:FIXed {freq}")
+            commands.write(":OUTPut1:STATe ON")
         #############################################################
 
-        time.sleep(1)  # Allow settling time
-        
         # SECTION C
         # In this section be sure to:
             # Set the scope to be scaled correctly in the vertical and horizontal axis
@@ -96,15 +135,19 @@ try:
             # Set Channel 1 and 2 of the scope to be AC coupled
         # WRITE YOUR CODE HERE
         #############################################################
-        scope.write(":AUT")
-        scope.write(":CHANNEL1:COUPling AC")
-        scope.write(":CHANNEL2:COUPling AC")
+        if predictive_scaling:
+            scaler.set_frequency(freq)
+        else:
+            scope.write(":AUT")
+            scope.write(":CHANNEL1:COUPling AC")
+            scope.write(":CHANNEL2:COUPling AC")
         #############################################################
         
-        time.sleep(1.5)
-        
         #take measurement
         try:
+            # Allow settling time: wait until the output amplitude stops changing
+            wait_for_settle(lambda: float(scope.query(':MEASure:VAMP? CHAN2')),
+                            tolerance=1e-3, rel_tolerance=0.01, poll_interval=0.1, timeout=2.5)
             
             # Section D 
             # In this section be sure to:
@@ -113,22 +156,69 @@ try:
                 # Measure the phase between the two channels (input and output)
             # WRITE YOUR CODE HERE
             #############################################################
-            measurement_in = float(scope.query(':MEASure:VAMP? CHAN1'))
-            measurement_out = float(scope.query(':MEASure:VAMP? CHAN2'))
-                               
+            if use_waveform_capture:
+                # One acquisition of both channels; the phase is output relative to input
+                t, volts = capture_channels(scope, (1, 2), waveform_points)
+                if predictive_scaling:
+                    in_range = [scaler.update(channel, vpp) for channel, vpp in zip((1, 2), np.ptp(volts, axis=1))]
+                    if not all(in_range):
+                        t, volts = capture_channels(scope, (1, 2), waveform_points)
+                gain, meas_phase = gain_phase(t, volts[0], volts[1], freq)
+            else:
+                if predictive_scaling:
+                    # Rescales (or falls back to :AUT) if a channel is clipped or unmeasurable
+                    measurement_in = scaler.measure_vamp(1)
+                    measurement_out = scaler.measure_vamp(2)
+                else:
+                    measurement_in = float(scope.query(':MEASure:VAMP? CHAN1'))
+                    measurement_out = float(scope.query(':MEASure:VAMP? CHAN2'))
+                gain = measurement_out/measurement_in
+                meas_phase = float(scope.query(':MEAS:PHAS? CHAN2,CHAN1'))
 
-            amplitudes.append(measurement_out/measurement_in)
-            
-            meas_phase = float(scope.query(':MEAS:PHAS? CHAN2,CHAN1'))
-
-            phases.append(meas_phase)
             #############################################################
+            return gain, meas_phase
 
         except Exception as e:
             print(f"Error at {freq} Hz: {e}")
-            amplitudes.append(0)
+            return np.nan, np.nan
+
+    def measure_and_record(freq):
+        gain, meas_phase = measure_frequency(freq)
+        results.append(frequency=freq, gain=gain, phase=meas_phase)
+        return gain, meas_phase
+
+    if excitation in ('multisine', 'chirp'):
+        print(f"Starting {excitation} measurement from {start_freq} Hz to {stop_freq} Hz with {points} tones")
+        frequencies, amplitudes, phases = measure_broadband(scope, wavegen,
+                                                            np.logspace(np.log10(start_freq), np.log10(stop_freq), points),
+                                                            base_freq=start_freq, kind=excitation,
+                                                            scaler=scaler if predictive_scaling else None)
+        results.extend(frequency=frequencies, gain=amplitudes, phase=phases)
+        amplitudes, phases = amplitudes.tolist(), phases.tolist()
+    elif adaptive:
+        print(f"Starting adaptive sweep from {start_freq} Hz to {stop_freq} Hz with up to {points} points")
+        frequencies, amplitudes, phases = adaptive_sweep(measure_and_record, start_freq, stop_freq,
+                                                         coarse_points=coarse_points, max_points=points)
+        amplitudes, phases = amplitudes.tolist(), phases.tolist()
+    else:
+        frequencies = np.logspace(np.log10(start_freq), np.log10(stop_freq), points)
+        print(f"Starting point-by-point sweep from {start_freq} Hz to {stop_freq} Hz with {points} points")
+
+        amplitudes = []
+        phases = []
+        
+        # Perform point-by-point sweep
+        for freq in frequencies:
+            gain, meas_phase = measure_and_record(freq)
+            amplitudes.append(gain)
+            phases.append(meas_phase)
 
-    plot_frequency_response(frequencies, amplitudes,phases, "Bode_Plot.png")  
+    results.close()
+    analysis = plot_frequency_response(frequencies, amplitudes,phases, "Bode_Plot.png")  
+    pole = -analysis['poles'][0].real / (2 * np.pi)
+    print(f"-3 dB bandwidth: {analysis['bandwidth']:.0f} Hz, "
+          f"first-order fit: DC gain {analysis['num'][0]:.3f}, pole at {pole:.0f} Hz "
+          f"({analysis['fit_error']:.1%} rms error)")
     
     # Section E
     # Disable the function generator output
@@ -0,0 +1,194 @@
+import time
+
+import numpy as np
+
+from measurement import OVERLOAD
+
+# Bode post-processing
+# Takes the frequency / gain / phase arrays of one sweep, or of a stacked
+# batch of sweeps shaped (..., points), and processes all of them at once:
+#   - failed points (NaN, gain <= 0, the scope's 9.9E37 "no reading") are masked
+#   - gain is converted to dB (NaN rather than -inf for masked points)
+#   - phase is unwrapped along the sweep, stepping over masked points
+#   - the -3 dB bandwidth and the phase margin are interpolated on a log frequency axis
+#   - a low-order rational transfer function is fitted (linearized least
+#     squares, refined with a few Sanathanan-Koerner reweighting iterations)
+#
+#   analysis = analyze_bode(frequency, gain, phase)
+#   analysis['bandwidth'], analysis['phase_margin'], analysis['num'], analysis['den']
+#
+# Frequencies must be sorted within each sweep. Phase is in degrees, output
+# relative to input (negative when the output lags). Sweeps in one batch
+# need the same number of points; pad shorter ones with NaN.
+
+
+def valid_points(frequency, gain, phase):
+    frequency, gain, phase = np.broadcast_arrays(*(np.asarray(a, dtype=float) for a in (frequency, gain, phase)))
+    return (np.isfinite(frequency) & (frequency > 0) & np.isfinite(gain) & (gain > 0) & (gain < OVERLOAD)
+            & np.isfinite(phase) & (np.abs(phase) < OVERLOAD))
+
+
+def gain_db(gain, valid):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(valid, 20 * np.log10(gain), np.nan)
+
+
+# values with every masked point replaced by the last valid point before it
+# (or the first valid point, for masked points at the start of a sweep)
+def fill_forward(values, valid):
+    index = np.broadcast_to(np.arange(valid.shape[-1]), valid.shape)
+    last = np.maximum.accumulate(np.where(valid, index, -1), axis=-1)
+    last = np.where(last < 0, np.argmax(valid, axis=-1)[..., None], last)
+    return np.take_along_axis(np.broadcast_to(values, valid.shape), last, axis=-1)
+
+
+def unwrap_phase(phase, valid):
+    unwrapped = np.unwrap(fill_forward(phase, valid), period=360.0, axis=-1)
+    return np.where(valid, unwrapped, np.nan)
+
+
+# First point where y falls below level, at or after index start, interpolated
+# on log frequency. Returns (log10 frequency of the crossing, index of the
+# point after it, fraction of the way from the previous valid point, found).
+def falling_crossing(frequency, y, level, valid, start=0):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_f = fill_forward(np.log10(frequency), valid)
+    y = fill_forward(y, valid)
+    level = np.asarray(level, dtype=float)[..., None]
+    index = np.arange(valid.shape[-1])
+    below = valid & (y < level) & (index >= np.asarray(start)[..., None])
+    after = np.argmax(below, axis=-1)[..., None]
+    before = np.maximum(after - 1, 0)
+    y0, y1 = np.take_along_axis(y, before, -1)[..., 0], np.take_along_axis(y, after, -1)[..., 0]
+    f0, f1 = np.take_along_axis(log_f, before, -1)[..., 0], np.take_along_axis(log_f, after, -1)[..., 0]
+    found = below.any(axis=-1) & (after[..., 0] > 0) & (y0 >= level[..., 0])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction = np.where(found, (level[..., 0] - y0) / (y1 - y0), np.nan)
+    return f0 + fraction * (f1 - f0), after[..., 0], fraction, found
+
+
+# Value of y at a crossing found by falling_crossing()
+def at_crossing(y, valid, after, fraction):
+    y = fill_forward(y, valid)
+    after = after[..., None]
+    y0 = np.take_along_axis(y, np.maximum(after - 1, 0), -1)[..., 0]
+    y1 = np.take_along_axis(y, after, -1)[..., 0]
+    return y0 + fraction * (y1 - y0)
+
+
+# Frequency at which the gain first drops `drop` dB below its peak, past the peak
+def bandwidth(frequency, db, valid, drop=3.0):
+    peak = np.argmax(np.where(valid, db, -np.inf), axis=-1)
+    reference = np.take_along_axis(db, peak[..., None], -1)[..., 0]
+    log_f, _, _, found = falling_crossing(frequency, db, reference - drop, valid, start=peak)
+    return np.where(found, 10 ** log_f, np.nan)
+
+
+# Phase margin of a loop-gain sweep: 180 + phase where the gain falls through
+# 0 dB. Returns (crossover frequency, phase margin in degrees).
+def phase_margin(frequency, db, phase, valid):
+    log_f, after, fraction, found = falling_crossing(frequency, db, 0.0, valid)
+    margin = 180.0 + at_crossing(phase, valid, after, fraction)
+    return np.where(found, 10 ** log_f, np.nan), np.where(found, margin, np.nan)
+
+
+# Evaluate num(s) / den(s) (coefficients in ascending powers of s = j*2*pi*f)
+def frequency_response(num, den, frequency):
+    s = 2j * np.pi * np.asarray(frequency, dtype=float)[..., None]
+    powers = lambda order: s ** np.arange(order)
+    num, den = np.asarray(num)[..., None, :], np.asarray(den)[..., None, :]
+    return (num * powers(num.shape[-1])).sum(axis=-1) / (den * powers(den.shape[-1])).sum(axis=-1)
+
+
+# Fit H(s) = (b0 + b1 s + ... + bm s^m) / (1 + a1 s + ... + an s^n) to every
+# sweep. Returns (num, den), shaped (..., m + 1) and (..., n + 1), in
+# ascending powers of s (rad/s), with den[..., 0] = 1.
+def rational_fit(frequency, gain, phase, valid, num_order=0, den_order=1, iterations=3):
+    frequency, gain, phase = np.broadcast_arrays(*(np.asarray(a, dtype=float) for a in (frequency, gain, phase)))
+    count = valid.sum(axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_f = np.where(valid, np.log10(frequency), 0.0)
+        f_scale = 10 ** (log_f.sum(axis=-1) / count)    # geometric mean, for conditioning
+        s = np.where(valid, 1j * frequency / f_scale[..., None], 0.0)
+    h = np.where(valid, gain * np.exp(1j * np.radians(phase)), 0.0)
+
+    # b(s) - H a'(s) = H, with a'(s) = a1 s + ... + an s^n: linear in the coefficients
+    columns = [s ** k for k in range(num_order + 1)] + [-h * s ** k for k in range(1, den_order + 1)]
+    design = np.stack(columns, axis=-1)
+    design = np.concatenate([design.real, design.imag], axis=-2)
+    target = np.concatenate([h.real, h.imag], axis=-1)
+
+    weight = valid.astype(float)
+    for _ in range(iterations + 1):
+        w = np.concatenate([weight, weight], axis=-1)[..., None]
+        lhs = np.einsum('...pi,...pj->...ij', design * w, design)
+        rhs = np.einsum('...pi,...p->...i', design * w, target)
+        solution = (np.linalg.pinv(lhs) @ rhs[..., None])[..., 0]
+        # Reweight by 1 / |den| so the fit minimizes the actual relative error
+        den = np.concatenate([np.ones(solution.shape[:-1] + (1,)), solution[..., num_order + 1:]], axis=-1)
+        denominator = (den[..., None, :] * s[..., None] ** np.arange(den_order + 1)).sum(axis=-1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weight = np.where(valid, 1 / np.abs(denominator) ** 2, 0.0)
+
+    # Undo the frequency normalization: s_normalized = s / (2 pi f_scale)
+    scale = (2 * np.pi * f_scale)[..., None]
+    num = solution[..., :num_order + 1] / scale ** np.arange(num_order + 1)
+    den = den / scale ** np.arange(den_order + 1)
+    usable = count >= num_order + den_order + 1
+    return np.where(usable[..., None], num, np.nan), np.where(usable[..., None], den, np.nan)
+
+
+# Roots of the denominators (rad/s), from the eigenvalues of the companion
+# matrices of all sweeps at once
+def poles(den):
+    den = np.asarray(den, dtype=float)
+    order = den.shape[-1] - 1
+    usable = np.all(np.isfinite(den), axis=-1) & (den[..., -1] != 0)
+    monic = np.where(usable[..., None], den, 1.0) / np.where(usable, den[..., -1], 1.0)[..., None]
+    companion = np.zeros(den.shape[:-1] + (order, order))
+    companion[..., 0, :] = -monic[..., -2::-1]
+    companion[..., np.arange(1, order), np.arange(order - 1)] = 1.0
+    return np.where(usable[..., None], np.linalg.eigvals(companion), np.nan)
+
+
+def analyze_bode(frequency, gain, phase, num_order=0, den_order=1, drop=3.0):
+    frequency, gain, phase = np.broadcast_arrays(*(np.asarray(a, dtype=float) for a in (frequency, gain, phase)))
+    valid = valid_points(frequency, gain, phase)
+    db = gain_db(gain, valid)
+    unwrapped = unwrap_phase(phase, valid)
+    crossover, margin = phase_margin(frequency, db, unwrapped, valid)
+    num, den = rational_fit(frequency, gain, unwrapped, valid, num_order, den_order)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        measured = gain * np.exp(1j * np.radians(phase))
+        relative = np.abs(frequency_response(num, den, frequency) / measured - 1)
+        fit_error = np.sqrt(np.where(valid, relative ** 2, 0).sum(axis=-1) / valid.sum(axis=-1))
+    return {'valid': valid, 'gain_db': db, 'phase': unwrapped,
+            'bandwidth': bandwidth(frequency, db, valid, drop),
+            'crossover_frequency': crossover, 'phase_margin': margin,
+            'num': num, 'den': den, 'poles': poles(den), 'fit_error': fit_error}
+
+
+# Throughput check on synthetic sweeps of second-order low-pass filters, with
+# noise, wrapped phase and a few failed points
+if __name__ == '__main__':
+    sweeps = 5000
+    rng = np.random.default_rng(0)
+    frequency = np.logspace(2, np.log10(2e5), 25)
+    cutoff = rng.uniform(1e3, 2e4, sweeps)[:, None]
+    damping = rng.uniform(0.3, 1.0, sweeps)[:, None]
+    s = 1j * frequency / cutoff
+    h = 1 / (1 + 2 * damping * s + s ** 2) * (1 + rng.normal(0, 0.002, (sweeps, len(frequency))))
+    gain = np.abs(h)
+    phase = (np.degrees(np.angle(h)) + 180) % 360 - 180
+    failed = rng.random(gain.shape) < 0.03
+    gain[failed] = 0.0
+    phase[failed] = np.nan
+
+    start = time.perf_counter()
+    analysis = analyze_bode(frequency, gain, phase, num_order=0, den_order=2)
+    elapsed = time.perf_counter() - start
+    fitted_cutoff = np.sqrt(np.abs(analysis['poles'].prod(axis=-1))) / (2 * np.pi)
+    print(f'{sweeps} sweeps x {len(frequency)} points in {elapsed * 1e3:.1f} ms')
+    print(f'median cutoff error {np.nanmedian(np.abs(fitted_cutoff / cutoff[:, 0] - 1)):.2%}, '
+          f'median fit error {np.nanmedian(analysis["fit_error"]):.2%}, '
+          f'{np.isnan(analysis["bandwidth"]).sum()} sweeps without a -3 dB point')
@@ -0,0 +1,314 @@
+import argparse
+import os
+import secrets
+import socket
+import stat
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener, answer_challenge, deliver_challenge
+
+from instruments import local_resource_manager
+
+# Instrument broker
+# A long-lived local process that keeps the bench's VISA sessions open between
+# script runs, so back-to-back runs skip enumeration, opening and *IDN? checks.
+# Each resource is opened once, however many clients (or roles, like the BJT
+# example's psu/dmm/smu on one address) use it. Calls to one resource are
+# serialized; different resources run in parallel, opening included. A client
+# sends its timeout with the open request, so a discovery probe of a resource
+# that does not answer waits the probe's short timeout, and the failure is
+# remembered for FAILED_OPEN_RETRY seconds so the next probe fails at once.
+#
+#   python broker.py                     start the broker (BENCH_SIM=1 for the simulator)
+#   BENCH_BROKER=localhost:5050 python IV_Tracer.py
+#
+# With BENCH_BROKER set, instruments.resource_manager() returns a
+# BrokerResourceManager whose resources forward every call to the broker.
+#
+# Reset policy (BENCH_BROKER_RESET):
+#   always      - *RST is sent as usual (default)
+#   if-unknown  - *RST is skipped if the instrument is still in its reset
+#                 state: it was reset through the broker and nothing but
+#                 queries has been sent to it since. Any command that sets
+#                 something (a range, NPLC, an output), a client that
+#                 disconnects without closing, or a call that fails makes the
+#                 state unknown, and the next *RST is sent.
+#
+# Clients and broker talk over a local socket. Both ends must know the same
+# key, since whoever passes the handshake can make the broker unpickle what it
+# sends: BENCH_BROKER_KEY if set, otherwise a random key the broker writes to
+# DEFAULT_KEY_FILE (readable by the current user only) the first time it
+# starts. There is no built-in key. The handshake runs on each connection's own thread, so
+# clients connecting at once (e.g. discovery probing every resource) do not
+# queue behind each other on the accept loop.
+
+DEFAULT_ADDRESS = 'localhost:5050'
+DEFAULT_KEY_FILE = os.path.join(os.path.expanduser('~'), '.bench_broker_key')
+BACKLOG = 64     # pending connections, e.g. one per resource during discovery
+FAILED_OPEN_RETRY = 30.0    # seconds before a resource that failed to open is tried again
+
+
+def parse_address(address):
+    host, _, port = address.rpartition(':')
+    return host or 'localhost', int(port)
+
+
+# Requests are small and strictly request/reply, so turn off Nagle's algorithm
+# (otherwise delayed ACKs add ~40 ms to some round trips)
+def no_delay(connection):
+    sock = socket.socket(fileno=connection.fileno())
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    finally:
+        sock.detach()
+    return connection
+
+
+# The shared key: BENCH_BROKER_KEY, or the key file. create=True (the broker)
+# writes a new random key file if there is none.
+def broker_key(create=False):
+    if os.environ.get('BENCH_BROKER_KEY'):
+        return os.environ['BENCH_BROKER_KEY'].encode()
+    if create and not os.path.exists(DEFAULT_KEY_FILE):
+        descriptor = os.open(DEFAULT_KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(descriptor, 'w') as f:
+            f.write(secrets.token_hex(32))
+    try:
+        with open(DEFAULT_KEY_FILE) as f:
+            if os.fstat(f.fileno()).st_mode & (stat.S_IRWXG | stat.S_IRWXO):
+                raise PermissionError(f'{DEFAULT_KEY_FILE} must only be accessible by its owner (chmod 600)')
+            return f.read().strip().encode()
+    except FileNotFoundError:
+        raise RuntimeError(f'No broker key: set BENCH_BROKER_KEY or start broker.py, '
+                           f'which creates {DEFAULT_KEY_FILE}') from None
+
+
+# Client side of the mutual authentication done by Broker.serve()
+def connect(address):
+    key = broker_key()
+    connection = no_delay(Client(parse_address(address)))
+    try:
+        answer_challenge(connection, key)
+        deliver_challenge(connection, key)
+    except BaseException:
+        connection.close()
+        raise
+    return connection
+
+
+class Session:
+    def __init__(self, instrument, idn):
+        self.instrument = instrument
+        self.idn = idn
+        self.lock = threading.Lock()
+        self.state_known = False   # reset by the broker, and only queried since
+        self.users = 0             # clients holding the session
+
+
+class Broker:
+    def __init__(self, rm=None, key=None):
+        self.rm = rm if rm is not None else local_resource_manager()
+        self.key = key if key is not None else broker_key(create=True)
+        self.sessions = {}
+        self.opening = {}     # resource name -> lock held while it is being opened
+        self.failures = {}    # resource name -> (time.monotonic() of the failure, error)
+        self.resources = None
+        self.lock = threading.Lock()
+
+    def list_resources(self, refresh=False):
+        with self.lock:
+            if self.resources is None or refresh:
+                self.resources = tuple(self.rm.list_resources())
+            return self.resources
+
+    # The open session of a resource, opening it (with the client's timeout)
+    # if needed. Only clients of the same resource wait for each other here.
+    def session(self, resource_name, timeout=5000):
+        with self.lock:
+            if resource_name in self.sessions:
+                return self.sessions[resource_name]
+            opening = self.opening.setdefault(resource_name, threading.Lock())
+        with opening:
+            with self.lock:
+                if resource_name in self.sessions:
+                    return self.sessions[resource_name]
+                failed_at, error = self.failures.get(resource_name, (None, None))
+                if failed_at is not None and time.monotonic() - failed_at < FAILED_OPEN_RETRY:
+                    raise error
+            instrument = None
+            try:
+                instrument = self.rm.open_resource(resource_name, open_timeout=timeout)
+                instrument.timeout = timeout
+                session = Session(instrument, instrument.query('*IDN?').strip())
+            except Exception as error:
+                if instrument is not None:
+                    instrument.close()
+                with self.lock:
+                    self.failures[resource_name] = (time.monotonic(), error)
+                raise
+            with self.lock:
+                self.failures.pop(resource_name, None)
+                self.sessions[resource_name] = session
+            print(f'Opened {resource_name}: {session.idn}')
+            return session
+
+    def call(self, session, method, args, kwargs, timeout, reset_policy):
+        with session.lock:
+            message = args[0] if args and isinstance(args[0], str) else ''
+            if method == 'write' and message.strip().upper() == '*RST':
+                # Another client holding the session may have changed its state
+                if reset_policy == 'if-unknown' and session.state_known and session.users == 1:
+                    return 0
+                session.state_known = True
+            elif any(not command.strip().endswith('?') for command in message.split(';') if command.strip()):
+                # Anything but a query changes state the next client cannot see
+                session.state_known = False
+            session.instrument.timeout = timeout
+            try:
+                return getattr(session.instrument, method)(*args, **kwargs)
+            except Exception:
+                session.state_known = False
+                raise
+
+    # One client connection holds one resource
+    def serve(self, connection):
+        session = None
+        timeout = 5000
+        reset_policy = 'always'
+        closed = False
+        try:
+            deliver_challenge(connection, self.key)
+            answer_challenge(connection, self.key)
+            while True:
+                request = connection.recv()
+                try:
+                    if request[0] == 'list':
+                        reply = self.list_resources(*request[1:])
+                    elif request[0] == 'open':
+                        _, resource_name, reset_policy, timeout = request
+                        session = self.session(resource_name, timeout)
+                        session.users += 1
+                        reply = session.idn
+                    elif request[0] == 'timeout':
+                        timeout = reply = request[1]
+                    elif request[0] == 'call':
+                        reply = self.call(session, request[1], request[2], request[3], timeout, reset_policy)
+                    elif request[0] == 'close':
+                        closed = True
+                        connection.send(('ok', None))
+                        return
+                    else:
+                        raise ValueError(f'unknown request {request[0]!r}')
+                    connection.send(('ok', reply))
+                except Exception as error:
+                    connection.send(('error', error))
+        except (EOFError, ConnectionError, AuthenticationError):
+            pass
+        finally:
+            if session is not None:
+                session.users -= 1
+                if not closed:
+                    session.state_known = False   # the client died mid-run
+            connection.close()
+
+    def run(self, address=DEFAULT_ADDRESS):
+        with Listener(parse_address(address), backlog=BACKLOG) as listener:
+            print(f'Instrument broker listening on {address}')
+            while True:
+                connection = no_delay(listener.accept())
+                threading.Thread(target=self.serve, args=(connection,), daemon=True).start()
+
+
+def request(connection, *message):
+    connection.send(message)
+    status, reply = connection.recv()
+    if status == 'error':
+        raise reply
+    return reply
+
+
+# Client side: one connection per opened resource, so calls to different
+# instruments from different threads (async_instruments.reset_all) still overlap
+class RemoteInstrument:
+    def __init__(self, address, resource_name, reset_policy='always', timeout=5000):
+        self.__dict__['connection'] = connect(address)
+        self.__dict__['resource_name'] = resource_name
+        try:
+            self.__dict__['idn'] = request(self.connection, 'open', resource_name, reset_policy, timeout)
+        except BaseException:
+            self.connection.close()
+            raise
+        self.__dict__['timeout'] = timeout
+        self.__dict__['read_termination'] = '\n'
+        self.__dict__['write_termination'] = '\n'
+
+    def __setattr__(self, name, value):
+        if name == 'timeout':
+            request(self.connection, 'timeout', value)
+        self.__dict__[name] = value
+
+    def call(self, method, *args, **kwargs):
+        return request(self.connection, 'call', method, args, kwargs)
+
+    def write(self, message, *args, **kwargs):
+        return self.call('write', message, *args, **kwargs)
+
+    def query(self, message, *args, **kwargs):
+        return self.call('query', message, *args, **kwargs)
+
+    def read(self, *args, **kwargs):
+        return self.call('read', *args, **kwargs)
+
+    def read_raw(self, *args, **kwargs):
+        return self.call('read_raw', *args, **kwargs)
+
+    def query_ascii_values(self, message, *args, **kwargs):
+        return self.call('query_ascii_values', message, *args, **kwargs)
+
+    def query_binary_values(self, message, *args, **kwargs):
+        return self.call('query_binary_values', message, *args, **kwargs)
+
+    def clear(self):
+        return self.call('clear')
+
+    # Hand the session back to the broker (it stays open there)
+    def close(self):
+        if self.connection.closed:
+            return
+        try:
+            request(self.connection, 'close')
+        finally:
+            self.connection.close()
+
+
+class BrokerResourceManager:
+    def __init__(self, address=DEFAULT_ADDRESS, reset_policy='always'):
+        self.address = address
+        self.reset_policy = reset_policy
+
+    def list_resources(self, query='?*::INSTR'):
+        with connect(self.address) as connection:
+            resources = request(connection, 'list')
+            request(connection, 'close')
+        return resources
+
+    # open_timeout (or timeout) also bounds opening and identifying the
+    # resource in the broker, if it is not open there yet
+    def open_resource(self, resource_name, **kwargs):
+        timeout = kwargs.pop('open_timeout', kwargs.get('timeout', 5000))
+        instrument = RemoteInstrument(self.address, resource_name, self.reset_policy, timeout)
+        for name, value in kwargs.items():
+            setattr(instrument, name, value)
+        return instrument
+
+    def close(self):
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Keep instrument sessions open for client scripts')
+    parser.add_argument('--address', default=os.environ.get('BENCH_BROKER', DEFAULT_ADDRESS),
+                        help=f'host:port to listen on (default {DEFAULT_ADDRESS})')
+    args = parser.parse_args()
+    Broker().run(args.address)
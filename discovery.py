@@ -0,0 +1,172 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Instrument discovery
+# Instead of hard-coding resource strings that break whenever an instrument is
+# swapped or moved to another port, look instruments up by model:
+#
+#   addresses = find_instruments(rm, psu='EDU36311A', dmm='EDU34450A')
+#   psu = rm.open_resource(addresses['psu'])
+#
+# discover() lists the resources and asks every one of them for *IDN? at once,
+# each with a short timeout. A missing or powered-off instrument costs one
+# short timeout, in parallel with the others, instead of several 5 s timeouts
+# one after the other. The result is cached on disk (DEFAULT_CACHE, or
+# BENCH_DISCOVERY_CACHE) for ttl seconds, so later runs skip discovery entirely.
+# If a cached result cannot satisfy a request, discovery runs again once.
+#
+#   python discovery.py [--refresh]     print the instruments found and their roles
+
+DEFAULT_CACHE = os.path.join(os.path.expanduser('~'), '.bench_instruments.json')
+DEFAULT_TTL = 3600          # seconds
+PROBE_TIMEOUT = 500         # milliseconds per *IDN? probe
+
+# Model name fragments of the instruments that can fill each role
+ROLE_MODELS = {
+    'psu': ('EDU36311A', 'E3631', 'E36', 'DP8', 'DP7'),
+    'dmm': ('34461A', '34465A', '34470A', 'EDU34450A', '3445'),
+    'smu': ('B29', '2450', '2400'),
+    'scope': ('DSO-X', 'MSO-X', 'DSOX', 'MSOX', 'DS1', 'MSO5'),
+    'wavegen': ('DG10', 'DG20', '33500', '33600', '33210', 'EDU33'),
+}
+
+
+# Split an *IDN? reply into its four fields
+def parse_idn(reply):
+    fields = [field.strip() for field in reply.strip().split(',')] + [''] * 4
+    return {'manufacturer': fields[0], 'model': fields[1], 'serial': fields[2], 'firmware': fields[3]}
+
+
+# *IDN? reply of one resource, or None if it cannot be opened or does not answer
+def identify(rm, resource_name, timeout=PROBE_TIMEOUT):
+    try:
+        instrument = rm.open_resource(resource_name, open_timeout=timeout)
+    except Exception:
+        return None
+    try:
+        instrument.timeout = timeout
+        return instrument.query('*IDN?').strip()
+    except Exception:
+        return None
+    finally:
+        instrument.close()
+
+
+# Cache entries are kept per kind of resource manager (simulator, VISA, broker)
+def backend(rm):
+    while hasattr(rm, 'rm'):
+        rm = rm.rm
+    return type(rm).__name__
+
+
+def cache_file(cache_path=None):
+    return cache_path or os.environ.get('BENCH_DISCOVERY_CACHE') or DEFAULT_CACHE
+
+
+def load_cache(cache_path=None):
+    try:
+        with open(cache_file(cache_path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(cache, cache_path=None):
+    path = cache_file(cache_path)
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(cache, f, indent=2)
+    os.replace(temporary, path)
+
+
+# {resource name: *IDN? reply} of every instrument that answered.
+# The cached result is used if it is younger than ttl seconds, unless refresh=True.
+def discover(rm, timeout=PROBE_TIMEOUT, ttl=DEFAULT_TTL, refresh=False, cache_path=None):
+    cache = load_cache(cache_path)
+    key = backend(rm)
+    entry = cache.get(key)
+    if entry and not refresh and time.time() - entry['time'] < ttl:
+        return entry['identities']
+
+    resources = list(rm.list_resources())
+    identities = {}
+    if resources:
+        with ThreadPoolExecutor(max_workers=len(resources)) as pool:
+            replies = pool.map(lambda name: identify(rm, name, timeout), resources)
+            identities = {name: reply for name, reply in zip(resources, replies) if reply}
+    cache[key] = {'time': time.time(), 'identities': identities}
+    try:
+        save_cache(cache, cache_path)
+    except OSError:
+        pass   # discovery still works, it just is not remembered
+    return identities
+
+
+# Roles an instrument can fill, by its model
+def roles_of(idn):
+    model = parse_idn(idn)['model'].upper()
+    return [role for role, models in ROLE_MODELS.items() if any(fragment in model for fragment in models)]
+
+
+# Resource names of the instruments matching a role request. wanted is None
+# (any instrument that can fill the role), a model name fragment or serial
+# number, or a full resource string (used as it is).
+def candidates(identities, role, wanted=None):
+    if wanted is not None and '::' in wanted:
+        return [wanted]
+    matches = []
+    for resource_name, idn in sorted(identities.items()):
+        fields = parse_idn(idn)
+        if wanted is None:
+            if role in roles_of(idn):
+                matches.append(resource_name)
+        elif wanted.upper() in fields['model'].upper() or wanted == fields['serial']:
+            matches.append(resource_name)
+    return matches
+
+
+def resolve(identities, roles):
+    addresses = {}
+    for role, wanted in roles.items():
+        matches = candidates(identities, role, wanted)
+        if len(matches) != 1:
+            return None, role, matches
+        addresses[role] = matches[0]
+    return addresses, None, []
+
+
+# Resource names by role, e.g. find_instruments(rm, psu='EDU36311A', dmm=None).
+# Raises LookupError if a role matches no instrument, or several.
+def find_instruments(rm, timeout=PROBE_TIMEOUT, ttl=DEFAULT_TTL, cache_path=None, **roles):
+    identities = discover(rm, timeout, ttl, cache_path=cache_path)
+    addresses, role, matches = resolve(identities, roles)
+    if addresses is None:
+        # The cache may predate a newly connected or swapped instrument
+        identities = discover(rm, timeout, ttl, refresh=True, cache_path=cache_path)
+        addresses, role, matches = resolve(identities, roles)
+    if addresses is None:
+        found = '\n'.join(f'  {name}: {idn}' for name, idn in sorted(identities.items())) or '  (none)'
+        problem = 'several instruments match' if matches else 'no instrument matches'
+        raise LookupError(f'{problem} {role}={roles[role]!r}; instruments found:\n{found}')
+    return addresses
+
+
+def print_instruments(identities):
+    for resource_name, idn in sorted(identities.items()):
+        roles = ', '.join(roles_of(idn)) or '-'
+        print(f'{resource_name:45s} {roles:10s} {idn}')
+
+
+if __name__ == '__main__':
+    from instruments import resource_manager
+
+    parser = argparse.ArgumentParser(description='List the instruments on the bench and the roles they can fill')
+    parser.add_argument('--refresh', action='store_true', help='ignore the cached result')
+    parser.add_argument('--timeout', type=int, default=PROBE_TIMEOUT, help='*IDN? timeout in ms')
+    args = parser.parse_args()
+    start = time.perf_counter()
+    print_instruments(discover(resource_manager(), args.timeout, refresh=args.refresh))
+    print(f'{time.perf_counter() - start:.3f} s')
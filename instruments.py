@@ -0,0 +1,31 @@
+import os
+
+import pyvisa
+
+# Set BENCH_SIM=1 to run the scripts against the simulated bench in
+# sim_instruments.py instead of real hardware. BENCH_SIM_TIME_SCALE scales the
+# simulated latency and settling times (1 = realistic, 0 = instant).
+# Set BENCH_BROKER=host:port to use the sessions held open by a running
+# broker.py instead of opening the instruments directly, and
+# BENCH_BROKER_RESET=if-unknown to skip *RST when the broker knows the state.
+# Set BENCH_TRACE=trace.json to trace every instrument call, sleep and plot of
+# the script (see io_trace.py).
+
+
+def local_resource_manager():
+    if os.environ.get('BENCH_SIM'):
+        from sim_instruments import SimResourceManager
+        return SimResourceManager(time_scale=float(os.environ.get('BENCH_SIM_TIME_SCALE', '1')))
+    return pyvisa.ResourceManager()
+
+
+def resource_manager():
+    if os.environ.get('BENCH_BROKER'):
+        from broker import BrokerResourceManager
+        rm = BrokerResourceManager(os.environ['BENCH_BROKER'], os.environ.get('BENCH_BROKER_RESET', 'always'))
+    else:
+        rm = local_resource_manager()
+    if os.environ.get('BENCH_TRACE'):
+        from io_trace import trace_script
+        rm = trace_script(rm, os.environ['BENCH_TRACE'])
+    return rm
@@ -0,0 +1,177 @@
+import atexit
+import json
+import sys
+import threading
+import time
+
+import numpy as np
+
+from scpi import parse_command
+
+# Instrument I/O tracing
+# Records every instrument write/query/read, every time.sleep() and every
+# matplotlib savefig()/show() with its start time, duration, instrument and
+# command, to show where a sweep's time goes:
+#   - latency histograms per command type (Tracer.summary())
+#   - a Chrome trace, opened in chrome://tracing or https://ui.perfetto.dev,
+#     with one row per instrument (Tracer.export_chrome())
+#   - folded stacks for flamegraph.pl / speedscope (Tracer.export_folded())
+#
+# Tracing is opt-in. Set BENCH_TRACE=trace.json and instruments.resource_manager()
+# traces the whole script, writes trace.json and trace.folded at exit and prints
+# the summary. Without it nothing is wrapped or patched, so it costs nothing.
+#
+#   tracer = Tracer()
+#   install(tracer)
+#   rm = TracedResourceManager(pyvisa.ResourceManager(), tracer)
+
+TRACED_METHODS = ('write', 'query', 'read', 'read_raw', 'query_ascii_values', 'query_binary_values')
+
+# Histogram bins: half-decades from 10 us to 100 s
+HISTOGRAM_BINS = np.logspace(-5, 2, 15)
+BARS = ' .:-=+*#%@'
+
+
+class Tracer:
+    def __init__(self):
+        self.events = []    # (category, name, instrument, start, duration, thread id, command)
+        self.origin = time.perf_counter()
+        self.local = threading.local()
+
+    def record(self, category, name, instrument, start, duration, command=''):
+        self.events.append((category, name, instrument, start - self.origin, duration,
+                            threading.get_ident(), command))
+
+    def in_io(self):
+        return getattr(self.local, 'depth', 0) > 0
+
+    # Time a call as one event; calls nested inside instrument I/O (e.g. a
+    # simulator's own sleeps) are not recorded separately
+    def call(self, category, name, instrument, function, *args, command='', **kwargs):
+        self.local.depth = getattr(self.local, 'depth', 0) + 1
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            duration = time.perf_counter() - start
+            self.local.depth -= 1
+            if not self.in_io() or category != 'sleep':
+                self.record(category, name, instrument, start, duration, command)
+
+    # Durations grouped by (category, name), e.g. ('io', 'query MEAS:VAMP?')
+    def histograms(self):
+        groups = {}
+        for category, name, _, _, duration, _, _ in self.events:
+            groups.setdefault((category, name), []).append(duration)
+        return {key: np.array(durations) for key, durations in groups.items()}
+
+    def summary(self):
+        groups = sorted(self.histograms().items(), key=lambda item: -item[1].sum())
+        lines = [f"{'category':<9}{'command':<34}{'count':>7}{'total s':>9}{'mean ms':>9}"
+                 f"{'p50 ms':>8}{'p95 ms':>8}{'max ms':>8}  histogram 10us..100s"]
+        for (category, name), durations in groups:
+            counts, _ = np.histogram(np.clip(durations, HISTOGRAM_BINS[0], HISTOGRAM_BINS[-1]), HISTOGRAM_BINS)
+            levels = np.ceil(counts / max(counts.max(), 1) * (len(BARS) - 1)).astype(int)
+            p50, p95 = np.percentile(durations, [50, 95]) * 1e3
+            lines.append(f"{category:<9}{name[:33]:<34}{len(durations):>7}{durations.sum():>9.3f}"
+                         f"{durations.mean() * 1e3:>9.2f}{p50:>8.2f}{p95:>8.2f}{durations.max() * 1e3:>8.2f}"
+                         f"  |{''.join(BARS[level] for level in levels)}|")
+        return '\n'.join(lines)
+
+    # Chrome trace event format: one complete ('X') event per call, one row
+    # (tid) per instrument plus one for sleeps and plotting
+    def export_chrome(self, path):
+        rows = {}
+        trace = []
+        for category, name, instrument, start, duration, thread, command in self.events:
+            row = instrument or category
+            if row not in rows:
+                rows[row] = len(rows) + 1
+                trace.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': rows[row],
+                              'args': {'name': row}})
+            trace.append({'name': name, 'cat': category, 'ph': 'X', 'pid': 1, 'tid': rows[row],
+                          'ts': start * 1e6, 'dur': duration * 1e6,
+                          'args': {'command': command, 'thread': thread}})
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
+
+    # Folded stacks ("category;instrument;command microseconds" per line)
+    def export_folded(self, path):
+        totals = {}
+        for category, name, instrument, _, duration, _, _ in self.events:
+            stack = ';'.join(part.replace(';', ',') for part in (category, instrument or '-', name))
+            totals[stack] = totals.get(stack, 0) + duration
+        with open(path, 'w') as f:
+            for stack, total in sorted(totals.items()):
+                f.write(f'{stack} {int(round(total * 1e6))}\n')
+
+
+# Command type of a message, e.g. 'SOUR:VOLT:LEV:IMM:AMP 5 @1' -> 'VOLT'
+def command_type(message):
+    types = []
+    for command in str(message).split(';'):
+        if command.strip():
+            path, _, _, _, is_query = parse_command(command)
+            types.append(':'.join(path) + ('?' if is_query else ''))
+    return ';'.join(types)
+
+
+class TracedInstrument:
+    def __init__(self, instrument, tracer):
+        self.__dict__['instrument'] = instrument
+        self.__dict__['tracer'] = tracer
+
+    def __getattr__(self, name):
+        attribute = getattr(self.instrument, name)
+        if name not in TRACED_METHODS:
+            return attribute
+
+        def traced(*args, **kwargs):
+            message = args[0] if args else ''
+            label = f'{name} {command_type(message)}' if message else name
+            return self.tracer.call('io', label, self.instrument.resource_name, attribute,
+                                    *args, command=str(message), **kwargs)
+        return traced
+
+    def __setattr__(self, name, value):
+        setattr(self.instrument, name, value)
+
+
+class TracedResourceManager:
+    def __init__(self, rm, tracer):
+        self.rm = rm
+        self.tracer = tracer
+
+    def open_resource(self, resource_name, **kwargs):
+        instrument = self.tracer.call('io', 'open_resource', resource_name, self.rm.open_resource,
+                                      resource_name, **kwargs)
+        return TracedInstrument(instrument, self.tracer)
+
+    def __getattr__(self, name):
+        return getattr(self.rm, name)
+
+
+# Trace time.sleep() and, if pyplot is loaded, savefig()/show()
+def install(tracer):
+    sleep = time.sleep
+    time.sleep = lambda seconds: tracer.call('sleep', 'sleep', None, sleep, seconds)
+    pyplot = sys.modules.get('matplotlib.pyplot')
+    if pyplot is not None:
+        for name in ('savefig', 'show'):
+            function = getattr(pyplot, name)
+            setattr(pyplot, name, lambda *args, _name=name, _function=function, **kwargs:
+                    tracer.call('plot', _name, None, _function, *args, **kwargs))
+
+
+# Used by instruments.resource_manager() when BENCH_TRACE is set
+def trace_script(rm, path):
+    tracer = Tracer()
+    install(tracer)
+
+    def finish():
+        tracer.export_chrome(path)
+        tracer.export_folded(path.rsplit('.', 1)[0] + '.folded')
+        print(tracer.summary(), file=sys.stderr)
+        print(f'Trace written to {path}', file=sys.stderr)
+    atexit.register(finish)
+    return TracedResourceManager(rm, tracer)
@@ -0,0 +1,173 @@
+import time
+
+import numpy as np
+
+from measurement import OVERLOAD
+
+# Diode I-V fitting
+# Fits the Shockley diode equation with series resistance,
+#
+#   V = n Vt ln(I / Is + 1) + I Rs
+#
+# to many I-V curves at once. For I >> Is this is linear in (n Vt, n Vt ln Is,
+# Rs) once written as V = a ln(I) + b + Rs I, so every curve is fitted by one
+# linear least-squares solve, batched over all curves with einsum. Curves are
+# padded arrays shaped (..., points), with NaN for missing points (see
+# pad_curves() and iv_curves()).
+#
+#   curves = iv_curves(columns)          # long format (optionally with a 'dut' column)
+#   fit = fit_diodes(curves['voltage'], curves['current'], current_limit=0.5)
+#   fit['saturation_current'], fit['ideality'], fit['series_resistance'], fit['outlier']
+#
+# Points are used if they are valid readings (not NaN or the DMM's 9.9E37
+# overload value), the current is above min_current (ln(I) is meaningless
+# in the noise floor) and below the supply's current limit (clamped points
+# only show the limit). Outliers are flagged at two levels:
+#   - points whose residual is more than point_threshold robust standard
+#     deviations (or min_residual volts) off the fit are dropped, and the curve
+#     is fitted again without them ('point_outliers')
+#   - devices whose Is, n or Rs are more than device_threshold robust standard
+#     deviations from the rest of the batch, or that could not be fitted ('outlier')
+
+THERMAL_VOLTAGE = 0.02585   # kT/q at 300 K
+
+
+# Stack curves of different lengths into NaN-padded (curves, points) arrays
+def pad_curves(voltages, currents):
+    length = max((len(v) for v in voltages), default=0)
+    voltage = np.full((len(voltages), length), np.nan)
+    current = np.full((len(voltages), length), np.nan)
+    for row, (v, i) in enumerate(zip(voltages, currents)):
+        voltage[row, :len(v)] = v
+        current[row, :len(i)] = i
+    return voltage, current
+
+
+# Padded curves from long-format rows (one per measured point, in measurement
+# order), grouped by the 'dut' column if there is one
+def iv_curves(columns):
+    voltage_column = np.asarray(columns['voltage'], dtype=float)
+    if 'dut' in columns:
+        duts, dut_index = np.unique(np.asarray(columns['dut']), return_inverse=True)
+    else:
+        duts, dut_index = np.array([None]), np.zeros(len(voltage_column), dtype=int)
+    order = np.argsort(dut_index, kind='stable')
+    counts = np.bincount(dut_index, minlength=len(duts))
+    position = np.arange(len(order)) - np.repeat(np.cumsum(counts) - counts, counts)
+    voltage = np.full((len(duts), counts.max(initial=0)), np.nan)
+    current = np.full_like(voltage, np.nan)
+    voltage[dut_index[order], position] = voltage_column[order]
+    current[dut_index[order], position] = np.asarray(columns['current'], dtype=float)[order]
+    return {'dut': duts, 'voltage': voltage, 'current': current}
+
+
+# Least-squares V = a ln(I) + b + Rs I over the points in mask, for every curve.
+# Returns the coefficients (..., 3) and the residuals (..., points). The
+# residual of a fitted point is its leave-one-out residual r / (1 - h), so a
+# glitch at the end of a curve, which pulls the line towards itself, still stands out.
+def solve_diode(voltage, current, mask):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_current = np.log(current)
+    basis = np.stack([log_current, np.ones_like(current), current], axis=-1)
+    design = np.where(mask[..., None], basis, 0.0)
+    target = np.where(mask, voltage, 0.0)
+    lhs = np.einsum('...pi,...pj->...ij', design, design)
+    rhs = np.einsum('...pi,...p->...i', design, target)
+    # Scale the columns so that ln(I), 1 and I (amps) are equally well conditioned
+    scale = np.sqrt(np.maximum(np.diagonal(lhs, axis1=-2, axis2=-1), 1e-300))
+    scaled = lhs / (scale[..., :, None] * scale[..., None, :])
+    inverse = np.linalg.pinv(scaled) / (scale[..., :, None] * scale[..., None, :])
+    coefficients = (inverse @ rhs[..., None])[..., 0]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        residual = voltage - (basis * coefficients[..., None, :]).sum(axis=-1)
+        leverage = np.einsum('...pi,...ij,...pj->...p', design, inverse, design)
+        residual = np.where(mask & (leverage < 1), residual / (1 - leverage), residual)
+    return coefficients, residual
+
+
+# Robust z-scores over every device in the batch (0 where the spread is 0)
+def robust_z(values):
+    flat = values.reshape(-1)
+    median = np.nanmedian(flat) if np.isfinite(flat).any() else np.nan
+    spread = 1.4826 * np.nanmedian(np.abs(flat - median)) if np.isfinite(flat).any() else np.nan
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(spread > 0, (values - median) / spread, 0.0)
+
+
+def fit_diodes(voltage, current, current_limit=None, min_current=1e-6, point_threshold=4.0,
+               min_residual=1e-3, device_threshold=5.0, iterations=3):
+    voltage, current = np.broadcast_arrays(np.asarray(voltage, dtype=float), np.asarray(current, dtype=float))
+    usable = (np.isfinite(voltage) & np.isfinite(current) & (np.abs(voltage) < OVERLOAD)
+              & (np.abs(current) < OVERLOAD) & (current > min_current))
+    if current_limit is not None:
+        usable &= current < 0.99 * current_limit
+
+    used = usable
+    point_outliers = np.zeros_like(usable)
+    coefficients, residual = solve_diode(voltage, current, used)
+    for _ in range(iterations):
+        # Robust spread of each curve's residuals: the (lower) median absolute residual
+        absolute = np.where(usable, np.abs(residual), np.inf)
+        middle = np.maximum(used.sum(axis=-1) - 1, 0) // 2
+        spread = 1.4826 * np.take_along_axis(np.sort(np.where(used, absolute, np.inf), axis=-1),
+                                             middle[..., None], -1)
+        flagged = usable & (absolute > np.maximum(point_threshold * spread, min_residual))
+        if np.array_equal(flagged, point_outliers):
+            break
+        point_outliers = flagged
+        used = usable & ~point_outliers
+        coefficients, residual = solve_diode(voltage, current, used)
+
+    a, b, series_resistance = np.moveaxis(coefficients, -1, 0)
+    count = used.sum(axis=-1)
+    fitted = (count >= 4) & (a > 0)
+    with np.errstate(invalid='ignore', over='ignore'):
+        saturation_current = np.where(fitted, np.exp(-b / a), np.nan)
+        ideality = np.where(fitted, a / THERMAL_VOLTAGE, np.nan)
+        series_resistance = np.where(fitted, series_resistance, np.nan)
+        rms_error = np.sqrt(np.where(used, residual ** 2, 0).sum(axis=-1) / count)
+
+    if saturation_current.ndim:
+        with np.errstate(invalid='ignore'):
+            deviation = np.maximum.reduce([np.abs(robust_z(np.log10(saturation_current))),
+                                           np.abs(robust_z(ideality)), np.abs(robust_z(series_resistance))])
+        outlier = ~fitted | (deviation > device_threshold)
+    else:
+        outlier = ~fitted
+    return {'saturation_current': saturation_current, 'ideality': ideality,
+            'series_resistance': series_resistance, 'rms_error': np.where(fitted, rms_error, np.nan),
+            'points': count, 'point_outliers': point_outliers, 'outlier': outlier}
+
+
+# Throughput check on a synthetic tray of diodes: spread of Is, n and Rs,
+# curves of different lengths, DMM noise, a few glitched readings and a few
+# bad parts
+if __name__ == '__main__':
+    parts = 5000
+    rng = np.random.default_rng(0)
+    saturation_current = 10 ** rng.uniform(-13, -11, parts)
+    ideality = rng.uniform(1.5, 2.0, parts)
+    series_resistance = rng.uniform(0.3, 0.7, parts)
+    series_resistance[:10] = 5.0          # bad parts
+    current = np.logspace(-5, np.log10(0.4), 40) * np.ones((parts, 1))
+    voltage = (ideality * THERMAL_VOLTAGE)[:, None] * np.log(current / saturation_current[:, None] + 1) \
+        + current * series_resistance[:, None]
+    voltage += rng.normal(0, 2e-4, voltage.shape)
+    current *= 1 + rng.normal(0, 1e-3, current.shape)
+    glitches = rng.random(voltage.shape) < 0.01
+    voltage[glitches] += 0.2
+    lengths = rng.integers(25, 41, parts)
+    voltage[np.arange(40) >= lengths[:, None]] = np.nan
+    glitches &= np.isfinite(voltage)
+
+    start = time.perf_counter()
+    fit = fit_diodes(voltage, current)
+    elapsed = time.perf_counter() - start
+    good = ~fit['outlier']
+    print(f'{parts} curves (25-40 points) in {elapsed * 1e3:.1f} ms ({elapsed / parts * 1e6:.1f} us per device)')
+    print(f'max error on good parts: n {np.nanmax(np.abs(fit["ideality"][good] / ideality[good] - 1)):.2%}, '
+          f'Rs {np.nanmax(np.abs(fit["series_resistance"][good] / series_resistance[good] - 1)):.2%}, '
+          f'Is {np.nanmax(np.abs(fit["saturation_current"][good] / saturation_current[good] - 1)):.1%}')
+    print(f'{(fit["point_outliers"] & glitches).sum()} of {glitches.sum()} glitched points flagged '
+          f'({(fit["point_outliers"] & ~glitches).sum()} good points flagged), '
+          f'{fit["outlier"].sum()} parts flagged ({fit["outlier"][:10].sum()} of the 10 bad ones)')
@@ -1,23 +1,14 @@
-import pyvisa
+import time
+from instruments import resource_manager
+from discovery import discover, print_instruments
 
 # Create a Resource Manager
-rm = pyvisa.ResourceManager()
+rm = resource_manager()
 
-# Connect to the device using its VISA resource string
-# Replace the IP address with your device's address
-visa_address = 'TCPIP0::192.168.2.2::INSTR'
-try:
-   instrument = rm.open_resource(visa_address)
-  
-   # Set timeout (optional)
-   instrument.timeout = 5000  # milliseconds
-  
-   # Send a command (example: *IDN? is a common identification query)
-   response = (instrument.query('*IDN?'))
-   print(f"Device response: {response}")
-
-   # Close the connection
-   instrument.close()
-  
-except pyvisa.Error as e:
-   print(f"Error: {e}")
\ No newline at end of file
+# Ask every instrument the resource manager can see for its *IDN?, all at
+# once with a short timeout, so a missing device (e.g. a LAN instrument at
+# TCPIP0::192.168.2.2::INSTR that is switched off) only costs one short timeout
+start = time.perf_counter()
+identities = discover(rm, timeout=1000, refresh=True)
+print(f"Found {len(identities)} instruments in {time.perf_counter() - start:.2f} s")
+print_instruments(identities)
@@ -0,0 +1,92 @@
+import numpy as np
+
+# Pass/fail limit testing with early abort
+# A LimitTest holds the pass window of every point of one sweep as two masks,
+# low and high (NaN where a point has no limit on that side). Points are
+# checked as they are measured, and the outcome is decided as soon as it is known:
+#   - 'fail' at the first point outside its window
+#   - when the supply reports constant-current mode: every later point would
+#     only show the current limit, so the sweep is decided by on_compliance
+#     ('fail' by default, 'pass' where reaching the limit is expected)
+#   - 'pass' once every point that has a limit has passed; the points after
+#     the last limited one cannot change the outcome
+# check() returns the outcome once it is decided (None before), and the sweep
+# should stop there and move on to the next curve or DUT. On a production line
+# most parts are decided within the first few points.
+#
+#   test = LimitTest(limit_masks(points, {1.0: (1e-3, 1e-2)}))
+#   for index, point in enumerate(points):
+#       ...
+#       if test.check(index, reading, in_current_limit(psu)) is not None:
+#           break
+#   test.outcome, test.reason
+
+# STATus:OPERation:CONDition? bits of the Keysight E36300 / EDU36311A supplies
+CV_BIT = 1 << 8     # channel in constant-voltage mode
+CC_BIT = 1 << 10    # channel in constant-current mode (at its current limit)
+
+
+# Whether a supply channel is in constant-current mode, from its operation status
+def in_current_limit(psu, channel=1):
+    return bool(int(float(psu.query(f'STAT:OPER:COND? (@{channel})'))) & CC_BIT)
+
+
+# low/high masks for the sweep points from {point: (low, high)}; None (or a
+# missing point) means no limit
+def limit_masks(points, limits):
+    points = np.asarray(points, dtype=float)
+    low = np.full(points.shape, np.nan)
+    high = np.full(points.shape, np.nan)
+    for point, (lower, upper) in limits.items():
+        match = np.isclose(points, point)
+        if not match.any():
+            raise ValueError(f'{point} is not a sweep point')
+        low[match] = np.nan if lower is None else lower
+        high[match] = np.nan if upper is None else upper
+    return low, high
+
+
+class LimitTest:
+    def __init__(self, masks, on_compliance='fail'):
+        self.low, self.high = (np.asarray(mask, dtype=float) for mask in masks)
+        limited = np.flatnonzero(np.isfinite(self.low) | np.isfinite(self.high))
+        self.last_limited = limited[-1] if len(limited) else -1
+        self.on_compliance = on_compliance
+        self.outcome = None
+        self.reason = None
+        self.points = 0    # points checked
+
+    def decide(self, outcome, reason):
+        self.outcome = outcome
+        self.reason = reason
+        return outcome
+
+    def check(self, index, value, compliance=False):
+        if self.outcome is not None:
+            return self.outcome
+        self.points += 1
+        limited = np.isfinite(self.low[index]) or np.isfinite(self.high[index])
+        if self.low[index] > value or self.high[index] < value or (limited and np.isnan(value)):
+            return self.decide('fail', f'point {index}: {value:.4g} outside [{self.low[index]:.4g}, '
+                                       f'{self.high[index]:.4g}]')
+        if compliance:
+            return self.decide(self.on_compliance, f'point {index}: supply in current limit')
+        if index >= self.last_limited:
+            return self.decide('pass', f'all limits passed by point {index}')
+        return None
+
+    # Outcome of a sweep that ran out of points before it was decided
+    def finish(self):
+        if self.outcome is None:
+            self.decide('fail', f'only {self.points} points measured')
+        return self.outcome
+
+
+# Limits for a BJT output curve at base current ib (A): IC / IB within
+# beta_limits at limit_vce, or IC below leakage_limit there for IB = 0
+def bjt_limit_masks(ib, vce_points, limit_vce=5.0, beta_limits=(100.0, 300.0), leakage_limit=1e-6):
+    if ib > 0:
+        window = (beta_limits[0] * ib, beta_limits[1] * ib)
+    else:
+        window = (None, leakage_limit)
+    return limit_masks(vce_points, {limit_vce: window})
@@ -0,0 +1,84 @@
+import numpy as np
+
+from measurement import OVERLOAD, query_real64
+
+# Hardware list-mode sweep
+# The whole voltage list is uploaded to the supply's LIST subsystem and the DMM
+# is armed with a trigger count, so the instruments step through the sweep on
+# their own and every reading is pulled back with a single FETCh? at the end.
+#
+# Wiring: the supply's trigger out (digital pin configured as TOUT) must be
+# connected to the DMM's Ext Trig input so the DMM takes one reading per step.
+
+
+# Upload the voltage list to one channel of the supply and put it in list mode
+def upload_voltage_list(psu, voltages, current_limit, dwell, channel=1):
+    points = ','.join(f'{v:g}' for v in voltages)
+    psu.write(f'LIST:VOLT {points}, (@{channel})')
+    psu.write(f'LIST:CURR {",".join([f"{current_limit:g}"] * len(voltages))}, (@{channel})')
+    psu.write(f'LIST:DWEL {",".join([f"{dwell:g}"] * len(voltages))}, (@{channel})')
+    psu.write(f'LIST:COUN 1, (@{channel})')
+    psu.write(f'LIST:STEP AUTO, (@{channel})')
+    psu.write(f'LIST:TOUT:BOST {",".join(["1"] * len(voltages))}, (@{channel})')  # trigger out at each step
+    psu.write(f'LIST:TERM:LAST 0, (@{channel})')   # return to the normal setting when done
+    psu.write(f'VOLT:MODE LIST, (@{channel})')
+    psu.write(f'CURR:MODE LIST, (@{channel})')
+    psu.write('DIG:PIN1:FUNC TOUT')
+    psu.write(f'TRIG:SOUR BUS, (@{channel})')
+
+
+# Configure the DMM for one function and arm it to take `count` externally
+# triggered readings into its reading memory. CONF restores the default
+# integration time (10 NPLC), so set the one the sweep needs afterwards.
+def arm_dmm_buffer(dmm, function, count, trigger_delay=0.0, nplc=1):
+    dmm.write(f'CONF:{function}:DC')
+    dmm.write(f'{function}:DC:NPLC {nplc:g}')
+    dmm.write('TRIG:SOUR EXT')
+    dmm.write('TRIG:SLOP POS')
+    dmm.write(f'TRIG:DEL {trigger_delay:g}')
+    dmm.write(f'TRIG:COUN {count}')
+    dmm.write('SAMP:COUN 1')
+    dmm.write('INIT')
+
+
+# Read back every buffered reading in one transfer. binary=True reads a
+# FORM REAL,64 block into a NumPy array instead of parsing ASCII.
+def fetch_readings(dmm, binary=False):
+    if binary:
+        return query_real64(dmm, 'FETC?')
+    return dmm.query_ascii_values('FETC?')
+
+
+# Run the uploaded list once and return one DMM reading per list point, as a
+# NumPy array with NaN for overloaded readings (+9.9E37).
+# `function` is the DMM function to buffer ('VOLT' or 'CURR').
+# binary=True transfers the readings as float64 and leaves the DMM in ASCII format.
+def run_list_sweep(psu, dmm, voltages, function, dwell, current_limit,
+                   channel=1, trigger_delay=0.0, nplc=1, binary=False):
+    upload_voltage_list(psu, voltages, current_limit, dwell, channel)
+    arm_dmm_buffer(dmm, function, len(voltages), trigger_delay, nplc)
+    if binary:
+        dmm.write('FORM:DATA REAL,64')
+
+    psu.write(f'OUTP ON, (@{channel})')
+    psu.write(f'INIT (@{channel})')
+    psu.query('*OPC?')   # make sure the list is initiated before triggering
+    psu.write('*TRG')
+
+    # FETC? blocks until the DMM has taken every reading, so allow for the
+    # whole list to run before timing out
+    old_timeout = dmm.timeout
+    dmm.timeout = old_timeout + int(1000 * dwell * len(voltages))
+    try:
+        readings = fetch_readings(dmm, binary)
+    finally:
+        dmm.timeout = old_timeout
+        if binary:
+            dmm.write('FORM:DATA ASCii')
+
+    # Leave the supply in fixed mode so normal VOLT writes work again
+    psu.write(f'VOLT:MODE FIX, (@{channel})')
+    psu.write(f'CURR:MODE FIX, (@{channel})')
+    readings = np.asarray(readings, dtype=float)
+    readings[np.abs(readings) >= OVERLOAD] = np.nan
+    return readings
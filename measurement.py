@@ -0,0 +1,281 @@
+import math
+
+import numpy as np
+
+# Configure-once DMM measurement layer
+# MEAS:...? makes the DMM reconfigure function, range and integration time on
+# every call. Here each function is configured with CONF once (with a locked
+# range and NPLC) and every reading after that is a plain READ?. Switching back
+# to a function that is already configured only sends FUNC, which keeps the
+# range and NPLC that function was set up with.
+#
+# With binary=True readings come back as IEEE-754 float64 blocks (FORM REAL,64)
+# instead of ASCII text, so neither the DMM nor Python formats or parses
+# numbers. This pays off for buffered readings (read_many, list sweeps).
+#
+# preset picks the integration time and autozero for a speed/accuracy trade-off:
+#
+#   preset     NPLC  autozero  time per reading (50 Hz)  noise vs 1 NPLC
+#   fast       0.02  OFF       0.4 ms                    ~7x, plus zero drift
+#   balanced   1     ONCE      20 ms                     1x
+#   precise    10    ON        400 ms (2 conversions)    ~0.3x
+#
+# Below 1 NPLC the meter no longer rejects mains hum, so 'fast' readings also
+# carry any ripple on the signal. With autozero OFF the offset is not
+# re-measured and drifts with temperature (datasheet: "autozero off" adder,
+# a few ppm of range). For 'fast' the bound is therefore about 7x the 1 NPLC
+# noise of the range in use plus that adder. aperture= (seconds) sets a
+# mains-independent integration time instead of NPLC.
+#
+# ranges maps a function to a fixed range, 'AUTO' (the DMM autoranges every
+# reading) or 'PREDICT': RangePredictor picks a fixed range for each reading
+# from the previous readings and their trend, and the range only changes (one
+# relay switch) when the signal moves to another decade. An overloaded reading
+# is retried one range up.
+#
+# AdaptiveSampler averages each point only as much as its noise requires: it
+# reads in batches until the standard error of the mean is within tolerance
+# (see below), so quiet points take one reading and noisy ones just enough.
+
+FUNCTION_NAMES = {'VOLT': 'VOLT:DC', 'CURR': 'CURR:DC'}
+
+PRESETS = {
+    'fast': {'nplc': 0.02, 'autozero': 'OFF'},
+    'balanced': {'nplc': 1, 'autozero': 'ONCE'},
+    'precise': {'nplc': 10, 'autozero': 'ON'},
+}
+
+# DC ranges of the 34461A / EDU34450A class of meters
+DMM_RANGES = {
+    'VOLT': (0.1, 1.0, 10.0, 100.0, 1000.0),
+    'CURR': (1e-4, 1e-3, 1e-2, 0.1, 1.0, 3.0),
+}
+
+# Readings at or above this are the instruments' overload / "no valid
+# measurement" value (+9.9E37, from the DMMs and the scope alike). Every module
+# that checks readings for it imports it from here.
+OVERLOAD = 9.9e37
+
+
+class RangePredictor:
+    def __init__(self, ranges):
+        self.ranges = ranges
+        self.history = []
+
+    # Range for the next reading: it must hold both the last reading and the
+    # next one extrapolated from the last two. None until there is a reading.
+    def predict(self):
+        if not self.history:
+            return None
+        expected = abs(self.history[-1])
+        if len(self.history) > 1:
+            expected = max(expected, abs(2 * self.history[-1] - self.history[-2]))
+        return next((r for r in self.ranges if expected <= r), self.ranges[-1])
+
+    def larger(self, current):
+        return next((r for r in self.ranges if r > current), None)
+
+    def record(self, value):
+        self.history = self.history[-1:] + [value]
+
+
+class DmmMeasurement:
+    # ranges maps 'VOLT'/'CURR' to a fixed range, 'AUTO' or 'PREDICT'.
+    # nplc and aperture override the preset's integration time.
+    def __init__(self, dmm, nplc=None, ranges=None, binary=False, preset=None, aperture=None):
+        settings = PRESETS[preset] if preset is not None else {}
+        self.dmm = dmm
+        self.nplc = nplc if nplc is not None else settings.get('nplc', 1)
+        self.aperture = aperture
+        self.autozero = settings.get('autozero')
+        self.ranges = ranges if ranges is not None else {}
+        self.binary = binary
+        self.function = None
+        self.configured = set()
+        self.predictors = {}
+        self.active_range = {}     # fixed range the DMM is on, per predicted function
+        self.range_changes = 0
+        self.overloads = 0
+
+    def configure(self, function):
+        if function == self.function:
+            return
+        if self.binary and not self.configured:
+            self.dmm.write('FORM:DATA REAL,64')
+        name = FUNCTION_NAMES[function]
+        if function in self.configured:
+            self.dmm.write(f'FUNC "{name}"')
+        else:
+            # A predicted range starts on AUTO for the first reading
+            initial = self.ranges.get(function, 'AUTO')
+            self.dmm.write(f'CONF:{name} {"AUTO" if initial == "PREDICT" else initial}')
+            if self.aperture is not None:
+                self.dmm.write(f'{name}:APER {self.aperture}')
+            else:
+                self.dmm.write(f'{name}:NPLC {self.nplc}')
+            if self.autozero is not None:
+                self.dmm.write(f'{name}:ZERO:AUTO {self.autozero}')
+            if initial == 'PREDICT':
+                self.predictors[function] = RangePredictor(DMM_RANGES[function])
+                self.active_range[function] = None
+            self.configured.add(function)
+        self.function = function
+
+    # Forget the cached configuration (e.g. after a *RST)
+    def reset(self):
+        self.function = None
+        self.configured.clear()
+        self.predictors.clear()
+        self.active_range.clear()
+
+    def set_range(self, function, value):
+        self.dmm.write(f'{FUNCTION_NAMES[function]}:RANG {value:g}')
+        self.active_range[function] = value
+        self.range_changes += 1
+
+    # Switch to the predicted range before a reading
+    def select_range(self, function):
+        predictor = self.predictors.get(function)
+        if predictor is None:
+            return
+        predicted = predictor.predict()
+        if predicted is not None and predicted != self.active_range[function]:
+            self.set_range(function, predicted)
+
+    # Step up one range after an overload; False if already on the top range
+    # (or still autoranging)
+    def range_up(self, function):
+        predictor = self.predictors.get(function)
+        if predictor is None or self.active_range[function] is None:
+            return False
+        larger = predictor.larger(self.active_range[function])
+        if larger is None:
+            return False
+        self.overloads += 1
+        self.set_range(function, larger)
+        return True
+
+    def read_once(self):
+        if self.binary:
+            return float(query_real64(self.dmm, 'READ?')[0])
+        return float(self.dmm.query('READ?'))
+
+    def read(self, function):
+        self.configure(function)
+        self.select_range(function)
+        value = self.read_once()
+        while abs(value) >= OVERLOAD and self.range_up(function):
+            value = self.read_once()
+        if function in self.predictors:
+            self.predictors[function].record(value)
+        return value
+
+    # Take `count` readings in one INIT/FETC? transaction. In binary mode they
+    # are returned as a NumPy array.
+    def read_many(self, function, count):
+        self.configure(function)
+        self.select_range(function)
+        self.dmm.write(f'SAMP:COUN {count}')
+        while True:
+            self.dmm.write('INIT')
+            if self.binary:
+                readings = query_real64(self.dmm, 'FETC?')
+            else:
+                readings = self.dmm.query_ascii_values('FETC?')
+            if not any(abs(value) >= OVERLOAD for value in readings) or not self.range_up(function):
+                break
+        self.dmm.write('SAMP:COUN 1')
+        if function in self.predictors and len(readings):
+            self.predictors[function].record(max(readings, key=abs))
+        return readings
+
+    # Dual-function sweep segment: apply every point and read the first function,
+    # then apply every point again for the next function, so the DMM only
+    # switches function once per function instead of twice per point.
+    # settle, if given, is called as settle(read) and returns the settled reading.
+    # Returns a dict of reading lists keyed by function.
+    def sweep_grouped(self, points, apply, functions=('VOLT', 'CURR'), settle=None):
+        results = {}
+        for function in functions:
+            self.configure(function)
+            readings = []
+            for point in points:
+                apply(point)
+                if settle is None:
+                    readings.append(self.read(function))
+                else:
+                    readings.append(settle(lambda: self.read(function)))
+            results[function] = readings
+        return results
+
+
+# Adaptive averaging
+# sample() reads a function in batches (one read_many transaction each) until
+# the standard error of the mean is at most
+#
+#   tolerance[function] + rel_tolerance * |mean|
+#
+# or max_samples readings have been taken, and returns (mean, std, n). The
+# noise of a single reading is pooled over every point measured on the same
+# range, so once it is known a quiet point stops after one reading and a noisy
+# one asks for all the readings it needs in a single batch. Until the noise of
+# the range is known the first batch is `batch` readings. std is only ever
+# measured at the point itself: it is NaN for a point that took one reading.
+class AdaptiveSampler:
+    def __init__(self, meter, tolerance, rel_tolerance=0.0, batch=4, max_samples=32):
+        self.meter = meter
+        self.tolerance = tolerance
+        self.rel_tolerance = rel_tolerance
+        self.batch = max(batch, 2)
+        self.max_samples = max_samples
+        self.pooled = {}    # (function, range) -> [sum of squared deviations, degrees of freedom]
+        self.points = 0
+        self.readings = 0
+
+    def target(self, function, mean):
+        return self.tolerance.get(function, 0.0) + self.rel_tolerance * abs(mean)
+
+    # Standard deviation of one reading: pooled over earlier points on this
+    # range and the readings taken so far at this point
+    def noise(self, key, values):
+        squares, dof = self.pooled.get(key, (0.0, 0))
+        if len(values) > 1:
+            squares += float(np.var(values)) * len(values)
+            dof += len(values) - 1
+        return math.sqrt(squares / dof) if dof else None
+
+    # readings: any already taken at this point (e.g. the settled reading)
+    def sample(self, function, readings=()):
+        values = [float(value) for value in readings] or [self.meter.read(function)]
+        while True:
+            key = (function, self.meter.active_range.get(function))
+            sigma = self.noise(key, values)
+            target = self.target(function, np.mean(values))
+            if sigma is None:
+                needed = self.batch
+            elif target > 0:
+                needed = math.ceil((sigma / target) ** 2)
+            else:
+                needed = self.max_samples
+            needed = max(min(needed, self.max_samples), 1)
+            if len(values) >= needed:
+                break
+            count = needed - len(values)
+            if count == 1:
+                values.append(self.meter.read(function))
+            else:
+                values.extend(float(value) for value in self.meter.read_many(function, count))
+        std = math.nan
+        if len(values) > 1:
+            squares, dof = self.pooled.get(key, (0.0, 0))
+            self.pooled[key] = (squares + float(np.var(values)) * len(values), dof + len(values) - 1)
+            std = float(np.std(values, ddof=1))
+        self.points += 1
+        self.readings += len(values)
+        return float(np.mean(values)), std, len(values)
+
+
+# Query readings sent as a FORM REAL,64 block (big-endian, the default byte
+# order) into a NumPy array
+def query_real64(dmm, command):
+    return dmm.query_binary_values(command, datatype='d', is_big_endian=True, container=np.array)
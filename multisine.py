@@ -0,0 +1,99 @@
+import numpy as np
+
+from waveform import capture_channels
+
+# Broadband (multi-sine / log-chirp) frequency response
+# Instead of stepping the generator through every frequency, one period of a
+# broadband waveform is uploaded to the wavegen as an arbitrary waveform and
+# repeated at base_freq. All of its energy sits on harmonics of base_freq, so a
+# single long capture of both scope channels contains the response at every
+# test frequency. The transfer function is the averaged cross-spectrum
+# H = sum(conj(X) Y) / sum(|X|^2) over the whole periods in the record,
+# evaluated at the tone frequencies.
+
+ARB_POINTS = 16384  # DG1000Z volatile arbitrary waveform length
+
+
+# Snap the requested frequencies to distinct harmonics of base_freq
+def tone_harmonics(frequencies, base_freq):
+    harmonics = np.round(np.asarray(frequencies, dtype=float) / base_freq).astype(int)
+    return np.unique(np.maximum(harmonics, 1))
+
+
+# One period of equal-amplitude harmonics with Schroeder phases, which keeps
+# the crest factor low so each tone gets as much amplitude as possible.
+# Normalized to +/-1.
+def multisine(harmonics, points=ARB_POINTS):
+    k = np.asarray(harmonics)
+    n = np.arange(points)[:, np.newaxis] / points
+    phases = -np.pi * k * (k - 1) / len(k)
+    wave = np.cos(2 * np.pi * k * n + phases).sum(axis=1)
+    return wave / np.abs(wave).max()
+
+
+# One period of a logarithmic chirp from harmonic k_start to k_stop
+def log_chirp(k_start, k_stop, points=ARB_POINTS):
+    n = np.arange(points) / points
+    ratio = k_stop / k_start
+    return np.sin(2 * np.pi * k_start * (ratio ** n - 1) / np.log(ratio))
+
+
+# Upload one period of the waveform (values in +/-1) to the DG1000Z's volatile
+# memory and play it at base_freq with the given peak-to-peak amplitude
+def upload_arb(wavegen, wave, base_freq, amplitude, channel=1):
+    data = ','.join(f'{v:.4f}' for v in wave)
+    wavegen.write(f':SOURce{channel}:TRACe:DATA VOLATILE,{data}')
+    wavegen.write(f':SOURce{channel}:FREQuency {base_freq}')
+    wavegen.write(f':SOURce{channel}:VOLTage:AMPLitude {amplitude}')
+    wavegen.write(f':SOURce{channel}:VOLTage:OFFSet 0')
+
+
+# Cross-spectrum estimate of the transfer function y/x at the given
+# frequencies, averaged over every whole period of base_freq in the record.
+# Returns (gain, phase_degrees), phase being output relative to input.
+def transfer_function(t, x, y, frequencies, base_freq):
+    t = np.asarray(t, dtype=float)
+    period = 1 / base_freq
+    segment = np.floor((t - t[0]) / period).astype(int)
+    n_periods = max(int(segment[-1]), 1)
+    keep = segment < n_periods
+    t, x, y, segment = t[keep], np.asarray(x)[keep], np.asarray(y)[keep], segment[keep]
+
+    # Single-bin DFTs at every tone for every period, as two matrix products
+    basis = np.exp(-2j * np.pi * np.outer(t, frequencies))
+    masks = segment[:, np.newaxis] == np.arange(n_periods)
+    spectrum_x = (masks * x[:, np.newaxis]).T @ basis
+    spectrum_y = (masks * y[:, np.newaxis]).T @ basis
+
+    h = (np.conj(spectrum_x) * spectrum_y).sum(axis=0) / (np.abs(spectrum_x) ** 2).sum(axis=0)
+    return np.abs(h), np.degrees(np.angle(h))
+
+
+# Measure the whole frequency response with a single broadband acquisition.
+# kind is 'multisine' or 'chirp'. Returns (frequencies, gains, phases) at the
+# harmonics of base_freq nearest to the requested frequencies.
+def measure_broadband(scope, wavegen, frequencies, base_freq, kind='multisine',
+                      amplitude=2.0, periods=4, points=100000, scaler=None):
+    harmonics = tone_harmonics(frequencies, base_freq)
+    if kind == 'chirp':
+        wave = log_chirp(harmonics[0], harmonics[-1])
+    else:
+        wave = multisine(harmonics)
+
+    upload_arb(wavegen, wave, base_freq, amplitude)
+    wavegen.write(':OUTPut1:STATe ON')
+
+    # Show a whole number of waveform periods, with enough memory to resolve
+    # the highest tone
+    scope.write(f':TIMebase:SCALe {periods / (base_freq * 10):.6g}')
+    t, volts = capture_channels(scope, (1, 2), points, points_mode='RAW')
+    if scaler is not None:
+        in_range = [scaler.update(channel, vpp) for channel, vpp in zip((1, 2), np.ptp(volts, axis=1))]
+        if not all(in_range):
+            t, volts = capture_channels(scope, (1, 2), points, points_mode='RAW')
+
+    # A chirp has energy on every harmonic in its range; only the requested
+    # (snapped) frequencies are evaluated either way
+    tone_freqs = harmonics * base_freq
+    gains, phases = transfer_function(t, volts[0], volts[1], tone_freqs, base_freq)
+    return tone_freqs, gains, phases
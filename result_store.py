@@ -0,0 +1,185 @@
+import json
+import os
+import time
+
+import numpy as np
+
+# Streaming on-disk sweep results
+# A result store is a directory holding one raw little-endian file per column
+# (<column>.bin) and a small columns.json that describes them:
+#
+#   iv_results/columns.json   {"columns": {"voltage": "<f8", ...}, "metadata": {...}}
+#   iv_results/voltage.bin
+#   iv_results/current.bin
+#
+# ResultWriter buffers points in a fixed-size chunk and appends the chunk to
+# the column files when it fills or when flush_interval seconds have passed.
+# Memory stays constant however long the run is, and each point only costs a
+# copy into the buffer. The files are plain appends with no footer or index to
+# rewrite, so a crash loses at most the last flush_interval seconds of points.
+# read_results() drops a trailing row that only some columns reached, and
+# np.memmap can open the columns directly.
+#
+#   with ResultWriter('iv_results', ['voltage', 'current'], metadata={'dut': 'D1'}) as writer:
+#       writer.append(voltage=v, current=i)
+#   columns, metadata = read_results('iv_results')
+
+HEADER_FILE = 'columns.json'
+
+
+class ResultWriter:
+    # columns is a list of names (stored as float64) or a dict of name -> dtype.
+    # mode 'w' starts a new store, 'a' appends to an existing one with the same columns.
+    # fsync=True also forces every flushed chunk to the disk (slower, survives power loss).
+    def __init__(self, path, columns, metadata=None, chunk_size=256, flush_interval=1.0, mode='w', fsync=False):
+        if not isinstance(columns, dict):
+            columns = {name: '<f8' for name in columns}
+        self.path = path
+        self.columns = {name: np.dtype(dtype).newbyteorder('<') for name, dtype in columns.items()}
+        self.chunk_size = chunk_size
+        self.flush_interval = flush_interval
+        self.last_flush = time.monotonic()
+        self.fsync = fsync
+        self.buffer = {name: np.empty(chunk_size, dtype) for name, dtype in self.columns.items()}
+        self.buffered = 0
+
+        os.makedirs(path, exist_ok=True)
+        header_path = os.path.join(path, HEADER_FILE)
+        if mode == 'a' and os.path.exists(header_path):
+            header = read_header(path)
+            if list(header['columns']) != list(self.columns):
+                raise ValueError(f"{path} has columns {list(header['columns'])}, not {list(self.columns)}")
+            self.metadata = header['metadata']
+            self.metadata.update(metadata or {})
+            self.rows = trim_columns(path, header)
+        else:
+            self.metadata = dict(metadata or {})
+            self.rows = 0
+            for name in self.columns:
+                open(column_file(path, name), 'wb').close()
+        self.write_header()
+        self.files = {name: open(column_file(path, name), 'ab') for name in self.columns}
+
+    def write_header(self):
+        header = {'columns': {name: dtype.str for name, dtype in self.columns.items()},
+                  'metadata': self.metadata}
+        temporary = os.path.join(self.path, HEADER_FILE + '.tmp')
+        with open(temporary, 'w') as f:
+            json.dump(header, f, indent=2, default=str)
+        os.replace(temporary, os.path.join(self.path, HEADER_FILE))
+
+    # Add or change metadata entries (written straight away)
+    def update_metadata(self, **entries):
+        self.metadata.update(entries)
+        self.write_header()
+
+    # Add one point; every column must be given
+    def append(self, **values):
+        for name, column in self.buffer.items():
+            column[self.buffered] = values[name]
+        self.buffered += 1
+        if self.buffered == self.chunk_size or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    # Add many points at once, e.g. a whole list-mode sweep
+    def extend(self, **columns):
+        arrays = {name: np.asarray(columns[name], dtype=dtype).ravel() for name, dtype in self.columns.items()}
+        count = len(next(iter(arrays.values())))
+        if any(len(array) != count for array in arrays.values()):
+            raise ValueError('all columns must have the same length')
+        self.flush()
+        for name, array in arrays.items():
+            self.files[name].write(array.tobytes())
+        self.rows += count
+        self.sync()
+
+    def flush(self):
+        if not self.buffered:
+            return
+        for name, column in self.buffer.items():
+            self.files[name].write(column[:self.buffered].tobytes())
+        self.rows += self.buffered
+        self.buffered = 0
+        self.sync()
+
+    def sync(self):
+        self.last_flush = time.monotonic()
+        for f in self.files.values():
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+
+    def close(self):
+        if self.files is None:
+            return
+        self.flush()
+        for f in self.files.values():
+            f.close()
+        self.files = None
+
+    def __len__(self):
+        return self.rows + self.buffered
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def column_file(path, name):
+    return os.path.join(path, f'{name}.bin')
+
+
+def read_header(path):
+    with open(os.path.join(path, HEADER_FILE)) as f:
+        return json.load(f)
+
+
+# Number of complete rows, i.e. the length of the shortest column
+def complete_rows(path, header):
+    return min(os.path.getsize(column_file(path, name)) // np.dtype(dtype).itemsize
+               for name, dtype in header['columns'].items())
+
+
+# Cut every column back to the last complete row (after a crash mid-flush)
+def trim_columns(path, header):
+    rows = complete_rows(path, header)
+    for name, dtype in header['columns'].items():
+        with open(column_file(path, name), 'r+b') as f:
+            f.truncate(rows * np.dtype(dtype).itemsize)
+    return rows
+
+
+# Load a store as (dict of column arrays, metadata). mmap=True maps the column
+# files instead of reading them into memory.
+def read_results(path, mmap=False):
+    header = read_header(path)
+    rows = complete_rows(path, header)
+    columns = {}
+    for name, dtype in header['columns'].items():
+        if mmap and rows:
+            columns[name] = np.memmap(column_file(path, name), dtype=dtype, mode='r', shape=(rows,))
+        else:
+            columns[name] = np.fromfile(column_file(path, name), dtype=dtype, count=rows)
+    return columns, header['metadata']
+
+
+# Reopen the store at path to carry on an interrupted sweep. If it holds an
+# unfinished run with the same config (sweep settings, instrument setup, ...)
+# new points are appended to it; otherwise a new store is started.
+# Returns (writer, columns already measured). Call
+# writer.update_metadata(complete=True) once the sweep has finished, so the
+# next run starts over instead of resuming.
+def resume_results(path, columns, config, metadata=None):
+    config = json.loads(json.dumps(config, default=str))
+    done = None
+    if os.path.exists(os.path.join(path, HEADER_FILE)):
+        previous, previous_metadata = read_results(path)
+        if previous_metadata.get('config') == config and not previous_metadata.get('complete'):
+            done = previous
+    metadata = dict(metadata or {}, config=config, complete=False)
+    writer = ResultWriter(path, columns, metadata, mode='w' if done is None else 'a')
+    if done is None:
+        done = {name: np.empty(0, dtype) for name, dtype in writer.columns.items()}
+    return writer, done
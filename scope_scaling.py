@@ -0,0 +1,137 @@
+import numpy as np
+
+from measurement import OVERLOAD
+from settle import wait_for_settle
+
+# Predictive scope scaling for frequency sweeps
+# The stimulus frequency is known, so the timebase can be computed directly
+# (a fixed number of periods on screen), and the vertical scale of each channel
+# is predicted from the amplitudes already measured at the neighbouring
+# frequencies (interpolated on log axes, or the nearest one at either end). For
+# a sweep in order that is the previous frequency, and frequencies inserted
+# between measured ones (adaptive sweeps) start on the right scale too. :AUT is
+# only used as a fallback when a measurement fails or stays clipped, since it
+# takes seconds and resets the channel coupling.
+
+HORIZONTAL_DIVISIONS = 10
+VERTICAL_DIVISIONS = 8
+MIN_VOLTS_PER_DIV = 0.001
+MAX_VOLTS_PER_DIV = 5.0
+
+
+# Amplitude expected at freq from {frequency: amplitude measured there}
+def predict_amplitude(amplitudes, freq):
+    freqs = sorted(amplitudes)
+    return float(np.exp(np.interp(np.log(freq), np.log(freqs), [np.log(amplitudes[f]) for f in freqs])))
+
+
+class ScopeScaler:
+    # periods: signal periods shown on screen
+    # fill: fraction of the screen height a signal should use after rescaling
+    def __init__(self, scope, channels=(1, 2), periods=3, fill=0.6,
+                 coupling='AC', max_retries=3, settle_timeout=1.0):
+        self.scope = scope
+        self.channels = channels
+        self.periods = periods
+        self.fill = fill
+        self.coupling = coupling
+        self.max_retries = max_retries
+        self.settle_timeout = settle_timeout
+        self.scales = {}
+        self.frequency = None
+        self.amplitudes = {}    # channel -> {frequency: amplitude measured there}
+
+    # Set coupling (and optionally an initial vertical scale) on every channel
+    def setup(self, initial_amplitude=None):
+        for channel in self.channels:
+            self.scope.write(f':CHANnel{channel}:COUPling {self.coupling}')
+            self.scope.write(f':CHANnel{channel}:OFFSet 0')
+            if initial_amplitude is not None:
+                self.set_vertical(channel, initial_amplitude)
+
+    def set_frequency(self, freq):
+        scale = self.periods / (freq * HORIZONTAL_DIVISIONS)
+        self.scope.write(f':TIMebase:SCALe {scale:.6g}')
+        self.frequency = freq
+        for channel, amplitudes in self.amplitudes.items():
+            vamp = predict_amplitude(amplitudes, freq)
+            if self.vertical_scale(vamp) != self.scales.get(channel):
+                self.set_vertical(channel, vamp)
+
+    # Remember a valid amplitude measured at the current frequency
+    def record(self, channel, vamp):
+        if self.frequency is not None and vamp > 0:
+            self.amplitudes.setdefault(channel, {})[self.frequency] = vamp
+
+    def vertical_scale(self, vamp):
+        scale = vamp / (VERTICAL_DIVISIONS * self.fill)
+        return min(max(scale, MIN_VOLTS_PER_DIV), MAX_VOLTS_PER_DIV)
+
+    # Scale a channel so an amplitude of `vamp` fills `fill` of the screen
+    def set_vertical(self, channel, vamp):
+        scale = self.vertical_scale(vamp)
+        self.scope.write(f':CHANnel{channel}:SCALe {scale:.4g}')
+        self.scales[channel] = scale
+
+    def autoscale(self):
+        self.scope.write(':AUT')
+        self.scope.query('*OPC?')
+        # :AUT changes coupling and scale, so restore coupling and re-read the scales
+        for channel in self.channels:
+            self.scope.write(f':CHANnel{channel}:COUPling {self.coupling}')
+            self.scales[channel] = float(self.scope.query(f':CHANnel{channel}:SCALe?'))
+
+    # Predict the next scale from an amplitude measured some other way (e.g. from
+    # a captured waveform). Returns False if the signal looked clipped.
+    def update(self, channel, vamp):
+        scale = self.scales.get(channel)
+        if scale is not None and vamp > 0.9 * scale * VERTICAL_DIVISIONS and scale < MAX_VOLTS_PER_DIV:
+            self.set_vertical(channel, vamp * 2)
+            return False
+        self.set_vertical(channel, vamp)
+        self.record(channel, vamp)
+        return True
+
+    def read_vamp(self, channel, settle=False):
+        read = lambda: float(self.scope.query(f':MEASure:VAMP? CHAN{channel}'))
+        if settle:
+            # Give the scope time to acquire with the new scale
+            return wait_for_settle(read, tolerance=1e-3, rel_tolerance=0.02,
+                                   poll_interval=0.05, timeout=self.settle_timeout)
+        return read()
+
+    # Measure the amplitude of a channel, rescaling when the signal is clipped
+    # or uses too little of the screen, and falling back to :AUT when that
+    # does not give a valid reading. The measured amplitude sets the scale
+    # predicted for the next frequency.
+    def measure_vamp(self, channel):
+        vamp = self.read_vamp(channel)
+        for _ in range(self.max_retries):
+            scale = self.scales.get(channel)
+            if abs(vamp) >= OVERLOAD:
+                if scale is None:
+                    break
+                # No valid measurement: zoom out and try again
+                self.set_vertical(channel, scale * VERTICAL_DIVISIONS * 2)
+            elif scale is None:
+                self.set_vertical(channel, vamp)
+            elif vamp > 0.9 * scale * VERTICAL_DIVISIONS and scale < MAX_VOLTS_PER_DIV:
+                # Clipped (or nearly): the real amplitude is at least this big
+                self.set_vertical(channel, vamp * 2)
+            elif vamp < 0.25 * scale * VERTICAL_DIVISIONS and scale > MIN_VOLTS_PER_DIV:
+                # Too small for a good measurement: zoom in
+                self.set_vertical(channel, vamp)
+            else:
+                # Good reading; keep the scale it implies for the next frequency
+                self.set_vertical(channel, vamp)
+                self.record(channel, vamp)
+                return vamp
+            vamp = self.read_vamp(channel, settle=True)
+
+        self.autoscale()
+        vamp = self.read_vamp(channel, settle=True)
+        if abs(vamp) >= OVERLOAD:
+            raise ValueError(f'Could not measure a valid amplitude on channel {channel}')
+        self.set_vertical(channel, vamp)
+        self.record(channel, vamp)
+        return vamp
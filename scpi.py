@@ -0,0 +1,52 @@
+import re
+
+# SCPI command parsing shared by the simulator and the instrument layers
+# Commands are normalized so that the different spellings the scripts use for
+# the same setting compare equal, e.g. 'SOUR:VOLT:LEV:IMM:AMP 5 @1' and
+# 'VOLTage 5, (@1)' both become path ('VOLT',), channel 1, args ['5'].
+
+# Nodes that are optional in the SCPI trees of these instruments ('AMP' is the
+# abbreviation the BJT scripts use for AMPLitude)
+OPTIONAL_NODES = {'LEV', 'IMM', 'AMPL', 'AMP', 'FIX', 'DC'}
+
+
+# SCPI short form of a header node: CHANNEL -> CHAN, TIMEBASE -> TIM
+def short_form(node):
+    node = node.upper()
+    if node.startswith('*') or len(node) <= 4:
+        return node
+    return node[:3] if node[3] in 'AEIOU' else node[:4]
+
+
+# Split a command header into its normalized path and numeric suffix,
+# e.g. ':SOURce1:VOLTage:LEVel:IMMediate:AMPLitude' -> ('VOLT',), 1
+def parse_header(header):
+    path = []
+    suffix = None
+    for node in header.strip(':').rstrip('?').split(':'):
+        match = re.match(r'([A-Za-z*]+)(\d*)$', node)
+        if match is None:
+            path.append(node.upper())
+            continue
+        name = short_form(match.group(1))
+        if match.group(2):
+            suffix = int(match.group(2))
+        if name in OPTIONAL_NODES or (name == 'SOUR' and not path) or (name == 'STAT' and path == ['OUTP']):
+            continue
+        path.append(name)
+    return tuple(path), suffix
+
+
+# Split one command (no ';') into (path, suffix, channel, args, is_query).
+# channel comes from a "(@1)" or "@1" channel list, which is removed from args.
+def parse_command(command):
+    header, _, args = command.strip().partition(' ')
+    is_query = header.endswith('?')
+    path, suffix = parse_header(header)
+    channel = None
+    match = re.search(r'\(?@(\d+)\)?', args)
+    if match is not None:
+        channel = int(match.group(1))
+        args = args[:match.start()] + args[match.end():]
+    args = [arg.strip() for arg in args.split(',') if arg.strip()]
+    return path, suffix, channel, args, is_query
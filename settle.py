@@ -0,0 +1,39 @@
+import time
+
+from measurement import OVERLOAD
+
+
+# Poll read() until `consecutive` readings in a row agree to within
+# tolerance + rel_tolerance * |reading|, and return the last reading.
+# Overload / "measurement not available" readings (OVERLOAD) never count as
+# settled. If the readings have not converged after `timeout` seconds the
+# latest valid reading is returned anyway, so a slow DUT is never worse off
+# than with a fixed time.sleep(timeout).
+def wait_for_settle(read, tolerance=1e-3, rel_tolerance=1e-3, consecutive=2,
+                    min_delay=0.0, poll_interval=0.02, timeout=1.0):
+    start = time.monotonic()
+    if min_delay > 0:
+        time.sleep(min_delay)
+
+    previous = None
+    matches = 0
+    while True:
+        reading = read()
+
+        if abs(reading) < OVERLOAD:
+            if previous is not None and \
+                    abs(reading - previous) <= tolerance + rel_tolerance * abs(reading):
+                matches += 1
+            else:
+                matches = 1
+            previous = reading
+            if matches >= consecutive:
+                return reading
+        else:
+            matches = 0
+
+        if time.monotonic() - start >= timeout:
+            # Fall back to the last valid reading we have
+            return reading if previous is None else previous
+
+        time.sleep(poll_interval)
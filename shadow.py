@@ -0,0 +1,161 @@
+import re
+
+from scpi import parse_command, short_form
+
+# Shadow registers: skip SCPI writes that would not change instrument state
+# ShadowInstrument wraps a pyvisa resource. It remembers the last value written
+# to each settable parameter and drops a write that sets the same value
+# again, e.g. 'OUTPut 1, (@1)' at every sweep point. Spellings are
+# normalized first (see scpi.py), so 'OUTP:STAT ON @1' after 'OUTPut 1, (@1)'
+# is also recognized as unchanged.
+#
+# Only the parameters in SETTINGS are remembered. Every other command is
+# always sent. The remembered state is dropped:
+#   - after commands that change other settings as a side effect (*RST, :AUT,
+#     CONF, MEAS:<function>?, list mode, ...)
+#   - when a call fails, or SYST:ERR? reports an error, since the instrument
+#     may not have taken the value
+#   - on invalidate(), e.g. after front-panel changes or a protection trip
+#     (the supply turning its own output off is not seen here)
+#
+#   psu, dmm = shadow(psu, dmm)
+
+# Settable parameters, by normalized path
+SETTINGS = {
+    # power supply / SMU
+    ('VOLT',), ('CURR',), ('OUTP',), ('VOLT', 'PROT'), ('CURR', 'PROT'),
+    # DMM
+    ('FUNC',), ('VOLT', 'NPLC'), ('CURR', 'NPLC'), ('VOLT', 'RANG'), ('CURR', 'RANG'),
+    ('VOLT', 'RANG', 'AUTO'), ('CURR', 'RANG', 'AUTO'), ('VOLT', 'ZERO', 'AUTO'), ('CURR', 'ZERO', 'AUTO'),
+    ('VOLT', 'APER'), ('CURR', 'APER'),
+    ('TRIG', 'SOUR'), ('TRIG', 'DEL'), ('TRIG', 'COUN'), ('SAMP', 'COUN'),
+    # scope
+    ('CHAN', 'DISP'), ('CHAN', 'COUP'), ('CHAN', 'SCAL'), ('CHAN', 'OFFS'), ('TIM', 'SCAL'), ('TIM', 'POS'),
+    ('WAV', 'FORM'), ('WAV', 'BYT'), ('WAV', 'SOUR'), ('WAV', 'POIN'), ('WAV', 'POIN', 'MODE'), ('ACQ', 'TYPE'),
+    # wavegen
+    ('FREQ',), ('FUNC', 'SHAP'), ('VOLT', 'OFFS'),
+}
+
+# Commands (path prefixes) after which nothing remembered can be trusted
+INVALIDATING = {
+    ('*RST',), ('*RCL',), ('SYST', 'PRES'), ('AUT',), ('CONF',), ('INST',),
+    ('VOLT', 'MODE'), ('CURR', 'MODE'), ('TRAC', 'DATA'),
+} | {('MEAS', function) for function in ('VOLT', 'CURR', 'RES', 'FRES', 'FREQ', 'PER', 'CAP', 'TEMP', 'DIOD', 'CONT')}
+
+
+# Comparable form of a command's arguments: '1' == 'ON' == '1.0', 'CHANnel1' == 'CHAN1'
+def normalize_args(args):
+    values = []
+    for arg in args:
+        try:
+            values.append(float(arg))
+            continue
+        except ValueError:
+            pass
+        word = arg.strip('"\'').upper()
+        if word in ('ON', 'OFF'):
+            values.append(1.0 if word == 'ON' else 0.0)
+            continue
+        match = re.match(r'([A-Z]+)(\d*)$', word)
+        values.append(short_form(match.group(1)) + match.group(2) if match else word)
+    return tuple(values)
+
+
+class ShadowInstrument:
+    def __init__(self, instrument):
+        self.__dict__['instrument'] = instrument
+        self.__dict__['values'] = {}          # (path, channel) -> normalized args
+        self.__dict__['peers'] = [self]       # wrappers of the same physical instrument
+        self.__dict__['sent'] = 0
+        self.__dict__['skipped'] = 0
+
+    def __getattr__(self, name):
+        return getattr(self.instrument, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.instrument, name, value)
+
+    def invalidate(self):
+        for peer in self.peers:
+            peer.values.clear()
+
+    # Run the commands of a message against a copy of the remembered state.
+    # Returns (commands to send, state after the message, whether it invalidates).
+    def plan(self, message, skip):
+        values = dict(self.values)
+        commands = []
+        invalidated = False
+        for command in message.split(';'):
+            if not command.strip():
+                continue
+            path, suffix, channel, args, is_query = parse_command(command)
+            channel = channel if channel is not None else suffix
+            if any(path[:len(prefix)] == prefix for prefix in INVALIDATING):
+                values.clear()
+                invalidated = True
+            elif path in SETTINGS and args and not is_query:
+                value = normalize_args(args)
+                if skip and values.get((path, channel)) == value:
+                    continue
+                # An unnumbered command may act on any channel, so forget the other spellings
+                for key in [key for key in values if key[0] == path and (channel is None or key[1] is None)]:
+                    del values[key]
+                values[(path, channel)] = value
+            commands.append(command.strip())
+        return commands, values, invalidated
+
+    def apply(self, values, invalidated):
+        if invalidated:
+            self.invalidate()
+        self.__dict__['values'] = values
+
+    def write(self, message, *args, **kwargs):
+        commands, values, invalidated = self.plan(message, skip=True)
+        if not commands:
+            self.__dict__['skipped'] += 1
+            return 0
+        try:
+            result = self.instrument.write(';'.join(commands), *args, **kwargs)
+        except Exception:
+            self.invalidate()
+            raise
+        self.__dict__['sent'] += 1
+        self.apply(values, invalidated)
+        return result
+
+    # Queries always go out; any settings in the message are remembered
+    def transact(self, method, message, *args, **kwargs):
+        commands, values, invalidated = self.plan(message, skip=False)
+        try:
+            reply = getattr(self.instrument, method)(message, *args, **kwargs)
+        except Exception:
+            self.invalidate()
+            raise
+        self.__dict__['sent'] += 1
+        self.apply(values, invalidated)
+        if commands and parse_command(commands[-1])[0] == ('SYST', 'ERR') and not str(reply).lstrip('+').startswith('0'):
+            self.invalidate()
+        return reply
+
+    def query(self, message, *args, **kwargs):
+        return self.transact('query', message, *args, **kwargs)
+
+    def query_ascii_values(self, message, *args, **kwargs):
+        return self.transact('query_ascii_values', message, *args, **kwargs)
+
+    def query_binary_values(self, message, *args, **kwargs):
+        return self.transact('query_binary_values', message, *args, **kwargs)
+
+
+# Wrap instruments in ShadowInstruments. Wrappers of the same resource (one
+# address opened as psu, dmm and smu) each keep their own values, but an
+# invalidating command through any of them clears all of them.
+def shadow(*instruments):
+    wrapped = [ShadowInstrument(instrument) for instrument in instruments]
+    groups = {}
+    for wrapper in wrapped:
+        groups.setdefault(wrapper.instrument.resource_name, []).append(wrapper)
+    for peers in groups.values():
+        for wrapper in peers:
+            wrapper.__dict__['peers'] = peers
+    return wrapped[0] if len(wrapped) == 1 else wrapped
@@ -0,0 +1,774 @@
+import math
+import re
+import time
+
+import numpy as np
+import pyvisa
+from pyvisa.constants import StatusCode
+
+from limit_test import CC_BIT, CV_BIT
+from measurement import DMM_RANGES, OVERLOAD
+from scpi import parse_command, short_form
+
+# Simulated instrument backend
+# A drop-in stand-in for pyvisa.ResourceManager that implements the SCPI subset
+# used by the scripts in this repository, so sweeps can be developed and
+# benchmarked without hardware (see instruments.resource_manager()).
+#
+# Every simulated instrument talks to one shared SimBench, which holds the
+# state of the supply, SMU, DMM, scope and wavegen and the DUTs wired to them:
+#   - PSU channel 1 drives a diode, or a BJT collector when the SMU is on
+#   - the SMU drives the BJT base
+#   - the DMM measures voltage across / current through the PSU's DUT
+#   - the wavegen drives an RC low-pass filter, scope CH1 is its input and
+#     CH2 its output
+# Outputs settle with a first-order time constant and every command pays a
+# configurable latency. time_scale scales all simulated delays and time
+# constants together (1 = realistic, 0 = instant).
+
+THERMAL_VOLTAGE = 0.02585
+POWER_LINE_FREQ = 50
+
+# Instrument kind and *IDN? reply by (USB vendor id, product id)
+MODELS = {
+    ('0x0957', '0x1A07'): ('dmm', 'Agilent Technologies,34461A'),
+    ('0x2A8D', '0x1401'): ('dmm', 'Keysight Technologies,EDU34450A'),
+    ('0x2A8D', '0x1102'): ('psu', 'Keysight Technologies,EDU36311A'),
+    ('0x1AB1', '0x0E11'): ('psu', 'RIGOL TECHNOLOGIES,DP832'),
+    ('0x0957', '0x1799'): ('scope', 'AGILENT TECHNOLOGIES,DSO-X 2012A'),
+    ('0x1AB1', '0x0642'): ('wavegen', 'Rigol Technologies,DG1022Z'),
+}
+
+# The resources the scripts in this repository expect to find
+DEFAULT_RESOURCES = (
+    'USB0::0x0957::0x1A07::MY53202914::INSTR',
+    'USB0::0x2A8D::0x1401::MY12345678::INSTR',
+    'USB0::0x2A8D::0x1102::MY12345678::INSTR',
+    'USB0::0x1AB1::0x0E11::DP8C172001883::INSTR',
+    'USB0::0x0957::0x1799::MY51136625::INSTR',
+    'USB0::0x1AB1::0x0642::DG1ZA220900451::INSTR',
+    'TCPIP0::192.168.2.2::INSTR',
+)
+
+# Seconds per transaction, plus extra time for slow commands (keyed by the
+# normalized command header, see scpi.parse_header())
+DEFAULT_LATENCY = {
+    'write': 0.002,
+    'query': 0.004,
+    'per_kbyte': 0.001,
+    'range_change': 0.02,   # DMM range relays switching and settling
+    'autorange': 0.005,     # extra ranging conversion of every autoranged reading
+    'commands': {
+        '*RST': 0.3,
+        'MEAS:VOLT': 0.1,   # function/range/NPLC reconfiguration + autorange
+        'MEAS:CURR': 0.1,
+        'CONF:VOLT': 0.03,
+        'CONF:CURR': 0.03,
+        'FUNC': 0.01,
+        'AUT': 2.0,
+        'DIG': 0.05,
+        'MEAS:VAMP': 0.02,
+        'MEAS:PHAS': 0.02,
+        'TRAC:DATA': 0.1,
+    },
+}
+
+
+# Ranges the reading noise and zero drift are specified on
+DMM_REFERENCE_RANGE = {'VOLT': 10.0, 'CURR': 1.0}
+
+
+def dmm_defaults():
+    return {'range': 'AUTO', 'auto_range': None, 'nplc': 10, 'aperture': None, 'autozero': 'ON'}
+
+
+# Smallest DMM range that holds value (the meter reads up to 120% of a range)
+def range_for(function, value):
+    return next((r for r in DMM_RANGES[function] if abs(value) <= 1.2 * r), DMM_RANGES[function][-1])
+
+
+def parse_bool(value):
+    return value.strip().upper() in ('1', 'ON')
+
+
+# A value that approaches its setpoint exponentially
+class FirstOrder:
+    def __init__(self, value=0.0, tau=0.0):
+        self.tau = tau
+        self.start = value
+        self.target = value
+        self.changed = time.monotonic()
+
+    def set(self, target):
+        self.start = self.value()
+        self.target = target
+        self.changed = time.monotonic()
+
+    def value(self):
+        if self.tau <= 0:
+            return self.target
+        elapsed = time.monotonic() - self.changed
+        return self.target + (self.start - self.target) * math.exp(-elapsed / self.tau)
+
+
+# DUT models
+
+class Diode:
+    def __init__(self, saturation_current=1e-12, ideality=1.8, series_resistance=0.5):
+        self.saturation_current = saturation_current
+        self.ideality = ideality
+        self.series_resistance = series_resistance
+
+    def voltage(self, current):
+        nvt = self.ideality * THERMAL_VOLTAGE
+        return nvt * math.log(current / self.saturation_current + 1) + current * self.series_resistance
+
+    def current(self, voltage):
+        nvt = self.ideality * THERMAL_VOLTAGE
+        if voltage <= 0 or self.series_resistance <= 0:
+            return self.saturation_current * (math.exp(min(voltage / nvt, 700)) - 1)
+        # I = Is * (exp((V - I*Rs) / nVt) - 1) has exactly one root in [0, V/Rs]
+        low, high = 0.0, voltage / self.series_resistance
+        for _ in range(100):
+            mid = (low + high) / 2
+            if self.saturation_current * (math.exp(min((voltage - mid * self.series_resistance) / nvt, 700)) - 1) > mid:
+                low = mid
+            else:
+                high = mid
+        return (low + high) / 2
+
+
+class Bjt:
+    def __init__(self, beta=150, early_voltage=80, knee_voltage=0.15, leakage=1e-9):
+        self.beta = beta
+        self.early_voltage = early_voltage
+        self.knee_voltage = knee_voltage
+        self.leakage = leakage
+
+    def collector_current(self, base_current, vce):
+        if vce <= 0:
+            return 0.0
+        active = self.beta * base_current * (1 + vce / self.early_voltage) + self.leakage
+        return active * (1 - math.exp(-vce / self.knee_voltage))
+
+    # VCE at which the collector current equals `current` (used in current limit)
+    def vce_at(self, base_current, current, vce_max):
+        low, high = 0.0, vce_max
+        for _ in range(60):
+            mid = (low + high) / 2
+            if self.collector_current(base_current, mid) < current:
+                low = mid
+            else:
+                high = mid
+        return (low + high) / 2
+
+
+class RcFilter:
+    def __init__(self, cutoff=5000.0):
+        self.cutoff = cutoff
+
+    def response(self, freq):
+        return 1 / (1 + 1j * np.asarray(freq) / self.cutoff)
+
+
+class SimBench:
+    def __init__(self, diode=None, bjt=None, network=None, time_scale=1.0,
+                 tau=0.02, scope_tau=0.05, noise=None, seed=None):
+        self.diode = diode if diode is not None else Diode()
+        self.bjt = bjt if bjt is not None else Bjt()
+        self.network = network if network is not None else RcFilter()
+        self.time_scale = time_scale
+        self.tau = tau
+        self.scope_tau = scope_tau
+        # Reading noise at 1 NPLC on the 10 V and 1 A ranges; it scales with the
+        # range and with 1/sqrt(integration time)
+        self.noise = noise if noise is not None else {'VOLT': 2e-5, 'CURR': 2e-7}
+        # Offset error that builds up with autozero OFF (same ranges)
+        self.zero_drift = {'VOLT': 1e-5, 'CURR': 1e-7}
+        self.rng = np.random.default_rng(seed)
+        for kind in ('psu', 'smu', 'dmm', 'scope', 'wavegen'):
+            self.reset(kind)
+
+    def sleep(self, seconds):
+        if seconds > 0 and self.time_scale > 0:
+            time.sleep(seconds * self.time_scale)
+
+    def reset(self, kind):
+        tau = self.tau * self.time_scale
+        if kind == 'psu':
+            self.psu = {channel: {'volt': FirstOrder(0.0, tau), 'curr': 1.0, 'output': False,
+                                  'mode': 'FIX', 'list': {}, 'initiated': False}
+                        for channel in (1, 2, 3)}
+        elif kind == 'smu':
+            self.smu = {'volt': 0.0, 'curr': FirstOrder(0.0, tau), 'output': False}
+        elif kind == 'dmm':
+            self.dmm = {'function': 'VOLT', 'settings': {function: dmm_defaults() for function in ('VOLT', 'CURR')},
+                        'sample_count': 1, 'trigger_count': 1, 'trigger_source': 'IMM',
+                        'trigger_delay': 0.0, 'armed': False, 'buffer': [],
+                        'format': 'ASC', 'byte_order': 'NORM'}
+        elif kind == 'scope':
+            self.scope = {'scale': {1: 1.0, 2: 1.0}, 'coupling': {1: 'DC', 2: 'DC'},
+                          'timebase': 1e-3, 'points': 1000, 'points_mode': 'NORM', 'source': 1,
+                          'frozen': None}
+        elif kind == 'wavegen':
+            self.wavegen = {'shape': 'SIN', 'amplitude': 5.0, 'offset': 0.0, 'freq': 1000.0,
+                            'output': False, 'arb': None,
+                            'response': FirstOrder(0.0, self.scope_tau * self.time_scale)}
+
+    # Circuit state at PSU channel 1: (voltage across DUT, current through DUT)
+    def solve(self):
+        channel = self.psu[1]
+        source = channel['volt'].value() if channel['output'] else 0.0
+        limit = channel['curr']
+        if self.smu['output']:
+            base_current = self.smu['curr'].value() if self.smu['volt'] >= 0.5 else 0.0
+            current = self.bjt.collector_current(base_current, source)
+            if current > limit:
+                return self.bjt.vce_at(base_current, limit, source), limit
+            return source, current
+        current = self.diode.current(source)
+        if current > limit:
+            return self.diode.voltage(limit), limit
+        return source, current
+
+    # STATus:OPERation:CONDition? of a PSU channel: CV or CC bit (E36300
+    # layout), 0 with the output off. Only channel 1 drives a DUT.
+    def psu_status(self, channel):
+        if not self.psu[channel]['output']:
+            return 0
+        if channel == 1 and self.solve()[1] >= self.psu[1]['curr']:
+            return CC_BIT
+        return CV_BIT
+
+    # One DMM reading of the active function, including noise and overload
+    def dmm_reading(self):
+        function = self.dmm['function']
+        settings = self.dmm['settings'][function]
+        voltage, current = self.solve()
+        value = voltage if function == 'VOLT' else current
+        auto = settings['range'] == 'AUTO'
+        if auto:
+            selected = range_for(function, value)
+            self.sleep(DEFAULT_LATENCY['autorange'])
+        else:
+            selected = settings['range']
+        integration = settings['aperture'] if settings['aperture'] is not None else settings['nplc'] / POWER_LINE_FREQ
+        while True:
+            relative = selected / DMM_REFERENCE_RANGE[function]
+            reading = value + self.rng.normal(0, self.noise[function] * relative / math.sqrt(integration * POWER_LINE_FREQ))
+            if settings['autozero'] == 'OFF':
+                reading += self.zero_drift[function] * relative
+            if abs(reading) <= 1.2 * selected:
+                break
+            # Autoranging steps up a range on overload; a fixed range reports it
+            larger = [r for r in DMM_RANGES[function] if r > selected]
+            if not auto or not larger:
+                return OVERLOAD
+            selected = larger[0]
+        if auto and selected != settings['auto_range']:
+            self.sleep(DEFAULT_LATENCY['range_change'])
+            settings['auto_range'] = selected
+        # Autozero takes a second (zero) conversion for every reading
+        self.sleep(integration * (2 if settings['autozero'] == 'ON' else 1))
+        return reading
+
+    def dmm_init(self):
+        self.dmm['buffer'] = []
+        if self.dmm['trigger_source'] == 'EXT':
+            self.dmm['armed'] = True
+            return
+        for _ in range(self.dmm['trigger_count']):
+            self.sleep(self.dmm['trigger_delay'])
+            for _ in range(self.dmm['sample_count']):
+                self.dmm['buffer'].append(self.dmm_reading())
+
+    # Step every initiated list, triggering the DMM at the start of each step
+    def psu_trigger(self):
+        for channel in self.psu.values():
+            if not channel['initiated']:
+                continue
+            points = channel['list']
+            voltages = points.get('VOLT', [])
+            for i, voltage in enumerate(voltages):
+                channel['volt'].set(voltage)
+                if 'CURR' in points:
+                    channel['curr'] = points['CURR'][min(i, len(points['CURR']) - 1)]
+                dwell = points.get('DWEL', [0.0])
+                dwell = dwell[min(i, len(dwell) - 1)]
+                delay = 0.0
+                if self.dmm['armed'] and len(self.dmm['buffer']) < self.dmm['trigger_count']:
+                    delay = self.dmm['trigger_delay']
+                    self.sleep(delay)
+                    for _ in range(self.dmm['sample_count']):
+                        self.dmm['buffer'].append(self.dmm_reading())
+                self.sleep(max(dwell - delay, 0.0))
+            channel['initiated'] = False
+        self.dmm['armed'] = False
+
+    # Scope signals
+
+    def channel_amplitude(self, channel):
+        wavegen = self.wavegen
+        if not wavegen['output']:
+            return 0.0
+        if wavegen['shape'] == 'ARB' and wavegen['arb'] is not None:
+            x, y = self.arb_periods()
+            return float(np.ptp(x if channel == 1 else y))
+        if channel == 1:
+            return wavegen['amplitude']
+        return wavegen['amplitude'] * abs(wavegen['response'].value())
+
+    def vamp(self, channel):
+        scale = self.scope['scale'][channel]
+        amplitude = self.channel_amplitude(channel) + abs(self.rng.normal(0, 0.02 * scale))
+        if amplitude > 8.2 * scale:
+            return OVERLOAD   # clipped
+        return amplitude
+
+    def phase(self):
+        wavegen = self.wavegen
+        if not wavegen['output'] or 10 * self.scope['timebase'] * wavegen['freq'] < 1:
+            return OVERLOAD
+        for channel in (1, 2):
+            if self.vamp(channel) >= OVERLOAD:
+                return OVERLOAD
+        return math.degrees(np.angle(wavegen['response'].value())) + self.rng.normal(0, 0.3)
+
+    def autoscale(self):
+        self.sleep(DEFAULT_LATENCY['commands']['AUT'])
+        for channel in (1, 2):
+            amplitude = self.channel_amplitude(channel)
+            self.scope['scale'][channel] = max(amplitude / 5, 0.001)
+            self.scope['coupling'][channel] = 'DC'
+        self.scope['timebase'] = 2 / (10 * self.wavegen['freq'])
+
+    def set_frequency(self, freq):
+        self.wavegen['freq'] = freq
+        self.wavegen['response'].set(complex(self.network.response(freq)))
+
+    # Stop acquiring: waveform downloads see the signals as they are now until :RUN
+    def freeze(self):
+        frozen = dict(self.wavegen)
+        frozen['response'] = FirstOrder(self.wavegen['response'].value())
+        self.scope['frozen'] = frozen
+
+    # One period of the arbitrary waveform at the filter input and output
+    def arb_periods(self, wavegen=None):
+        wavegen = wavegen if wavegen is not None else self.wavegen
+        wave = wavegen['arb'] * wavegen['amplitude'] / 2
+        spectrum = np.fft.rfft(wave)
+        harmonics = np.arange(len(spectrum)) * wavegen['freq']
+        return wave, np.fft.irfft(spectrum * self.network.response(harmonics), len(wave))
+
+    def waveform(self, channel, t):
+        wavegen = self.scope['frozen'] or self.wavegen
+        if not wavegen['output']:
+            signal = np.zeros_like(t)
+        elif wavegen['shape'] == 'ARB' and wavegen['arb'] is not None:
+            periods = self.arb_periods(wavegen)[channel - 1]
+            index = ((t * wavegen['freq']) % 1 * len(periods)).astype(int)
+            signal = periods[index]
+        else:
+            h = 1.0 if channel == 1 else wavegen['response'].value()
+            signal = wavegen['amplitude'] / 2 * abs(h) * np.sin(2 * np.pi * wavegen['freq'] * t + np.angle(h))
+        return signal + self.rng.normal(0, 0.01 * self.scope['scale'][channel], len(t))
+
+
+class SimInstrument:
+    def __init__(self, bench, resource_name, kind, idn, latency=None):
+        self.bench = bench
+        self.resource_name = resource_name
+        self.kind = kind
+        self.idn = idn
+        self.latency = latency if latency is not None else DEFAULT_LATENCY
+        self.timeout = 2000
+        self.read_termination = '\n'
+        self.write_termination = '\n'
+        self.responses = []
+        self.errors = []
+
+    def sleep(self, seconds):
+        self.bench.sleep(seconds)
+
+    # pyvisa interface
+
+    def write(self, message):
+        self.sleep(self.latency['write'])
+        replies = []
+        for command in message.split(';'):
+            if command.strip():
+                reply = self.execute(command.strip())
+                if reply is not None:
+                    replies.append(reply)
+        if replies:
+            if all(isinstance(reply, bytes) for reply in replies):
+                self.responses.append(b''.join(replies))
+            else:
+                self.responses.append(';'.join(str(reply) for reply in replies))
+        return len(message)
+
+    def read_raw(self):
+        if not self.responses:
+            # A query the instrument did not answer: wait out the timeout
+            self.sleep(self.timeout / 1000)
+            raise pyvisa.errors.VisaIOError(StatusCode.error_timeout)
+        response = self.responses.pop(0)
+        if isinstance(response, str):
+            response = (response + self.read_termination).encode()
+        self.sleep(self.latency['per_kbyte'] * len(response) / 1024)
+        return response
+
+    def read(self):
+        return self.read_raw().decode().rstrip(self.read_termination)
+
+    def query(self, message):
+        self.sleep(self.latency['query'] - self.latency['write'])
+        self.write(message)
+        return self.read()
+
+    def query_ascii_values(self, message, converter='f', separator=',', container=list):
+        values = [float(value) for value in self.query(message).split(separator) if value.strip()]
+        return container(values)
+
+    # IEEE 488.2 definite length blocks only ('#<digits><length><data>')
+    def query_binary_values(self, message, datatype='f', is_big_endian=False, container=list, **kwargs):
+        self.sleep(self.latency['query'] - self.latency['write'])
+        self.write(message)
+        raw = self.read_raw()
+        digits = int(raw[1:2])
+        length = int(raw[2:2 + digits])
+        values = np.frombuffer(raw[2 + digits:2 + digits + length], ('>' if is_big_endian else '<') + datatype)
+        return container(values)
+
+    def clear(self):
+        self.responses = []
+
+    def close(self):
+        pass
+
+    # SCPI
+
+    def error(self, code, message):
+        self.errors.append(f'{code},"{message}"')
+
+    def execute(self, command):
+        # Channel lists: "(@1)", "@1" or the header suffix (SOURce1, OUTPut1)
+        path, suffix, channel, args, is_query = parse_command(command)
+
+        extra = self.latency['commands'].get(':'.join(path[:2]), self.latency['commands'].get(path[0] if path else '', 0))
+        self.sleep(extra)
+
+        handler = getattr(self, 'do_' + self.kind_for(path, channel, suffix))
+        try:
+            reply = self.common(path, args, is_query)
+            if reply is NotImplemented:
+                reply = handler(path, args, is_query, channel if channel is not None else suffix)
+        except (ValueError, IndexError, KeyError):
+            self.error(-224, 'Illegal parameter value')
+            return None
+        if reply is NotImplemented:
+            self.error(-113, 'Undefined header')
+            return None
+        # Only queries put anything in the output queue
+        return reply if is_query else None
+
+    # Which simulated subsystem a command goes to. The BJT example opens the
+    # same address for the PSU, DMM and SMU, so source commands without a
+    # channel go to the SMU unless the instrument itself is a supply.
+    def kind_for(self, path, channel, suffix):
+        if self.kind in ('scope', 'wavegen'):
+            return self.kind
+        if not path:
+            return 'dmm'
+        if path[0] in ('VOLT', 'CURR', 'OUTP'):
+            if len(path) > 1 and path[1] in ('NPLC', 'RANG', 'ZERO', 'APER'):
+                return 'dmm'
+            if self.kind == 'psu' or channel is not None or suffix is not None:
+                return 'psu'
+            return 'smu'
+        if path[0] in ('LIST', 'DIG'):
+            return 'psu'
+        if path[0] == 'STAT' and (self.kind == 'psu' or channel is not None):
+            return 'psu'
+        if path[0] in ('INIT', 'TRIG'):
+            return 'psu' if channel is not None else 'dmm'
+        return 'dmm'
+
+    def common(self, path, args, is_query):
+        if path == ('*IDN',):
+            serial = self.resource_name.split('::')[3] if self.resource_name.count('::') >= 4 else '0'
+            return f'{self.idn},{serial},1.0'
+        if path == ('*RST',):
+            self.bench.reset(self.kind if self.kind != 'bench' else 'dmm')
+        elif path == ('*OPC',):
+            return '1'
+        elif path == ('*CLS',):
+            self.errors = []
+        elif path == ('*TRG',):
+            self.bench.psu_trigger()
+        elif path == ('SYST', 'ERR'):
+            return self.errors.pop(0) if self.errors else '+0,"No error"'
+        elif path != ('*WAI',):
+            return NotImplemented
+        return None
+
+    def do_psu(self, path, args, is_query, channel):
+        state = self.bench.psu[channel or 1]
+        if path == ('VOLT',):
+            if is_query:
+                return f'{state["volt"].target:g}'
+            state['volt'].set(float(args[0]))
+        elif path == ('CURR',):
+            if is_query:
+                return f'{state["curr"]:g}'
+            state['curr'] = float(args[0])
+        elif path == ('OUTP',):
+            if is_query:
+                return '1' if state['output'] else '0'
+            state['output'] = parse_bool(args[0])
+        elif path in (('VOLT', 'MODE'), ('CURR', 'MODE')):
+            state['mode'] = args[0].upper()[:4]
+        elif path[0] == 'LIST':
+            if path[1] in ('VOLT', 'CURR', 'DWEL'):
+                state['list'][path[1]] = [float(arg) for arg in args]
+        elif path == ('INIT',):
+            state['initiated'] = state['mode'] == 'LIST'
+        elif path[0] in ('TRIG', 'DIG'):
+            pass
+        elif path == ('STAT', 'OPER', 'COND') and is_query:
+            return str(self.bench.psu_status(channel or 1))
+        else:
+            return NotImplemented
+        return None
+
+    def do_smu(self, path, args, is_query, channel):
+        state = self.bench.smu
+        if path == ('VOLT',):
+            if is_query:
+                return f'{state["volt"]:g}'
+            state['volt'] = float(args[0])
+        elif path == ('CURR',):
+            if is_query:
+                return f'{state["curr"].target:g}'
+            state['curr'].set(float(args[0]))
+        elif path == ('OUTP',):
+            if is_query:
+                return '1' if state['output'] else '0'
+            state['output'] = parse_bool(args[0])
+        else:
+            return NotImplemented
+        return None
+
+    def do_dmm(self, path, args, is_query, channel):
+        dmm = self.bench.dmm
+        if path[0] in ('MEAS', 'CONF') and len(path) > 1 and path[1] in ('VOLT', 'CURR'):
+            dmm['function'] = path[1]
+            # CONF and MEAS both restore the default integration time and autozero
+            settings = dmm['settings'][path[1]] = dmm_defaults()
+            if args and args[0].upper() not in ('AUTO', 'DEF'):
+                settings['range'] = range_for(path[1], float(args[0]))
+            if path[0] == 'CONF':
+                return None
+            return self.dmm_readings([self.bench.dmm_reading()])
+        if len(path) >= 2 and path[0] in ('VOLT', 'CURR') and path[1] in ('NPLC', 'RANG', 'ZERO', 'APER'):
+            return self.dmm_setting(dmm['settings'][path[0]], path[0], path[1:], args, is_query)
+        if path == ('FUNC',):
+            if is_query:
+                return f'"{dmm["function"]}"'
+            dmm['function'] = short_form(args[0].strip('"\'').split(':')[0])
+            return None
+        if path == ('READ',):
+            self.bench.dmm_init()
+            return self.dmm_readings(dmm['buffer'])
+        if path == ('INIT',):
+            self.bench.dmm_init()
+            return None
+        if path == ('FETC',):
+            return self.dmm_readings(dmm['buffer'])
+        if path in (('FORM',), ('FORM', 'DATA')):
+            if is_query:
+                return 'REAL,+64' if dmm['format'] == 'REAL' else 'ASC,+9'
+            dmm['format'] = short_form(args[0])[:4]
+            return None
+        if path == ('FORM', 'BORD'):
+            dmm['byte_order'] = short_form(args[0])
+            return None
+        if path == ('SAMP', 'COUN'):
+            dmm['sample_count'] = int(args[0])
+            return None
+        if path == ('TRIG', 'COUN'):
+            dmm['trigger_count'] = int(float(args[0]))
+            return None
+        if path == ('TRIG', 'SOUR'):
+            dmm['trigger_source'] = short_form(args[0])[:3]
+            return None
+        if path == ('TRIG', 'DEL'):
+            dmm['trigger_delay'] = float(args[0])
+            return None
+        if path == ('TRIG', 'SLOP'):
+            return None
+        return NotImplemented
+
+    def dmm_setting(self, settings, function, path, args, is_query):
+        if path == ('NPLC',):
+            if is_query:
+                return f'{settings["nplc"]:g}'
+            settings['nplc'] = float(args[0])
+            settings['aperture'] = None
+        elif path == ('RANG',):
+            if is_query:
+                return f'{settings["range"] if settings["range"] != "AUTO" else settings["auto_range"] or 0:g}'
+            selected = range_for(function, float(args[0]))
+            if selected != settings['range']:
+                self.sleep(self.latency.get('range_change', DEFAULT_LATENCY['range_change']))
+            settings['range'] = selected
+        elif path == ('RANG', 'AUTO'):
+            if is_query:
+                return '1' if settings['range'] == 'AUTO' else '0'
+            if parse_bool(args[0]):
+                settings['range'] = 'AUTO'
+            elif settings['range'] == 'AUTO':
+                settings['range'] = settings['auto_range'] or DMM_RANGES[function][-1]
+        elif path == ('ZERO', 'AUTO'):
+            if is_query:
+                return '1' if settings['autozero'] == 'ON' else '0'
+            mode = args[0].upper()
+            if mode == 'ONCE':
+                # One zero conversion now, then autozero stays off (the fresh zero has no drift yet)
+                self.sleep(settings['aperture'] or settings['nplc'] / POWER_LINE_FREQ)
+                settings['autozero'] = 'ONCE'
+            else:
+                settings['autozero'] = 'ON' if parse_bool(mode) else 'OFF'
+        elif path == ('APER',):
+            if is_query:
+                return f'{settings["aperture"] or settings["nplc"] / POWER_LINE_FREQ:g}'
+            settings['aperture'] = float(args[0])
+        elif path == ('APER', 'ENAB'):
+            if is_query:
+                return '1' if settings['aperture'] is not None else '0'
+            if not parse_bool(args[0]):
+                settings['aperture'] = None
+        else:
+            return NotImplemented
+        return None
+
+    # Reading replies in the current FORMat: ASCII, or an IEEE-754 float64 block
+    # (big-endian unless FORM:BORD SWAPped)
+    def dmm_readings(self, values):
+        dmm = self.bench.dmm
+        if dmm['format'] != 'REAL':
+            return ','.join(f'{value:.9E}' for value in values)
+        data = np.asarray(values, dtype='<f8' if dmm['byte_order'] == 'SWAP' else '>f8').tobytes()
+        length = str(len(data))
+        return f'#{len(length)}{length}'.encode() + data + b'\n'
+
+    def do_scope(self, path, args, is_query, channel):
+        scope = self.bench.scope
+        if path[0] == 'CHAN':
+            if path[1] == 'SCAL':
+                if is_query:
+                    return f'{scope["scale"][channel]:.6E}'
+                scope['scale'][channel] = float(args[0])
+            elif path[1] == 'COUP':
+                scope['coupling'][channel] = short_form(args[0])
+            elif path[1] not in ('DISP', 'OFFS'):
+                return NotImplemented
+            return None
+        if path == ('TIM', 'SCAL'):
+            if is_query:
+                return f'{scope["timebase"]:.6E}'
+            scope['timebase'] = float(args[0])
+            return None
+        if path == ('AUT',):
+            self.bench.autoscale()
+            return None
+        if path == ('MEAS', 'VAMP'):
+            source = int(re.sub(r'\D', '', args[0])) if args else 1
+            return f'{self.bench.vamp(source):.6E}'
+        if path == ('MEAS', 'PHAS'):
+            return f'{self.bench.phase():.6E}'
+        if path[0] == 'WAV':
+            return self.waveform_command(path[1:], args, is_query)
+        if path in (('DIG',), ('SING',), ('STOP',)):
+            self.bench.freeze()
+            return None
+        if path == ('RUN',):
+            scope['frozen'] = None
+            return None
+        if path == ('TIM', 'POS'):
+            return None
+        return NotImplemented
+
+    def waveform_command(self, path, args, is_query):
+        scope = self.bench.scope
+        if path == ('SOUR',):
+            scope['source'] = int(re.sub(r'\D', '', args[0]))
+        elif path == ('POIN', 'MODE'):
+            scope['points_mode'] = short_form(args[0])
+        elif path == ('POIN',):
+            scope['points'] = int(args[0]) if args[0].isdigit() else 100000
+        elif path in (('FORM',), ('BYT',), ('UNS',)):
+            pass
+        elif path in (('PRE',), ('DATA',)):
+            limit = 1000 if scope['points_mode'] == 'NORM' else 100000
+            points = min(scope['points'], limit)
+            x_inc = 10 * scope['timebase'] / points
+            x_origin = -5 * scope['timebase']
+            y_inc = 10 * scope['scale'][scope['source']] / 65536
+            if path == ('PRE',):
+                return f'+1,+0,+{points},+1,{x_inc:.6E},{x_origin:.6E},+0,{y_inc:.6E},+0.0E+00,+0'
+            t = np.arange(points) * x_inc + x_origin
+            codes = np.clip(np.round(self.bench.waveform(scope['source'], t) / y_inc), -32768, 32767)
+            data = codes.astype('<i2').tobytes()
+            header = f'#8{len(data):08d}'.encode()
+            return header + data + b'\n'
+        else:
+            return NotImplemented
+        return None
+
+    def do_wavegen(self, path, args, is_query, channel):
+        wavegen = self.bench.wavegen
+        if path == ('FUNC', 'SHAP'):
+            wavegen['shape'] = short_form(args[0])[:3]
+        elif path == ('VOLT',):
+            wavegen['amplitude'] = float(args[0])
+        elif path == ('VOLT', 'OFFS'):
+            wavegen['offset'] = float(args[0])
+        elif path == ('FREQ',):
+            if is_query:
+                return f'{wavegen["freq"]:.6E}'
+            self.bench.set_frequency(float(args[0]))
+        elif path == ('OUTP',):
+            if is_query:
+                return 'ON' if wavegen['output'] else 'OFF'
+            wavegen['output'] = parse_bool(args[0])
+        elif path == ('TRAC', 'DATA'):
+            wavegen['arb'] = np.array([float(arg) for arg in args[1:]])
+            wavegen['shape'] = 'ARB'
+        else:
+            return NotImplemented
+        return None
+
+
+class SimResourceManager:
+    def __init__(self, bench=None, resources=DEFAULT_RESOURCES, time_scale=1.0, latency=None):
+        self.bench = bench if bench is not None else SimBench(time_scale=time_scale)
+        self.resources = tuple(resources)
+        self.latency = latency
+
+    def list_resources(self, query='?*::INSTR'):
+        return self.resources
+
+    def open_resource(self, resource_name, **kwargs):
+        if resource_name not in self.resources:
+            raise pyvisa.errors.VisaIOError(StatusCode.error_resource_not_found)
+        fields = resource_name.split('::')
+        kind, idn = MODELS.get(tuple(fields[1:3]), ('bench', 'Simulated,Bench'))
+        instrument = SimInstrument(self.bench, resource_name, kind, idn, self.latency)
+        for name, value in kwargs.items():
+            setattr(instrument, name, value)
+        self.bench.sleep(0.05)   # opening a session is not free either
+        return instrument
+
+    def close(self):
+        pass
@@ -0,0 +1,289 @@
+import queue
+import threading
+import time
+
+import numpy as np
+
+from async_instruments import reset_all
+from bjt_analysis import bjt_curves, extract_bjt_parameters
+from instruments import resource_manager
+from limit_test import LimitTest, bjt_limit_masks, in_current_limit
+from measurement import DmmMeasurement
+from settle import wait_for_settle
+
+# Multi-station BJT characterization
+# Each Station is one bench with its own PSU, DMM and SMU. A single address can
+# fill several roles, as in BJT_curve_example.py. StationScheduler gives every
+# station its own worker thread. Each worker takes the next DUT from a shared
+# queue, so a fast station simply measures more parts. pyvisa releases the GIL
+# while it waits on the bus, so threads scale with the number of stations.
+#
+# Failures stay inside their station:
+#   - An exception (VISA timeout, bad reading, ...) marks that DUT as 'error'
+#     and the station moves on. After max_failures errors in a row the station
+#     is retired.
+#   - A DUT still running after dut_timeout seconds is marked 'timeout' and its
+#     station is abandoned. The other stations keep working. The blocked thread
+#     is a daemon, so it cannot keep the process alive.
+#   - DUTs left over once every station is out of service are 'skipped'.
+#
+#   stations = [Station('bench1', psu1, dmm1, smu1), Station('bench2', psu2, dmm2, smu2)]
+#   results = StationScheduler(stations, dut_timeout=300).run(['Q1', 'Q2', 'Q3'])
+#   dataset = combine(results)
+
+
+class Station:
+    # rm defaults to instruments.resource_manager(), so BENCH_SIM works here too
+    def __init__(self, name, psu, dmm, smu, rm=None, timeout=5000):
+        self.name = name
+        self.resource_names = {'psu': psu, 'dmm': dmm, 'smu': smu}
+        self.rm = rm
+        self.timeout = timeout
+        self.instruments = None
+
+    # Open every address once and hand the same session to each role using it
+    def open(self):
+        if self.rm is None:
+            self.rm = resource_manager()
+        sessions = {}
+        for resource_name in self.resource_names.values():
+            if resource_name not in sessions:
+                sessions[resource_name] = self.rm.open_resource(resource_name)
+                sessions[resource_name].timeout = self.timeout
+        self.instruments = {role: sessions[name] for role, name in self.resource_names.items()}
+        reset_all(*sessions.values())
+        return self.instruments
+
+    def close(self):
+        if self.instruments is None:
+            return
+        for instrument in {id(i): i for i in self.instruments.values()}.values():
+            try:
+                instrument.close()
+            except Exception:
+                pass
+        self.instruments = None
+
+
+class DutResult:
+    def __init__(self, dut, station=None, status='skipped', data=None, error=None, elapsed=0.0):
+        self.dut = dut
+        self.station = station
+        self.status = status    # 'ok', 'error', 'timeout' or 'skipped'
+        self.data = data        # whatever measure() returned
+        self.error = error
+        self.elapsed = elapsed
+
+    def __repr__(self):
+        return f'DutResult({self.dut!r}, station={self.station!r}, status={self.status!r})'
+
+
+# Output curves of one transistor, as measured by BJT_curve_example.py (grouped
+# DMM readings, settled instead of fixed delays). Both outputs are always
+# switched off again, even if the sweep fails.
+# Returns arrays with one row per base current.
+def characterize_bjt(psu, dmm, smu, ib_values_microamps=(0, 10, 50, 100), vce_values=None,
+                     v_be=0.7, collector_current_limit=0.5, nplc=1, settle_timeout=0.5):
+    if vce_values is None:
+        vce_values = np.round(np.arange(0.0, 10.0 + 0.1, 0.2), 1)
+    ib_values_microamps = np.asarray(ib_values_microamps, dtype=float)
+    vce_values = np.asarray(vce_values, dtype=float)
+    meter = DmmMeasurement(dmm, nplc=nplc, ranges={'VOLT': 10, 'CURR': 1})
+    settle = lambda read: wait_for_settle(read, tolerance=1e-3, timeout=settle_timeout)
+    vce = np.empty((len(ib_values_microamps), len(vce_values)))
+    ic = np.empty_like(vce)
+
+    smu.write("SOUR:CURR:LEV:IMM:AMP 0.0")
+    smu.write("SOUR:VOLT:LEV:IMM:AMP 0.0")
+    smu.write("OUTP:STAT ON")
+    psu.write("SOUR:CURR:LEV:IMM:AMP 0.0 @1")
+    psu.write("SOUR:VOLT:LEV:IMM:AMP 0.0 @1")
+    psu.write("OUTP:STAT ON @1")
+    try:
+        for row, ib_microamps in enumerate(ib_values_microamps):
+            smu.write(f"SOUR:VOLT:LEV:IMM:AMP {v_be if ib_microamps else 0.0}")
+            smu.write(f"SOUR:CURR:LEV:IMM:AMP {ib_microamps * 1e-6}")
+            psu.write(f"SOUR:CURR:LEV:IMM:AMP {collector_current_limit} @1")
+            grouped = meter.sweep_grouped(vce_values, lambda v: psu.write(f"SOUR:VOLT:LEV:IMM:AMP {v} @1"),
+                                          ('VOLT', 'CURR'), settle=settle)
+            vce[row], ic[row] = grouped['VOLT'], grouped['CURR']
+    finally:
+        smu.write("OUTP:STAT OFF")
+        psu.write("OUTP:STAT OFF @1")
+    return {'ib_microamps': ib_values_microamps, 'vce_set': vce_values, 'vce': vce, 'ic': ic}
+
+
+# Production screen of one transistor with the limit test of
+# BJT_curve_example.py: points are measured one at a time, each curve stops as
+# soon as it has passed or failed, and the DUT stops at its first failing
+# curve. Points that were skipped are NaN. Adds 'outcome' ('pass' or 'fail')
+# and 'reasons' (one per curve tested) to the arrays of characterize_bjt().
+def screen_bjt(psu, dmm, smu, ib_values_microamps=(0, 10, 50, 100), vce_values=None, v_be=0.7,
+               collector_current_limit=0.5, nplc=1, settle_timeout=0.5, limit_vce=5.0,
+               beta_limits=(100.0, 300.0), leakage_limit=1e-6):
+    if vce_values is None:
+        vce_values = np.round(np.arange(0.0, 10.0 + 0.1, 0.2), 1)
+    ib_values_microamps = np.asarray(ib_values_microamps, dtype=float)
+    vce_values = np.asarray(vce_values, dtype=float)
+    meter = DmmMeasurement(dmm, nplc=nplc, ranges={'VOLT': 10, 'CURR': 1})
+    vce = np.full((len(ib_values_microamps), len(vce_values)), np.nan)
+    ic = np.full_like(vce, np.nan)
+    outcome, reasons = 'pass', []
+
+    smu.write("SOUR:CURR:LEV:IMM:AMP 0.0")
+    smu.write("SOUR:VOLT:LEV:IMM:AMP 0.0")
+    smu.write("OUTP:STAT ON")
+    psu.write("SOUR:CURR:LEV:IMM:AMP 0.0 @1")
+    psu.write("SOUR:VOLT:LEV:IMM:AMP 0.0 @1")
+    psu.write("OUTP:STAT ON @1")
+    try:
+        for row, ib_microamps in enumerate(ib_values_microamps):
+            smu.write(f"SOUR:VOLT:LEV:IMM:AMP {v_be if ib_microamps else 0.0}")
+            smu.write(f"SOUR:CURR:LEV:IMM:AMP {ib_microamps * 1e-6}")
+            psu.write(f"SOUR:CURR:LEV:IMM:AMP {collector_current_limit} @1")
+            test = LimitTest(bjt_limit_masks(ib_microamps * 1e-6, vce_values, limit_vce, beta_limits, leakage_limit))
+            for column, value in enumerate(vce_values):
+                psu.write(f"SOUR:VOLT:LEV:IMM:AMP {value} @1")
+                vce[row, column] = wait_for_settle(lambda: meter.read('VOLT'), tolerance=1e-3,
+                                                   timeout=settle_timeout)
+                ic[row, column] = meter.read('CURR')
+                if test.check(column, ic[row, column], in_current_limit(psu, 1)) is not None:
+                    break
+            reasons.append(f'IB = {ib_microamps:g} uA: {test.finish()}, {test.reason}')
+            if test.outcome != 'pass':
+                outcome = 'fail'
+                break
+    finally:
+        smu.write("OUTP:STAT OFF")
+        psu.write("OUTP:STAT OFF @1")
+    return {'ib_microamps': ib_values_microamps, 'vce_set': vce_values, 'vce': vce, 'ic': ic,
+            'outcome': outcome, 'reasons': reasons}
+
+
+class StationScheduler:
+    # measure(psu, dmm, smu) measures the DUT currently in a station.
+    # load(station, dut), if given, runs first, e.g. to wait for a handler to
+    # insert the part.
+    def __init__(self, stations, measure=characterize_bjt, load=None, dut_timeout=None, max_failures=2):
+        self.stations = list(stations)
+        self.measure = measure
+        self.load = load
+        self.dut_timeout = dut_timeout
+        self.max_failures = max_failures
+
+    def worker(self, station, pending, events, abandoned):
+        try:
+            instruments = station.open()
+        except Exception as error:
+            events.put(('retired', station, error))
+            return
+        failures = 0
+        try:
+            while failures < self.max_failures and not abandoned.is_set():
+                try:
+                    index, dut = pending.get_nowait()
+                except queue.Empty:
+                    break
+                start = time.perf_counter()
+                events.put(('start', station, (index, dut, start)))
+                try:
+                    if self.load is not None:
+                        self.load(station, dut)
+                    data = self.measure(instruments['psu'], instruments['dmm'], instruments['smu'])
+                    result = DutResult(dut, station.name, 'ok', data)
+                    failures = 0
+                except Exception as error:
+                    result = DutResult(dut, station.name, 'error', error=error)
+                    failures += 1
+                result.elapsed = time.perf_counter() - start
+                events.put(('done', station, (index, result)))
+        finally:
+            station.close()
+        events.put(('retired', station, None))
+
+    # Measure every DUT and return one DutResult per DUT, in queue order
+    def run(self, duts):
+        duts = list(duts)
+        pending = queue.Queue()
+        for index, dut in enumerate(duts):
+            pending.put((index, dut))
+        events = queue.Queue()
+        abandoned = {station.name: threading.Event() for station in self.stations}
+        for station in self.stations:
+            threading.Thread(target=self.worker, args=(station, pending, events, abandoned[station.name]),
+                             name=f'station-{station.name}', daemon=True).start()
+
+        results = [None] * len(duts)
+        running = {}    # station name -> (index, dut, start)
+        active = len(self.stations)
+        while active and any(result is None for result in results):
+            try:
+                kind, station, payload = events.get(timeout=0.1)
+            except queue.Empty:
+                kind = None
+            if kind is not None and abandoned[station.name].is_set():
+                continue    # late news from a station that was given up on
+            if kind == 'start':
+                running[station.name] = payload
+            elif kind == 'done':
+                index, result = payload
+                running.pop(station.name, None)
+                results[index] = result
+            elif kind == 'retired':
+                if payload is not None:
+                    print(f"Station {station.name} failed to start: {payload}")
+                active -= 1
+
+            if self.dut_timeout is not None:
+                now = time.perf_counter()
+                for name, (index, dut, start) in list(running.items()):
+                    if now - start > self.dut_timeout:
+                        print(f"Station {name} timed out on DUT {dut!r}, taking it out of service")
+                        results[index] = DutResult(dut, name, 'timeout', elapsed=now - start)
+                        abandoned[name].set()
+                        del running[name]
+                        active -= 1
+
+        for index, dut in enumerate(duts):
+            if results[index] is None:
+                results[index] = DutResult(dut)
+        return results
+
+
+# Stack the 'ok' results into one long-format dataset: one row per measured
+# point, with the DUT and station it came from
+def combine(results):
+    columns = {'dut': [], 'station': [], 'ib_microamps': [], 'vce_set': [], 'vce': [], 'ic': []}
+    for result in results:
+        if result.status != 'ok':
+            continue
+        data = result.data
+        ib, vce_set = np.meshgrid(data['ib_microamps'], data['vce_set'], indexing='ij')
+        columns['dut'].append(np.full(ib.size, str(result.dut), dtype=object))
+        columns['station'].append(np.full(ib.size, result.station, dtype=object))
+        columns['ib_microamps'].append(ib.ravel())
+        columns['vce_set'].append(vce_set.ravel())
+        columns['vce'].append(np.ravel(data['vce']))
+        columns['ic'].append(np.ravel(data['ic']))
+    return {name: np.concatenate(values) if values else np.array([]) for name, values in columns.items()}
+
+
+# Throughput check on the simulated bench: every station gets its own SimBench
+if __name__ == '__main__':
+    from sim_instruments import SimResourceManager
+
+    address = 'USB0::0x0957::0x1A07::MY53202914::INSTR'
+    duts = [f'Q{n}' for n in range(1, 9)]
+    vce_values = np.round(np.arange(0.0, 10.0 + 0.1, 0.5), 1)
+    measure = lambda psu, dmm, smu: characterize_bjt(psu, dmm, smu, vce_values=vce_values, settle_timeout=0.05)
+    for count in (1, 2, 4):
+        stations = [Station(f'bench{n}', address, address, address, rm=SimResourceManager(time_scale=0.1))
+                    for n in range(1, count + 1)]
+        start = time.perf_counter()
+        results = StationScheduler(stations, measure=measure).run(duts)
+        wall = time.perf_counter() - start
+        dataset = combine(results)
+        print(f"{count} station(s): {len(duts)} DUTs in {wall:.2f} s ({len(duts) / wall:.2f} DUT/s), "
+              f"{len(dataset['ic'])} points")
+    parameters = extract_bjt_parameters(*(bjt_curves(dataset)[name] for name in ('ib', 'vce', 'ic')))
+    print(f"beta at 100 uA per DUT: {np.round(parameters['beta'][:, -1], 1)}")